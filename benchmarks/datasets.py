@@ -0,0 +1,218 @@
+"""
+Synthetic datasets of the benchmark suite: drug names, populated databases and HTML pages of every source layout.
+Every dataset is generated from a seed, the same arguments always give the same data.
+"""
+import html
+import random
+
+from database.db_models import DbDrug, DbSource, DbHit
+from database.lawsuit_database import DrugsDb
+
+SYLLABLES = ['ba', 'ce', 'da', 'fen', 'gli', 'hy', 'ka', 'lo', 'mi', 'nex', 'pra', 'qui', 'ro', 'sa', 'tri', 'va',
+             'xa', 'zo', 'lar', 'tel', 'vir', 'mab', 'zol', 'pril']
+GENERIC_SUFFIXES = ['mab', 'pril', 'statin', 'olol', 'azole', 'sartan', 'tinib', 'gliptin']
+SCAN_INTERVAL = 24 * 60 * 60
+FIRST_SCAN_TS = 1500000000
+INSERT_CHUNK = 50000
+
+
+def drug_names(count, seed=0):
+    """
+    Generates distinct drug names, some of them with a generic name in parentheses
+    :param count: number of names
+    :param seed: seed of the generator
+    :return: list of names
+    """
+    rng = random.Random(seed)
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        if rng.random() < 0.2:
+            generic = ''.join(rng.choice(SYLLABLES) for _ in range(2)) + rng.choice(GENERIC_SUFFIXES)
+            name = '{} ({})'.format(name, generic)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def misspell(name, rng):
+    """
+    Swaps two neighbouring letters of the longest word, the way names differ between sources
+    """
+    word = max(name.split(), key=len)
+    if len(word) < 4:
+        return name
+    idx = rng.randrange(1, len(word) - 2)
+    return name.replace(word, word[:idx] + word[idx + 1] + word[idx] + word[idx + 2:], 1)
+
+
+class SyntheticDataset:
+    """
+    Drugs, sources and hits of a database that was scanned many times. Every source lists a window of drugs,
+    windows of neighbouring sources overlap by half. Every drug and source pair has hits_per_pair hits,
+    one per daily scan, so hits table looks like before optimize_hits_table.
+    """
+    def __init__(self, hits, sources=10, hits_per_pair=10, seed=0):
+        """
+        :param hits: number of hits in the hits table
+        :param sources: number of sources
+        :param hits_per_pair: number of scans that found every drug
+        :param seed: seed of the generator
+        """
+        self.hits = hits
+        self.hits_per_pair = hits_per_pair
+        self.seed = seed
+        pairs = max(hits // hits_per_pair, sources)
+        self.per_source = max(pairs // sources, 1)
+        shift = max(self.per_source // 2, 1)
+        self.source_names = ['SyntheticSource{}'.format(idx) for idx in range(sources)]
+        self.drug_names = drug_names((sources - 1) * shift + self.per_source, seed)
+        # positions of drugs listed by every source
+        self.listed = {name: list(range(idx * shift, idx * shift + self.per_source))
+                       for idx, name in enumerate(self.source_names)}
+        self.last_scan_ts = FIRST_SCAN_TS + (hits_per_pair - 1) * SCAN_INTERVAL
+
+    @property
+    def pairs(self):
+        """
+        :return: list of tuples (drug_position, source_position), positions are database IDs minus one
+        """
+        return [(drug, source) for source, name in enumerate(self.source_names) for drug in self.listed[name]]
+
+    def hit_rows(self):
+        """
+        :return: generator of hits table rows
+        """
+        for drug, source in self.pairs:
+            for scan in range(self.hits_per_pair):
+                yield {'drug_id': drug + 1, 'source_id': source + 1, 'hit_ts': FIRST_SCAN_TS + scan * SCAN_INTERVAL}
+
+    def populate(self, db_path, db_name):
+        """
+        Creates database file with the dataset, drug/source summary and n-gram index are rebuilt afterwards
+        :param db_path: directory of the database file
+        :param db_name: name of the database file
+        :return: None
+        """
+        db = DrugsDb(db_name, db_path)
+        db.create_database()
+        with db.session_scope() as session:
+            session.execute(DbDrug.__table__.insert(), [{'id': idx + 1, 'name': name}
+                                                        for idx, name in enumerate(self.drug_names)])
+            session.execute(DbSource.__table__.insert(), [
+                {'id': idx + 1, 'name': name, 'address': 'http://firm{}.example.com/'.format(idx),
+                 'display_name': 'Synthetic Firm {}'.format(idx), 'twitter_name': 'None',
+                 'created_ts': FIRST_SCAN_TS, 'updated_ts': self.last_scan_ts}
+                for idx, name in enumerate(self.source_names)])
+            chunk = []
+            for row in self.hit_rows():
+                chunk.append(row)
+                if len(chunk) == INSERT_CHUNK:
+                    session.execute(DbHit.__table__.insert(), chunk)
+                    chunk = []
+            if chunk:
+                session.execute(DbHit.__table__.insert(), chunk)
+            db.rebuild_summary(session)
+            db.rebuild_ngram_index(session)
+        db.close_db()
+
+    def new_names(self, count):
+        """
+        :return: names of drugs that are not in the dataset
+        """
+        names = set(self.drug_names)
+        return [name for name in drug_names(len(names) + count * 2, self.seed + 1) if name not in names][:count]
+
+    def misspelled_names(self, count):
+        """
+        :return: near-duplicates of drugs in the dataset
+        """
+        rng = random.Random(self.seed)
+        return [misspell(name, rng) for name in rng.sample(self.drug_names, min(count, len(self.drug_names)))]
+
+    def scan_drugs(self, source_name, changed=0.05):
+        """
+        Drugs of the next scan of a source, a fraction of listed drugs is replaced with new drugs
+        :param source_name: name of the source
+        :param changed: fraction of drugs that are removed and added
+        :return: dictionary {'drug_name': 'drug_url'}
+        """
+        positions = self.listed[source_name]
+        kept = positions[:len(positions) - int(len(positions) * changed)]
+        source = self.source_names.index(source_name)
+        names = [self.drug_names[position] for position in kept]
+        names += ['{} {}'.format(name, source) for name in self.new_names(len(positions) - len(kept))]
+        return {name: 'http://firm{}.example.com/{}'.format(source, idx) for idx, name in enumerate(names)}
+
+
+def element(selector, content='', attrs=None):
+    """
+    Renders element matching compiled selector {'name': tag, 'class_': class}
+    """
+    attrs = dict(attrs or {})
+    if 'class_' in selector:
+        attrs['class'] = selector['class_']
+    rendered = ''.join(' {}="{}"'.format(name, html.escape(value)) for name, value in attrs.items())
+    return '<{0}{1}>{2}</{0}>'.format(selector['name'], rendered, content)
+
+
+def synthetic_item(definition, name, link):
+    """
+    Renders element of a single drug the way the source lays it out
+    :param definition: SourceDefinition object
+    :param name: drug name, strip tokens of the source are added
+    :param link: drug link
+    :return: HTML of the item
+    """
+    raw_name = name + (' ' + definition.strip_tokens[0].strip() if definition.strip_tokens else '')
+    if definition.strip:
+        raw_name = ' {} '.format(raw_name)
+    item_attrs = dict()
+    link_attrs = dict()
+    if definition.link_attribute is not None:
+        link_attrs[definition.link_attribute] = link
+    if definition.link_selector is None:
+        item_attrs.update(link_attrs)
+        link_attrs = None
+    name_attrs = {definition.name_attribute: raw_name} if definition.name_attribute else dict()
+    name_text = '' if definition.name_attribute else html.escape(raw_name)
+    if definition.name_selector is None:
+        item_attrs.update(name_attrs)
+        content = name_text
+        if link_attrs is not None:
+            # item text includes text of the link
+            content = element(definition.link_selector, name_text, link_attrs)
+    elif link_attrs is not None and definition.name_selector == definition.link_selector:
+        content = element(definition.name_selector, name_text, dict(name_attrs, **link_attrs))
+    else:
+        content = element(definition.name_selector, name_text, name_attrs)
+        if link_attrs is not None:
+            content += element(definition.link_selector, 'Learn more', link_attrs)
+    item = element(definition.items, content, item_attrs)
+    if definition.items['name'] == 'td':
+        item = '<tr>{}<td>Details</td></tr>'.format(item)
+    return item
+
+
+def synthetic_page(definition, drugs):
+    """
+    Renders page of a source with navigation, drug list and footer
+    :param definition: SourceDefinition object
+    :param drugs: dictionary {'drug_name': 'drug_url'}
+    :return: HTML document as bytes
+    """
+    items = [synthetic_item(definition, name, link) for name, link in drugs.items()]
+    items += [synthetic_item(definition, name, definition.url) for name in sorted(definition.discard)]
+    listing = ''.join(items)
+    if definition.items['name'] == 'td':
+        listing = '<table><tbody>{}</tbody></table>'.format(listing)
+    if definition.container is not None:
+        listing = element(definition.container, listing)
+    navigation = '<ul class="menu">{}</ul>'.format(''.join('<li><span>Practice area {}</span></li>'.format(idx)
+                                                           for idx in range(50)))
+    footer = ''.join('<p class="disclaimer">Attorney advertising, paragraph {}.</p>'.format(idx) for idx in range(20))
+    page = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>{}</title></head>'
+            '<body><header>{}</header><main>{}</main><footer>{}</footer></body></html>')
+    return page.format(html.escape(definition.display_name), navigation, listing, footer).encode('utf8')
@@ -0,0 +1,157 @@
+"""
+Measures end-to-end throughput of DrugAlert.run in live mode against the local Twitter stand-in.
+Synthetic sources list thousands of drugs, every drug is new and is published as a tweet.
+Database, publish queue and caches are created in a temporary directory.
+
+python -m benchmarks.publish -sources 5 -drugs 1000 -latency 0.005
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import drugAlert
+from drugAlert import DrugAlert
+from drug_sources.web_scraping_sources import Source
+from twitter.fake_server import FakeTwitterServer
+from twitter.publisher import PublishQueue
+from twitter.rate_limit import RateLimiter
+
+
+def synthetic_sources(sources, drugs, overlap=0.5):
+    """
+    Creates source classes, neighbouring sources share part of their drugs
+    :param sources: number of sources
+    :param drugs: number of drugs listed by every source
+    :param overlap: fraction of drugs shared with the previous source
+    :return: tuple of dictionary of source classes {'source_name': source_class} and number of distinct drugs
+    """
+    shift = max(int(drugs * (1 - overlap)), 1)
+    srcs = dict()
+    for idx in range(sources):
+        listed = {'Synthetic Drug {:06d}'.format(number): 'http://firm{}.example.com/{}'.format(idx, number)
+                  for number in range(idx * shift, idx * shift + drugs)}
+        name = 'SyntheticSource{}'.format(idx)
+        srcs[name] = type(name, (Source,), {'_url': 'http://firm{}.example.com/'.format(idx),
+                                            '_display_name': 'Synthetic Firm {}'.format(idx),
+                                            'fetch_drugs_from_source': lambda self, from_file=False, d=listed: d})
+    return srcs, (sources - 1) * shift + drugs if sources else 0
+
+
+class BenchmarkAlert(DrugAlert):
+    """
+    DrugAlert with adjustable client side tweet rate and publisher workers, evaluation and publishing are timed
+    """
+    def __init__(self, tweet_rate=None, tweet_burst=10, publish_workers=1):
+        DrugAlert.__init__(self)
+        self.tweet_rate = tweet_rate
+        self.tweet_burst = tweet_burst
+        self.publish_workers = publish_workers
+        self.timings = dict()
+
+    def initialize_publisher(self, workers=1):
+        DrugAlert.initialize_publisher(self, self.publish_workers)
+
+    def initalize_twitter(self):
+        DrugAlert.initalize_twitter(self)
+        if self.tweet_rate is not None:
+            self.twitter.tweet_limiter = RateLimiter(self.tweet_rate, self.tweet_burst)
+
+    def evaluate_scans(self, scans):
+        started = time.perf_counter()
+        try:
+            return DrugAlert.evaluate_scans(self, scans)
+        finally:
+            self.timings['scan_and_evaluate'] = time.perf_counter() - started
+
+    def send_tweets(self, hits, live=False):
+        started = time.perf_counter()
+        try:
+            return DrugAlert.send_tweets(self, hits, live)
+        finally:
+            self.timings['queue_tweets'] = time.perf_counter() - started
+
+    def finish_publishing(self, errors, timeout=drugAlert.DEFAULT_PUBLISH_TIMEOUT):
+        started = time.perf_counter()
+        try:
+            return DrugAlert.finish_publishing(self, errors, timeout)
+        finally:
+            self.timings['finish_publishing'] = time.perf_counter() - started
+
+
+def run_benchmark(sources=5, drugs=1000, overlap=0.5, latency=0.0, tweet_rate=1000.0, rate_limit=None,
+                  spam_threshold=None, publish_timeout=600, publish_workers=1):
+    """
+    Runs DrugAlert.run once on an empty database
+    :param sources: number of synthetic sources
+    :param drugs: number of drugs listed by every source
+    :param overlap: fraction of drugs shared by neighbouring sources
+    :param latency: seconds every response of the fake server is delayed
+    :param tweet_rate: client side tweets per second, None keeps the rate of Twitter
+    :param rate_limit: requests to a single endpoint allowed by the fake server in 15 minutes
+    :param spam_threshold: status updates in a minute that lock the account
+    :param publish_timeout: seconds the run waits for tweets
+    :param publish_workers: number of tweets published at the same time
+    :return: dictionary of results
+    """
+    srcs, distinct = synthetic_sources(sources, drugs, overlap)
+    if drugAlert.logger is None:
+        drugAlert.logger = logging.getLogger('__main__')
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeTwitterServer(latency=latency, rate_limit=rate_limit, spam_threshold=spam_threshold) as server:
+        with open(os.path.join(directory, 'twitter_auth.json'), 'w') as out_file:
+            json.dump({'consumer_key': 'key', 'consumer_secret': 'secret', 'token_key': 'key',
+                       'token_secret': 'secret', 'admin_profile': '@admin', 'api_url': server.base_url}, out_file)
+        # run keeps its files next to the script
+        script = sys.argv[0]
+        sys.argv[0] = os.path.join(directory, 'drugAlert.py')
+        alert = BenchmarkAlert(tweet_rate, publish_workers=publish_workers)
+        started = time.perf_counter()
+        try:
+            alert.run(live=True, from_file=False, publish_timeout=publish_timeout, srcs=srcs)
+        finally:
+            sys.argv[0] = script
+            Source.response_cache = None
+        seconds = time.perf_counter() - started
+        left = len(PublishQueue(os.path.join(directory, 'publish_queue.json')))
+        state = server.state
+        return {'hits': sources * drugs,
+                'drugs': distinct,
+                'tweets': len(state.tweets),
+                'messages': len(state.messages),
+                'left': left,
+                'seconds': seconds,
+                'timings': dict(alert.timings),
+                'responses': {'{} {}'.format(*key): count for key, count in sorted(state.responses.items())}}
+
+
+def main(argv=None):
+    prsr = argparse.ArgumentParser(description='End-to-end publish throughput of drugAlert.py')
+    prsr.add_argument('-sources', help='Number of synthetic sources', type=int, default=5)
+    prsr.add_argument('-drugs', help='Number of drugs listed by every source', type=int, default=1000)
+    prsr.add_argument('-overlap', help='Fraction of drugs shared by neighbouring sources', type=float, default=0.5)
+    prsr.add_argument('-latency', help='Response delay of the fake server in seconds', type=float, default=0.0)
+    prsr.add_argument('-tweet_rate', help='Client side tweets per second', type=float, default=1000.0)
+    prsr.add_argument('-rate_limit', help='Requests per endpoint allowed by the fake server in 15 minutes', type=int)
+    prsr.add_argument('-spam_threshold', help='Status updates in a minute that lock the account', type=int)
+    prsr.add_argument('-publish_timeout', help='Seconds the run waits for tweets', type=float, default=600)
+    prsr.add_argument('-publish_workers', help='Number of tweets published at the same time', type=int, default=1)
+    args = prsr.parse_args(argv)
+
+    result = run_benchmark(args.sources, args.drugs, args.overlap, args.latency, args.tweet_rate, args.rate_limit,
+                           args.spam_threshold, args.publish_timeout, args.publish_workers)
+    print('{hits} hits of {drugs} drugs, {tweets} tweets published, {left} left for the next run'.format(**result))
+    print('run took {:.2f} s, {:.1f} hits/s, {:.1f} tweets/s'.format(
+        result['seconds'], result['hits'] / result['seconds'], result['tweets'] / result['seconds']))
+    for phase, seconds in result['timings'].items():
+        print('    {:<24} {:8.2f} s'.format(phase, seconds))
+    for response, count in result['responses'].items():
+        print('    {:<40} {:8d}'.format(response, count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Measures import time of drugAlert.py and of the modules loaded by each mode.
+Every measurement runs in a fresh interpreter with -X importtime, the fastest of several runs is reported.
+Exits with status 1 when plain startup (argument parsing, before any mode runs) is slower than the budget.
+
+python -m benchmarks.startup -budget 150 -repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by every mode on top of drugAlert
+MODES = {
+    'startup': [],
+    'UPDATE_TEST_FILES': ['drug_sources.web_scraping_sources'],
+    'TEST_FILE': ['drug_sources.web_scraping_sources', 'drug_sources.response_cache', 'database.lawsuit_database'],
+    'LIVE': ['drug_sources.web_scraping_sources', 'drug_sources.response_cache', 'database.lawsuit_database',
+             'TwitterAPI'],
+}
+# Modules that must not be imported by plain startup
+HEAVY_MODULES = ['sqlalchemy', 'requests', 'bs4', 'TwitterAPI', 'asyncio']
+DEFAULT_BUDGET_MS = 150
+DEFAULT_REPEAT = 5
+
+
+def parse_importtime(output):
+    """
+    Parses output of -X importtime
+    :param output: stderr of the interpreter
+    :return: list of tuples (module, depth, self_us, cumulative_us) in the order modules finished importing
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((module, depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(modules, python=sys.executable):
+    """
+    Imports drugAlert and modules in a fresh interpreter
+    :param modules: names of modules imported after drugAlert
+    :param python: interpreter to run
+    :return: tuple of dictionary {'module': (cumulative_us, {'imported_module': cumulative_us})} of modules
+             and modules they imported directly, and set of all imported modules
+    """
+    targets = ['drugAlert'] + modules
+    code = '; '.join('import {}'.format(module) for module in targets)
+    result = subprocess.run([python, '-X', 'importtime', '-c', code], cwd=ROOT, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    imports = parse_importtime(result.stderr)
+    costs = dict()
+    children = dict()
+    for module, depth, _, cumulative in imports:
+        # imports finish before the module that imported them
+        if depth == 0:
+            if module in targets:
+                costs[module] = (cumulative, children)
+            children = dict()
+        elif depth == 1:
+            children[module] = cumulative
+    return costs, {module for module, _, _, _ in imports}
+
+
+def measure_mode(modules, repeat):
+    """
+    :return: tuple (total milliseconds, {'module': (milliseconds, {'imported_module': milliseconds})},
+             imported modules) of the fastest run
+    """
+    best = None
+    for _ in range(repeat):
+        costs, imported = measure(modules)
+        total = sum(cumulative for cumulative, _ in costs.values())
+        if best is None or total < best[0]:
+            best = (total, costs, imported)
+    total, costs, imported = best
+    costs = {module: (us / 1000, {child: child_us / 1000 for child, child_us in children.items()})
+             for module, (us, children) in costs.items()}
+    return total / 1000, costs, imported
+
+
+def main(argv=None):
+    prsr = argparse.ArgumentParser(description='Import time of drugAlert.py modes')
+    prsr.add_argument('-budget', help='Maximum startup import time in milliseconds', type=float,
+                      default=DEFAULT_BUDGET_MS)
+    prsr.add_argument('-repeat', help='Number of runs of every mode', type=int, default=DEFAULT_REPEAT)
+    prsr.add_argument('-top', help='Number of the slowest imports reported for every module', type=int, default=5)
+    args = prsr.parse_args(argv)
+
+    failures = []
+    for mode, modules in MODES.items():
+        total, costs, imported = measure_mode(modules, args.repeat)
+        print('{:<44} {:8.1f} ms'.format(mode, total))
+        for module, (ms, children) in costs.items():
+            print('  {:<42} {:8.1f} ms'.format(module, ms))
+            for child, child_ms in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+                print('    {:<40} {:8.1f} ms'.format(child, child_ms))
+        if mode == 'startup':
+            heavy = sorted(module for module in HEAVY_MODULES if module in imported)
+            if heavy:
+                failures.append('startup imports {}'.format(', '.join(heavy)))
+            if total > args.budget:
+                failures.append('startup took {:.1f} ms, budget is {:.1f} ms'.format(total, args.budget))
+    for failure in failures:
+        print('FAIL: {}'.format(failure))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Times DrugsDb methods, evaluation of scans and every source parser on synthetic datasets of growing size.
+Databases with 10^3 to 10^6 hits and pages of every source layout are generated in a temporary directory.
+Database cases run on a snapshot of the populated database, so every repetition starts from the same data.
+The fastest of several repetitions is reported. Results are saved as JSON and compared with a baseline,
+the command exits with status 1 when a case got slower than the threshold.
+
+python -m benchmarks.suite -hits 1000 10000 100000 -output results.json
+python -m benchmarks.suite -hits 1000 10000 100000 -baseline results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import drugAlert
+from drugAlert import DrugAlert
+from benchmarks.datasets import SyntheticDataset, synthetic_page, drug_names, SCAN_INTERVAL
+from database.lawsuit_database import DrugsDb
+from database.db_models import DbDrug
+from drug_sources.parsers import available_backends, make_soup
+from drug_sources.streaming import stream_drugs, CHUNK_SIZE
+from drug_sources.web_scraping_sources import Source, get_all_scraping_sources
+
+DEFAULT_HITS = [1000, 10000, 100000]
+DEFAULT_ITEMS = [100, 1000]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+# differences below this many seconds are noise, whatever the ratio
+NOISE_SECONDS = 0.002
+SAMPLE = 100
+
+
+def prepare_inputs(dataset):
+    """
+    Computes arguments of database cases once per dataset, outside of timed code
+    :param dataset: SyntheticDataset object
+    :return: dictionary of arguments
+    """
+    rng = random.Random(dataset.seed)
+    pairs = [(drug + 1, source + 1) for drug, source in dataset.pairs]
+    drug_ids = list(range(1, len(dataset.drug_names) + 1))
+    source_ids = list(range(1, len(dataset.source_names) + 1))
+    next_scan_ts = dataset.last_scan_ts + SCAN_INTERVAL
+    srcs = OrderedDict((name, type(name, (Source,), {'_url': 'http://firm{}.example.com/'.format(idx),
+                                                     '_display_name': 'Synthetic Firm {}'.format(idx)}))
+                       for idx, name in enumerate(dataset.source_names))
+    seen = dict()
+    for drug_id, source_id in pairs:
+        seen.setdefault((source_id, next_scan_ts), []).append(drug_id)
+    scans = [{'drugs': dataset.scan_drugs(name), 'source': src_class(), 'ts': next_scan_ts}
+             for name, src_class in srcs.items()]
+    return {'pairs': pairs,
+            'sample_pairs': rng.sample(pairs, min(SAMPLE, len(pairs))),
+            'sample_drugs': rng.sample(drug_ids, min(SAMPLE, len(drug_ids))),
+            'drug_ids': drug_ids,
+            'source_ids': source_ids,
+            'sources': [(src_class(), next_scan_ts) for src_class in srcs.values()],
+            'srcs': srcs,
+            'scan_names': list(scans[0]['drugs']),
+            'misspelled': dataset.misspelled_names(SAMPLE),
+            'new_hits': [(drug_id, source_id, next_scan_ts) for drug_id, source_id in pairs],
+            'seen': seen,
+            'scans': scans}
+
+
+def evaluate_postprocessed_scans(db, session, inputs):
+    alert = DrugAlert()
+    alert.db = db
+    alert.session = session
+    alert.srcs = inputs['srcs']
+    alert.evaluate_postprocessed_scans(DrugAlert.postprocess_scans(inputs['scans']))
+
+
+def get_hit_stats_for_drug_and_source(db, session, inputs):
+    for drug_id, source_id in inputs['sample_pairs']:
+        db.get_hit_stats_for_drug_and_source(session, drug_id, source_id)
+
+
+def get_sources_names_for_drug(db, session, inputs):
+    for drug_id in inputs['sample_drugs']:
+        db.get_sources_names_for_drug(session, drug_id)
+
+
+def get_sources_ids_for_drug(db, session, inputs):
+    for drug_id in inputs['sample_drugs']:
+        db.get_sources_ids_for_drug(session, drug_id)
+
+
+# Every case is called with (db, session, inputs), changes are rolled back after every repetition
+DB_CASES = OrderedDict([
+    ('get_drug_names', lambda db, session, inputs: db.get_drug_names(session)),
+    ('get_distinct_drug_hits', lambda db, session, inputs: db.get_distinct_drug_hits(session)),
+    ('get_ids_by_name', lambda db, session, inputs: db.get_ids_by_name(session, DbDrug, inputs['scan_names'])),
+    ('get_present_drugs', lambda db, session, inputs: db.get_present_drugs(session, inputs['source_ids'])),
+    ('get_hit_stats_for_drugs', lambda db, session, inputs: db.get_hit_stats_for_drugs(session, inputs['drug_ids'])),
+    ('get_hit_stats_for_drug_and_source', get_hit_stats_for_drug_and_source),
+    ('get_sources_ids_for_drug', get_sources_ids_for_drug),
+    ('get_sources_names_for_drug', get_sources_names_for_drug),
+    ('match_drugs', lambda db, session, inputs: db.match_drugs(session, inputs['misspelled'])),
+    ('add_drugs_if_not_in_db', lambda db, session, inputs: db.add_drugs_if_not_in_db(inputs['scan_names'], session)),
+    ('add_sources_if_not_in_db', lambda db, session, inputs: db.add_sources_if_not_in_db(inputs['sources'],
+                                                                                         session)),
+    ('add_hits', lambda db, session, inputs: db.add_hits(session, inputs['new_hits'])),
+    ('update_presence', lambda db, session, inputs: db.update_presence(session, inputs['seen'], {})),
+    ('optimize_hits_table', lambda db, session, inputs: db.optimize_hits_table(session)),
+    ('optimize_hits_table_pairs', lambda db, session, inputs: db.optimize_hits_table(
+        session, pairs=inputs['sample_pairs'])),
+    ('rebuild_summary', lambda db, session, inputs: db.rebuild_summary(session)),
+    ('rebuild_ngram_index', lambda db, session, inputs: db.rebuild_ngram_index(session)),
+    ('evaluate_postprocessed_scans', evaluate_postprocessed_scans),
+])
+
+
+def best_time(function, repeat):
+    """
+    :param function: function without arguments
+    :param repeat: number of repetitions
+    :return: the shortest time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_db_case(case, db_path, db_name, inputs, repeat):
+    """
+    Times a database case on snapshots of the database, database opening is not timed
+    :return: the shortest time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        db = DrugsDb(db_name, db_path, snapshot=True)
+        session = db.create_session()
+        try:
+            started = time.perf_counter()
+            case(db, session, inputs)
+            session.flush()
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close_db()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_db_cases(hits, directory, repeat=DEFAULT_REPEAT, select=None):
+    """
+    Populates database with hits and times database cases
+    :param hits: number of hits in the database
+    :param directory: directory of database files
+    :param repeat: number of repetitions of every case
+    :param select: compiled regular expression of result names to run, all cases run if not set
+    :return: ordered dictionary of results {'db/case/hits': seconds}
+    """
+    results = OrderedDict()
+    cases = [(name, case) for name, case in DB_CASES.items()
+             if select is None or select.search('db/{}/{}'.format(name, hits))]
+    if not cases:
+        return results
+    dataset = SyntheticDataset(hits)
+    db_name = 'benchmark_{}.db'.format(hits)
+    # database left by an earlier run in the same directory
+    if os.path.exists(os.path.join(directory, db_name)):
+        os.remove(os.path.join(directory, db_name))
+    started = time.perf_counter()
+    dataset.populate(directory, db_name)
+    results['db/populate/{}'.format(hits)] = time.perf_counter() - started
+    inputs = prepare_inputs(dataset)
+    for name, case in cases:
+        results['db/{}/{}'.format(name, hits)] = time_db_case(case, directory, db_name, inputs, repeat)
+    return results
+
+
+def run_parser_cases(items, repeat=DEFAULT_REPEAT, select=None):
+    """
+    Times every declarative source on a synthetic page with every parser backend and with streaming
+    :param items: number of drugs on the page
+    :param repeat: number of repetitions of every case
+    :param select: compiled regular expression of result names to run, all cases run if not set
+    :return: ordered dictionary of results {'parse/source/method/items': seconds}
+    """
+    results = OrderedDict()
+    names = drug_names(items, seed=items)
+    for source_name, src_class in get_all_scraping_sources().items():
+        definition = getattr(src_class, 'definition', None)
+        if definition is None:
+            continue
+        drugs = OrderedDict((name, 'https://{}.example.com/{}'.format(source_name.lower(), idx))
+                            for idx, name in enumerate(names))
+        page = synthetic_page(definition, drugs)
+        chunks = [page[idx:idx + CHUNK_SIZE] for idx in range(0, len(page), CHUNK_SIZE)]
+        methods = [('extract-{}'.format(backend), lambda backend=backend: definition.extract(make_soup(page, backend)))
+                   for backend in available_backends()]
+        methods.append(('stream', lambda: stream_drugs(definition, chunks)))
+        for method, function in methods:
+            key = 'parse/{}/{}/{}'.format(source_name, method, items)
+            if select is not None and not select.search(key):
+                continue
+            found = len(function())
+            if found != items:
+                raise RuntimeError('{} extracted {} of {} drugs'.format(key, found, items))
+            results[key] = best_time(function, repeat)
+    return results
+
+
+def run_suite(hits=DEFAULT_HITS, items=DEFAULT_ITEMS, repeat=DEFAULT_REPEAT, select=None, directory=None):
+    """
+    Runs all cases
+    :param hits: sizes of databases
+    :param items: sizes of pages
+    :param repeat: number of repetitions of every case
+    :param select: regular expression of result names to run
+    :param directory: directory of database files, temporary directory is used if not set
+    :return: dictionary {'environment': {...}, 'repeat': repeat, 'results': {'name': seconds}}
+    """
+    if drugAlert.logger is None:
+        drugAlert.logger = logging.getLogger('__main__')
+    if select is not None:
+        select = re.compile(select)
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as temporary:
+        for size in hits:
+            results.update(run_db_cases(size, directory or temporary, repeat, select))
+    for size in items:
+        results.update(run_parser_cases(size, repeat, select))
+    return {'environment': {'python': platform.python_version(),
+                            'sqlite': sqlite3.sqlite_version,
+                            'machine': platform.machine(),
+                            'created': int(time.time())},
+            'repeat': repeat,
+            'results': results}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, noise=NOISE_SECONDS):
+    """
+    Finds cases that got slower than baseline
+    :param baseline: results of run_suite saved earlier
+    :param current: results of run_suite
+    :param threshold: allowed slowdown, 0.25 allows cases 25% slower than baseline
+    :param noise: differences of fewer seconds are never regressions
+    :return: list of tuples (name, baseline_seconds, current_seconds), the largest slowdown first
+    """
+    regressions = []
+    for name, seconds in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if seconds > before * (1 + threshold) and seconds - before > noise:
+            regressions.append((name, before, seconds))
+    return sorted(regressions, key=lambda item: item[2] / max(item[1], 1e-9), reverse=True)
+
+
+def load_results(results_file):
+    with open(results_file, 'r', encoding='utf8') as in_file:
+        return json.load(in_file, object_pairs_hook=OrderedDict)
+
+
+def save_results(results, results_file):
+    with open(results_file, 'w', encoding='utf8') as out_file:
+        json.dump(results, out_file, indent=2)
+
+
+def main(argv=None):
+    prsr = argparse.ArgumentParser(description='Benchmarks of database methods and source parsers')
+    prsr.add_argument('-hits', help='Numbers of hits of synthetic databases', type=int, nargs='*',
+                      default=DEFAULT_HITS)
+    prsr.add_argument('-items', help='Numbers of drugs on synthetic pages', type=int, nargs='*',
+                      default=DEFAULT_ITEMS)
+    prsr.add_argument('-repeat', help='Number of repetitions of every case', type=int, default=DEFAULT_REPEAT)
+    prsr.add_argument('-select', help='Regular expression of case names to run, e.g. "db/add_hits" or "parse/"')
+    prsr.add_argument('-directory', help='Directory of database files, temporary directory by default')
+    prsr.add_argument('-output', help='JSON file the results are saved to')
+    prsr.add_argument('-baseline', help='JSON file with results of an earlier run to compare with')
+    prsr.add_argument('-threshold', help='Allowed slowdown compared to baseline, 0.25 is 25%%', type=float,
+                      default=DEFAULT_THRESHOLD)
+    args = prsr.parse_args(argv)
+
+    results = run_suite(args.hits, args.items, args.repeat, args.select, args.directory)
+    baseline = load_results(args.baseline)['results'] if args.baseline else dict()
+    for name, seconds in results['results'].items():
+        line = '{:<64} {:10.4f} s'.format(name, seconds)
+        if name in baseline:
+            line += ' {:+7.1%}'.format(seconds / max(baseline[name], 1e-9) - 1)
+        print(line)
+    if args.output:
+        save_results(results, args.output)
+    if not args.baseline:
+        return 0
+    regressions = compare(load_results(args.baseline), results, args.threshold)
+    for name, before, seconds in regressions:
+        print('REGRESSION {}: {:.4f} s -> {:.4f} s'.format(name, before, seconds))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
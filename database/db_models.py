@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey, Column, Integer, String
+from sqlalchemy import ForeignKey, Column, Integer, String, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 
@@ -8,7 +8,7 @@ Base = declarative_base()
 class DbDrug(Base):
     __tablename__ = "drugs"
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True, unique=True)
     descriptions = relationship("DbDescription")
 
     def __init__(self, name):
@@ -17,6 +17,7 @@ class DbDrug(Base):
 
 class DbHit(Base):
     __tablename__ = "hits"
+    __table_args__ = (Index('ix_hits_drug_source_ts', 'drug_id', 'source_id', 'hit_ts'),)
     id = Column(Integer, primary_key=True)
     drug_id = Column(Integer, ForeignKey('drugs.id'))
     drug = relationship("DbDrug", backref=backref("hits"))
@@ -30,6 +31,34 @@ class DbHit(Base):
         self.hit_ts = hit_ts
 
 
+class DbDrugSourceSummary(Base):
+    __tablename__ = "drug_source_summary"
+    drug_id = Column(Integer, ForeignKey('drugs.id'), primary_key=True)
+    source_id = Column(Integer, ForeignKey('sources.id'), primary_key=True)
+    first_ts = Column(Integer)
+    last_ts = Column(Integer)
+    hit_count = Column(Integer)
+    present = Column(Boolean)
+
+    def __init__(self, drug_id, source_id, first_ts, last_ts, hit_count, present=True):
+        self.drug_id = drug_id
+        self.source_id = source_id
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.hit_count = hit_count
+        self.present = present
+
+
+class DbDrugNgram(Base):
+    __tablename__ = "drug_ngrams"
+    ngram = Column(String, primary_key=True)
+    drug_id = Column(Integer, ForeignKey('drugs.id'), primary_key=True)
+
+    def __init__(self, ngram, drug_id):
+        self.ngram = ngram
+        self.drug_id = drug_id
+
+
 class DbDescription(Base):
     __tablename__ = "descr"
     id = Column(Integer, primary_key=True)
@@ -46,7 +75,7 @@ class DbSource(Base):
     id = Column(Integer, primary_key=True)
     created_ts = Column(Integer)
     updated_ts = Column(Integer)
-    name = Column(String)
+    name = Column(String, index=True, unique=True)
     display_name = Column(String)
     twitter_name = Column(String)
     address = Column(String)
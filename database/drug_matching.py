@@ -0,0 +1,95 @@
+import re
+
+WORD_SEPARATORS = re.compile(r'[\W_]+')
+PARENTHESES = re.compile(r'\([^)]*\)')
+
+
+class FuzzyMatcher:
+    """
+    Scores similarity of drug names by their character n-grams.
+    Score mixes Dice coefficient, which penalizes any difference, with overlap coefficient,
+    which treats a name contained in the other one ("Xarelto" and "Xarelto (rivaroxaban)") as the same drug.
+    Names with different numbers ("Batch 1" and "Batch 2") never match. Names never match either when a word outside
+    parentheses has no similar word in the other name, so "Exactech Knee Implant" and "Exactech Hip Implant"
+    or "Bard IVC Filter" and "IVC Filter" are different products.
+    """
+    def __init__(self, n=3, threshold=0.77, containment_weight=0.5, candidates=10, word_threshold=0.6):
+        """
+        :param n: length of n-grams
+        :param threshold: minimum score of a match, from 0 to 1
+        :param containment_weight: weight of overlap coefficient in the score, from 0 (Dice only) to 1 (overlap only)
+        :param candidates: maximum number of candidates with the most common n-grams that are scored
+        :param word_threshold: minimum Dice coefficient of a misspelled word and the word it stands for, from 0 to 1
+        """
+        self.n = n
+        self.threshold = threshold
+        self.containment_weight = containment_weight
+        self.candidates = candidates
+        self.word_threshold = word_threshold
+
+    @staticmethod
+    def words(name):
+        return WORD_SEPARATORS.sub(' ', name.casefold()).split()
+
+    @staticmethod
+    def numbers(name):
+        return {word for word in FuzzyMatcher.words(name) if any(char.isdigit() for char in word)}
+
+    @staticmethod
+    def distinguishing_words(name):
+        """
+        :return: words of name outside parentheses, parentheses hold generic names that sources often leave out
+        """
+        return FuzzyMatcher.words(PARENTHESES.sub(' ', name))
+
+    def ngrams(self, name):
+        """
+        Splits name into n-grams of case folded words, words are padded with spaces
+        :param name: drug name
+        :return: set of n-grams
+        """
+        grams = set()
+        for word in self.words(name):
+            padded = ' {} '.format(word)
+            grams.update(padded[idx:idx + self.n] for idx in range(max(1, len(padded) - self.n + 1)))
+        return grams
+
+    def score(self, grams, other_grams):
+        if not grams or not other_grams:
+            return 0
+        common = len(grams & other_grams)
+        dice = 2 * common / (len(grams) + len(other_grams))
+        overlap = common / min(len(grams), len(other_grams))
+        return (1 - self.containment_weight) * dice + self.containment_weight * overlap
+
+    def words_match(self, name, other_name):
+        """
+        Checks that every distinguishing word of both names has the same or a misspelled word in the other name
+        """
+        for words, other_words in ((self.distinguishing_words(name), self.words(other_name)),
+                                   (self.distinguishing_words(other_name), self.words(name))):
+            other_grams = [self.ngrams(word) for word in other_words]
+            for word in words:
+                grams = self.ngrams(word)
+                if not any(2 * len(grams & other) / (len(grams) + len(other)) >= self.word_threshold
+                           for other in other_grams):
+                    return False
+        return True
+
+    def best_match(self, name, candidates):
+        """
+        Finds the most similar name
+        :param name: drug name
+        :param candidates: iterable of tuples (drug_id, drug_name)
+        :return: tuple (drug_id, drug_name, score) of the best candidate above threshold or None
+        """
+        grams = self.ngrams(name)
+        numbers = self.numbers(name)
+        best = None
+        for drug_id, drug_name in candidates:
+            if self.numbers(drug_name) != numbers:
+                continue
+            score = self.score(grams, self.ngrams(drug_name))
+            if score >= self.threshold and (best is None or score > best[2]) and self.words_match(name, drug_name):
+                best = (drug_id, drug_name, score)
+        return best
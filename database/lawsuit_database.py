@@ -1,32 +1,127 @@
 import logging
-from sqlalchemy import create_engine, and_, desc
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, and_, desc, func, tuple_, inspect
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.pool import StaticPool
 from os import path
+import sqlite3
 import sys
+from urllib.request import pathname2url
 
-from database.db_models import DbDrug, DbSource, DbHit, Base
+from database.db_models import DbDrug, DbSource, DbHit, DbDrugSourceSummary, DbDrugNgram, Base
+from database.drug_matching import FuzzyMatcher
+from database.storage_profiles import STORAGE_PROFILES, DEFAULT_PROFILE
 
 logger = logging.getLogger(__name__)
 
+# Default SQLite bound parameter limit of versions before 3.32
+MAX_VARIABLES = 999
+
+
+def batches(items, columns=1):
+    """
+    Splits items so that IN lists and multi-row inserts stay below the SQLite bound parameter limit
+    :param items: iterable of items
+    :param columns: number of parameters of a single item
+    :return: generator of lists of items
+    """
+    items = list(items)
+    size = MAX_VARIABLES // columns
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
 
 class DB:
-    def __init__(self, db_name="drugs.db", db_path=None):
+    def __init__(self, db_name="drugs.db", db_path=None, profile=DEFAULT_PROFILE, snapshot=False):
+        """
+        :param db_name: name of the database file
+        :param db_path: directory of the database file, directory of the script is used if not set
+        :param profile: name of the storage profile from STORAGE_PROFILES or dictionary of pragmas
+        :param snapshot: if True, the database is copied into memory and the copy is used instead,
+                         changes are discarded by close_db and the database file is only read while it is copied
+        """
         if not db_path:
-            full_path = 'sqlite:///' + path.join(path.dirname(path.realpath(sys.argv[0])), db_name)
+            db_file = path.join(path.dirname(path.realpath(sys.argv[0])), db_name)
         else:
-            full_path = 'sqlite:///'+path.join(db_path, db_name)
-        self.engine = create_engine(full_path, echo=False)
+            db_file = path.join(db_path, db_name)
+        if isinstance(profile, str):
+            try:
+                profile = STORAGE_PROFILES[profile]
+            except KeyError:
+                raise ValueError('Unknown storage profile {}'.format(profile))
+        self.pragmas = OrderedDict(profile)
+        if snapshot:
+            # the copy is discarded, journal mode of the database file is left as it is
+            self.pragmas.pop('journal_mode', None)
+            snapshot_connection = self.copy_database(db_file)
+            # every session shares the single connection that holds the copy
+            self.engine = create_engine('sqlite://', creator=lambda: snapshot_connection, poolclass=StaticPool,
+                                        echo=False)
+        else:
+            self.engine = create_engine('sqlite:///' + db_file, echo=False)
+        event.listen(self.engine, 'connect', self.apply_pragmas)
         self.session_factory = sessionmaker(bind=self.engine)
+        self.session_registry = scoped_session(self.session_factory)
+
+    def apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in self.pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(pragma, value))
+        cursor.close()
+
+    @staticmethod
+    def copy_database(db_file):
+        """
+        Copies database with the SQLite backup API, which reads a consistent state of the database including changes
+        that are still in its WAL file. The database is opened read-only and only read locks are taken.
+        :param db_file: path of the database file
+        :return: connection to the in-memory copy
+        """
+        source = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(db_file)), uri=True)
+        target = sqlite3.connect(':memory:', check_same_thread=False)
+        try:
+            source.backup(target)
+        except BaseException:
+            target.close()
+            raise
+        finally:
+            source.close()
+        return target
 
     def create_session(self):
+        """
+        Returns session of the current thread, the same session is returned until close_db is called
+        :return: session object
+        """
         logger.debug("Creating session")
-        session = scoped_session(self.session_factory)
-        return session()
+        return self.session_registry()
+
+    @contextmanager
+    def session_scope(self):
+        """
+        Provides a separate session that is committed when the block ends, or rolled back on errors
+        :return: session object
+        """
+        session = self.session_factory()
+        try:
+            yield session
+            self.save_changes(session)
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     def create_database(self):
         logger.debug("Creating database")
         Base.metadata.create_all(self.engine)
+        # create_all skips indexes of tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
 
     @staticmethod
     def add_item(item, session):
@@ -40,17 +135,117 @@ class DB:
     def query_all(item, session):
         return session.query(item).all()
 
+    @staticmethod
+    def bulk_insert(session, model, rows):
+        """
+        Inserts rows with a single prepared statement, bypassing the unit of work
+        :param model: mapped class
+        :param rows: list of dictionaries {'column': value}
+        """
+        if rows:
+            session.flush()
+            session.execute(model.__table__.insert(), rows)
+
     @staticmethod
     def save_changes(session):
         session.commit()
 
     def close_db(self):
+        self.session_registry.remove()
         self.engine.dispose()
 
 
 class DrugsDb(DB):
-    def __init__(self, db_name="drugs.db", db_path=None):
-        DB.__init__(self, db_name, db_path)
+    def __init__(self, db_name="drugs.db", db_path=None, profile=DEFAULT_PROFILE, snapshot=False,
+                 merge_matches=False):
+        """
+        :param merge_matches: if True, new drug names are resolved to their near-duplicates already in the database,
+                              otherwise near-duplicates are only logged and the names are added as new drugs
+        """
+        DB.__init__(self, db_name, db_path, profile, snapshot)
+        # matches new drug names with near-duplicates already in the database, None disables matching
+        self.matcher = FuzzyMatcher()
+        self.merge_matches = merge_matches
+
+    def create_database(self):
+        inspector = inspect(self.engine)
+        ngrams_exist = inspector.has_table(DbDrugNgram.__tablename__)
+        summary_exists = inspector.has_table(DbDrugSourceSummary.__tablename__)
+        DB.create_database(self)
+        if not summary_exists:
+            with self.session_scope() as session:
+                self.rebuild_summary(session)
+        if not ngrams_exist:
+            with self.session_scope() as session:
+                self.rebuild_ngram_index(session)
+
+    def rebuild_ngram_index(self, session):
+        """
+        Fills n-gram index with names of all drugs
+        """
+        logger.debug("Rebuilding drug name index")
+        session.flush()
+        session.execute(DbDrugNgram.__table__.delete())
+        self.index_drugs(session, session.query(DbDrug.name, DbDrug.id).all())
+
+    def index_drugs(self, session, drugs):
+        """
+        Adds drug names to n-gram index
+        :param drugs: iterable of tuples (drug_name, drug_id)
+        """
+        matcher = self.matcher or FuzzyMatcher()
+        self.bulk_insert(session, DbDrugNgram, [{'ngram': ngram, 'drug_id': drug_id}
+                                                for name, drug_id in drugs for ngram in matcher.ngrams(name)])
+
+    def match_drugs(self, session, names):
+        """
+        Finds near-duplicates of drug names. Candidates sharing the most n-grams are read from n-gram index
+        and scored by the matcher.
+        :param names: names of drugs that are not in the database
+        :return: dictionary {'drug_name': (drug_id, matched_name, score)} of names that have a match
+        """
+        matches = dict()
+        for name in names:
+            grams = self.matcher.ngrams(name)
+            if not grams:
+                continue
+            common = func.count(DbDrugNgram.ngram)
+            query = session.query(DbDrugNgram.drug_id).filter(DbDrugNgram.ngram.in_(list(grams)))
+            candidate_ids = [item[0] for item in query.group_by(DbDrugNgram.drug_id).order_by(desc(common))
+                             .limit(self.matcher.candidates).all()]
+            if not candidate_ids:
+                continue
+            candidates = session.query(DbDrug.id, DbDrug.name).filter(DbDrug.id.in_(candidate_ids)).all()
+            match = self.matcher.best_match(name, candidates)
+            if match is not None:
+                logger.info('Drug {} matched with {} (score {:.2f})'.format(name, match[1], match[2]))
+                matches[name] = match
+        return matches
+
+    @staticmethod
+    def rebuild_summary(session):
+        """
+        Fills drug/source summary from hits table. Hit counts of databases migrated this way only include hits
+        that were left by hits table optimization.
+        """
+        logger.debug("Rebuilding drug/source summary")
+        session.flush()
+        summary = DbDrugSourceSummary.__table__
+        session.execute(summary.delete())
+        hits = session.query(DbHit.drug_id, DbHit.source_id, func.min(DbHit.hit_ts), func.max(DbHit.hit_ts),
+                             func.count(DbHit.id)).group_by(DbHit.drug_id, DbHit.source_id)
+        session.execute(summary.insert().from_select(['drug_id', 'source_id', 'first_ts', 'last_ts', 'hit_count'],
+                                                     hits))
+        DrugsDb.rebuild_presence(session)
+
+    @staticmethod
+    def rebuild_presence(session):
+        """
+        Marks drugs as present in sources that found them in their last scan
+        """
+        summary = DbDrugSourceSummary.__table__
+        last_scan = session.query(DbSource.updated_ts).filter(DbSource.id == summary.c.source_id).scalar_subquery()
+        session.execute(summary.update().values(present=func.coalesce(summary.c.last_ts >= last_scan, False)))
 
     @staticmethod
     def get_item(session, item, db_id=None, name=None):
@@ -71,6 +266,13 @@ class DrugsDb(DB):
     def get_source(session, db_id=None, name=None):
         return DrugsDb.get_item(session, DbSource, db_id, name)
 
+    @staticmethod
+    def get_drug_names(session):
+        """
+        :return: names of all drugs, oldest first
+        """
+        return [item[0] for item in session.query(DbDrug.name).order_by(DbDrug.id).all()]
+
     @staticmethod
     def get_distinct_drug_hits(session):
         try:
@@ -122,66 +324,197 @@ class DrugsDb(DB):
             logger.debug('Hit not found for drug_id={} source_id={}'.format(drug_id, source_id))
             raise NoResultFound
 
-    def optimize_hits_table(self, session):
-        try:
-            all_hits = self.get_distinct_drug_hits(session)
-        except NoResultFound:
-            logger.debug('No hits found in the database. Hit optimization not needed.')
+    @staticmethod
+    def get_hit_stats_for_drugs(session, drug_ids):
+        """
+        Reads hit counts of drugs from drug/source summary with one query per batch of drugs
+        :param drug_ids: database IDs of drugs
+        :return: dictionary {'drug_hits': {drug_id: total_hits},
+                             'source_hits': {(drug_id, source_id): hits},
+                             'source_names': {drug_id: ['source_name']}}
+        """
+        stats = {'drug_hits': dict(),
+                 'source_hits': dict(),
+                 'source_names': dict()}
+        summary = DbDrugSourceSummary
+        for batch in batches(set(drug_ids)):
+            query = session.query(summary.drug_id, summary.source_id, DbSource.name, summary.hit_count)
+            query = query.outerjoin(DbSource, summary.source_id == DbSource.id).filter(summary.drug_id.in_(batch))
+            for drug_id, source_id, source_name, hits in query.order_by(summary.drug_id, summary.source_id).all():
+                stats['drug_hits'][drug_id] = stats['drug_hits'].get(drug_id, 0) + hits
+                stats['source_hits'][(drug_id, source_id)] = hits
+                if source_name is not None:
+                    stats['source_names'].setdefault(drug_id, []).append(source_name)
+        return stats
+
+    def add_hits(self, session, hits):
+        """
+        Inserts hits and updates drug/source summary
+        :param hits: list of tuples (drug_id, source_id, hit_ts)
+        """
+        summary = OrderedDict()
+        for drug_id, source_id, hit_ts in hits:
+            row = summary.setdefault((drug_id, source_id), {'drug_id': drug_id, 'source_id': source_id,
+                                                            'first_ts': hit_ts, 'last_ts': hit_ts, 'hit_count': 0,
+                                                            'present': True})
+            row['first_ts'] = min(row['first_ts'], hit_ts)
+            row['last_ts'] = max(row['last_ts'], hit_ts)
+            row['hit_count'] += 1
+        self.bulk_insert(session, DbHit, [{'drug_id': drug_id, 'source_id': source_id, 'hit_ts': hit_ts}
+                                          for drug_id, source_id, hit_ts in hits])
+        if not summary:
             return
-        for drug_id in all_hits:
-            try:
-                sources = self.get_sources_ids_for_drug(session, drug_id)
-            except NoResultFound:
-                raise RuntimeError('Hits were found in the database, but no sources are available')
-            for src in sources:
-                try:
-                    ds_hits = self.get_hits_for_drug_and_source(session, drug_id, src)
-                except NoResultFound:
-                    raise RuntimeError('Hit was not found for drug and source.')
-                for idx, hit in enumerate(ds_hits):
-                    if idx != 0 and idx < len(ds_hits) - 1:
-                        self.delete_item(hit, session)
+        # one statement executed for every row, multi-row VALUES would be compiled again for every batch
+        table = DbDrugSourceSummary.__table__
+        statement = insert(table)
+        excluded = statement.excluded
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['drug_id', 'source_id'],
+            set_={'first_ts': func.min(table.c.first_ts, excluded.first_ts),
+                  'last_ts': func.max(table.c.last_ts, excluded.last_ts),
+                  'hit_count': table.c.hit_count + excluded.hit_count,
+                  'present': True}), list(summary.values()))
+
+    @staticmethod
+    def get_present_drugs(session, source_ids):
+        """
+        Reads drugs found in the last scan of sources
+        :param source_ids: database IDs of sources
+        :return: dictionary {source_id: set(drug_id)}
+        """
+        present = {source_id: set() for source_id in source_ids}
+        summary = DbDrugSourceSummary
+        for batch in batches(present):
+            query = session.query(summary.source_id, summary.drug_id)
+            for source_id, drug_id in query.filter(summary.source_id.in_(batch), summary.present.is_(True)).all():
+                present[source_id].add(drug_id)
+        return present
+
+    @staticmethod
+    def update_presence(session, seen, removed):
+        """
+        Updates drug/source summary of drugs that were already known to sources, without adding hits
+        :param seen: dictionary {(source_id, scan_ts): [drug_id]} of drugs still found in sources
+        :param removed: dictionary {source_id: [drug_id]} of drugs no longer found in sources
+        """
+        table = DbDrugSourceSummary.__table__
+        session.flush()
+        for (source_id, scan_ts), drug_ids in seen.items():
+            for batch in batches(drug_ids):
+                session.execute(table.update().where(and_(table.c.source_id == source_id, table.c.drug_id.in_(batch)))
+                                .values(last_ts=func.max(table.c.last_ts, scan_ts), hit_count=table.c.hit_count + 1))
+        for source_id, drug_ids in removed.items():
+            for batch in batches(drug_ids):
+                session.execute(table.update().where(and_(table.c.source_id == source_id, table.c.drug_id.in_(batch)))
+                                .values(present=False))
+
+    def optimize_hits_table(self, session, pairs=None):
+        """
+        Keeps only the first and the last hit of every drug and source pair with a single DELETE statement
+        :param pairs: (drug_id, source_id) pairs to compact, all pairs are compacted if not set
+        """
+        session.flush()
+        deleted = 0
+        if pairs is None:
+            deleted += self.delete_middle_hits(session)
+        else:
+            for batch in batches(set(pairs), columns=2):
+                deleted += self.delete_middle_hits(session, tuple_(DbHit.drug_id, DbHit.source_id).in_(batch))
+        logger.debug('Removed {} hits from hits table'.format(deleted))
+
+    @staticmethod
+    def delete_middle_hits(session, condition=None):
+        partition = (DbHit.drug_id, DbHit.source_id)
+        ranked = session.query(DbHit.id.label('id'),
+                               func.row_number().over(partition_by=partition,
+                                                      order_by=(DbHit.hit_ts, DbHit.id)).label('position'),
+                               func.count(DbHit.id).over(partition_by=partition).label('hits'))
+        if condition is not None:
+            ranked = ranked.filter(condition)
+        ranked = ranked.subquery()
+        middle = session.query(ranked.c.id).filter(ranked.c.position > 1, ranked.c.position < ranked.c.hits)
+        return session.query(DbHit).filter(DbHit.id.in_(middle)).delete(synchronize_session='fetch')
+
+    @staticmethod
+    def get_ids_by_name(session, item, names):
+        """
+        Resolves names to database IDs using IN queries
+        :param item: DbDrug or DbSource
+        :param names: names of items
+        :return: dictionary {'name': id} of items found in the database
+        """
+        ids = dict()
+        for batch in batches(names):
+            ids.update(session.query(item.name, item.id).filter(item.name.in_(batch)).all())
+        return ids
 
     def add_drugs_if_not_in_db(self, pp_drugs, session):
-        drugs = dict()
-        for drug_name in pp_drugs:
-            try:
-                result = self.get_drug(session, name=drug_name)
-            except NoResultFound:
-                new_drug = DbDrug(drug_name)
-                self.add_item(new_drug, session)
-                result = self.get_drug(session, None, drug_name)
-            drugs[drug_name] = result.id
-        return drugs
+        """
+        Inserts drugs that are not in the database. Names that are near-duplicates of drugs in the database
+        are resolved to these drugs instead if merge_matches is set.
+        :param pp_drugs: names of drugs
+        :return: dictionary of drugs with their database IDs {'drug_name': id}
+        """
+        names = list(OrderedDict.fromkeys(pp_drugs))
+        known = self.get_ids_by_name(session, DbDrug, names)
+        unknown = [name for name in names if name not in known]
+        if self.matcher is not None and unknown:
+            for name, (drug_id, matched_name, score) in self.match_drugs(session, unknown).items():
+                if self.merge_matches:
+                    known[name] = drug_id
+                else:
+                    logger.info('Drug {} added as a new drug, merging with {} is disabled'.format(name, matched_name))
+            unknown = [name for name in unknown if name not in known]
+        session.flush()
+        for batch in batches(unknown):
+            statement = insert(DbDrug.__table__).values([{'name': name} for name in batch])
+            session.execute(statement.on_conflict_do_nothing(index_elements=['name']))
+        added = self.get_ids_by_name(session, DbDrug, unknown)
+        self.index_drugs(session, added.items())
+        known.update(added)
+        if len(known) != len(names):
+            raise NoResultFound
+        return OrderedDict((name, known[name]) for name in names)
+
+    @staticmethod
+    def rename_drugs(session, names):
+        """
+        Renames drugs, n-gram index is kept because names differ only by case and punctuation
+        :param names: dictionary {'drug_name': 'new_name'}
+        """
+        session.flush()
+        for name, new_name in names.items():
+            session.query(DbDrug).filter(DbDrug.name == name).update({'name': new_name}, synchronize_session=False)
 
     def get_drug_ids(self, drugs_noids, session):
-        drugs = dict()
-        for drug_name in drugs_noids:
-            result = self.get_drug(session, name=drug_name)
-            if result is None:
-                raise NoResultFound
-            drugs[drug_name] = result.id
-        return drugs
+        names = list(OrderedDict.fromkeys(drugs_noids))
+        found = self.get_ids_by_name(session, DbDrug, names)
+        if len(found) != len(names):
+            raise NoResultFound
+        return OrderedDict((name, found[name]) for name in names)
 
     def add_sources_if_not_in_db(self, pp_sources, session):
-        sources = dict()
+        """
+        Inserts sources that are not in the database and updates timestamps of known sources
+        :param pp_sources: list of tuples (source_object, scan_timestamp)
+        :return: dictionary of sources with their database IDs {'source_name': id}
+        """
+        rows = OrderedDict()
         for source, scan_ts in pp_sources:
-            try:
-                result = self.get_source(session, name=source.name)
-                result.updated_ts = scan_ts
-            except NoResultFound:
-                new_source = DbSource(source.name, source.url, source.display_name, source.twitter_name, scan_ts,
-                                      scan_ts)
-                self.add_item(new_source, session)
-                result = self.get_source(session, name=source.name)
-            sources[source.name] = result.id
-        return sources
+            rows[source.name] = {'name': source.name, 'address': source.url, 'display_name': source.display_name,
+                                 'twitter_name': source.twitter_name, 'created_ts': scan_ts, 'updated_ts': scan_ts}
+        session.flush()
+        for batch in batches(rows.values(), columns=6):
+            statement = insert(DbSource.__table__).values(batch)
+            session.execute(statement.on_conflict_do_update(index_elements=['name'],
+                                                            set_={'updated_ts': statement.excluded.updated_ts}))
+        # loaded sources would keep timestamps from before the upsert
+        session.expire_all()
+        return self.get_sources_ids(pp_sources, session)
 
     def get_sources_ids(self, sources_noids, session):
-        sources = dict()
-        for source, scan_ts in sources_noids:
-            result = self.get_source(session, name=source.name)
-            if result is None:
-                raise NoResultFound
-            sources[source.name] = result.id
-        return sources
+        names = list(OrderedDict.fromkeys(source.name for source, scan_ts in sources_noids))
+        found = self.get_ids_by_name(session, DbSource, names)
+        if len(found) != len(names):
+            raise NoResultFound
+        return OrderedDict((name, found[name]) for name in names)
@@ -0,0 +1,12 @@
+from collections import OrderedDict
+
+# Pragmas applied to every new connection
+STORAGE_PROFILES = {
+    'sqlite': OrderedDict(),
+    'sd_card': OrderedDict([('journal_mode', 'WAL'),
+                            ('synchronous', 'NORMAL'),
+                            ('mmap_size', 64 * 1024 * 1024),
+                            ('cache_size', -8 * 1024),
+                            ('temp_store', 'MEMORY')]),
+}
+DEFAULT_PROFILE = 'sqlite'
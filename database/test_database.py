@@ -1,5 +1,10 @@
+import hashlib
+import os
+import tempfile
 import unittest
-from database.lawsuit_database import DrugsDb, DbHit, DbDrug, DbSource, NoResultFound
+from sqlalchemy import inspect, text
+from database.lawsuit_database import DrugsDb, DbHit, DbDrug, DbSource, DbDrugSourceSummary, DbDrugNgram, \
+    NoResultFound
 
 
 class TestDatabase(unittest.TestCase):
@@ -40,6 +45,7 @@ class TestDatabase(unittest.TestCase):
         for obj in test_objects:
             cls.db.add_item(obj, cls.session)
             pass
+        cls.db.rebuild_summary(cls.session)
 
     @classmethod
     def tearDownClass(cls):
@@ -101,6 +107,13 @@ class TestDatabaseReadOperations(TestDatabase):
         self.assertEqual(self.db.get_hit_stats_for_drug_and_source(self.session, 1, 4), (0, 6))
         self.assertEqual(self.db.get_hit_stats_for_drug_and_source(self.session, 999, 999), (0, 0))
 
+    def test_get_hit_stats_for_drugs(self):
+        stats = self.db.get_hit_stats_for_drugs(self.session, [1, 3, 4, 999])
+        self.assertEqual(stats['drug_hits'], {1: 6, 3: 1})
+        self.assertEqual(stats['source_hits'], {(1, 1): 3, (1, 2): 2, (1, 3): 1, (3, 3): 1})
+        self.assertEqual(stats['source_names'], {1: ['First Source', 'Second Source', 'Third Source'],
+                                                 3: ['Third Source']})
+
 
 class TestDatabaseWriteOperations(TestDatabase):
     def test_optimize_hits_table(self):
@@ -116,6 +129,31 @@ class TestDatabaseWriteOperations(TestDatabase):
         self.assertRaises(NoResultFound, self.db.get_hits_for_drug_and_source, self.session, 3, 1)
         self.assertRaises(NoResultFound, self.db.get_hits_for_drug_and_source, self.session, 999, 1)
 
+    def test_optimize_hits_table_for_pairs(self):
+        for hit_ts in (5, 6, 7):
+            self.db.add_item(DbHit(2, 2, hit_ts), self.session)
+            self.db.add_item(DbHit(3, 2, hit_ts), self.session)
+        self.db.optimize_hits_table(self.session, pairs=[(2, 2), (999, 999)])
+        r = self.db.get_hits_for_drug_and_source(self.session, 2, 2)
+        self.assertEqual(sorted([item.hit_ts for item in r]), [5, 7])
+        r = self.db.get_hits_for_drug_and_source(self.session, 3, 2)
+        self.assertEqual(sorted([item.hit_ts for item in r]), [5, 6, 7])
+
+    def test_add_hits_updates_summary(self):
+        self.db.add_hits(self.session, [(4, 2, 10), (4, 2, 8), (4, 3, 9)])
+        self.db.add_hits(self.session, [(4, 2, 12)])
+        summary = self.session.query(DbDrugSourceSummary).filter(DbDrugSourceSummary.drug_id == 4,
+                                                                  DbDrugSourceSummary.source_id == 2).one()
+        self.assertEqual((summary.first_ts, summary.last_ts, summary.hit_count), (8, 12, 3))
+        stats = self.db.get_hit_stats_for_drugs(self.session, [4])
+        self.assertEqual(stats['source_hits'], {(4, 2): 3, (4, 3): 1})
+        r = self.db.get_hits_for_drug_and_source(self.session, 4, 2)
+        self.assertEqual(sorted([item.hit_ts for item in r]), [8, 10, 12])
+
+    def test_hits_index(self):
+        indexes = inspect(self.db.engine).get_indexes('hits')
+        self.assertIn(['drug_id', 'source_id', 'hit_ts'], [index['column_names'] for index in indexes])
+
     def test_add_sources_if_not_in_db(self):
         sources = []
 
@@ -137,10 +175,223 @@ class TestDatabaseWriteOperations(TestDatabase):
         drugs = ['AAAA', 'BBBB']
         self.assertEqual(self.db.add_drugs_if_not_in_db(drugs, self.session), {'AAAA': 5, 'BBBB': 6})
 
+    def test_bulk_add_drugs_mixed_with_known(self):
+        drugs = ['First Drug', 'CCCC', 'CCCC', 'Orphan Drug']
+        ids = self.db.add_drugs_if_not_in_db(drugs, self.session)
+        self.assertEqual(list(ids), ['First Drug', 'CCCC', 'Orphan Drug'])
+        self.assertEqual((ids['First Drug'], ids['Orphan Drug']), (1, 4))
+        self.assertEqual(self.db.get_drug_ids(['CCCC', 'Second Drug'], self.session),
+                         {'CCCC': ids['CCCC'], 'Second Drug': 2})
+        self.assertRaises(NoResultFound, self.db.get_drug_ids, ['CCCC', 'NO drug'], self.session)
+
+    def test_bulk_add_drugs_above_batch_size(self):
+        drugs = ['Batch Drug {}'.format(idx) for idx in range(1200)]
+        ids = self.db.add_drugs_if_not_in_db(drugs, self.session)
+        self.assertEqual(list(ids), drugs)
+        self.assertEqual(len(set(ids.values())), len(drugs))
+
+    def test_names_are_unique(self):
+        inspector = inspect(self.db.engine)
+        for table in ('drugs', 'sources'):
+            indexes = [index for index in inspector.get_indexes(table) if index['column_names'] == ['name']]
+            self.assertTrue(indexes and indexes[0]['unique'])
+
+
+class TestDatabaseMigration(unittest.TestCase):
+
+    def test_summary_built_for_existing_database(self):
+        with tempfile.TemporaryDirectory() as db_path:
+            db = DrugsDb(db_name='old.db', db_path=db_path)
+            for table in (DbDrug.__table__, DbSource.__table__, DbHit.__table__):
+                table.create(db.engine)
+            with db.engine.begin() as connection:
+                connection.execute(DbSource.__table__.insert(), [{'name': 'Source', 'updated_ts': 5}])
+                connection.execute(DbHit.__table__.insert(), [{'drug_id': 1, 'source_id': 1, 'hit_ts': 1},
+                                                              {'drug_id': 1, 'source_id': 1, 'hit_ts': 5},
+                                                              {'drug_id': 2, 'source_id': 1, 'hit_ts': 3}])
+            db.create_database()
+            session = db.create_session()
+            stats = db.get_hit_stats_for_drugs(session, [1, 2, 3])
+            self.assertEqual(stats['drug_hits'], {1: 2, 2: 1})
+            summary = session.query(DbDrugSourceSummary).filter(DbDrugSourceSummary.drug_id == 1).one()
+            self.assertEqual((summary.first_ts, summary.last_ts), (1, 5))
+            self.assertEqual(db.get_present_drugs(session, [1]), {1: {1}})
+            session.close()
+            db.close_db()
+
+
+class TestDatabaseConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = tempfile.TemporaryDirectory()
+        self.db = DrugsDb(db_name='connection.db', db_path=self.db_path.name, profile='sd_card')
+        self.db.create_database()
+
+    def tearDown(self):
+        self.db.close_db()
+        self.db_path.cleanup()
+
+    def test_profile_applied_on_connect(self):
+        with self.db.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(connection.exec_driver_sql('PRAGMA synchronous').scalar(), 1)
+            self.assertEqual(connection.exec_driver_sql('PRAGMA temp_store').scalar(), 2)
+
+    def test_sqlite_profile_is_default(self):
+        db = DrugsDb(db_name='plain.db', db_path=self.db_path.name)
+        db.create_database()
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'delete')
+        db.close_db()
+        self.assertEqual([name for name in os.listdir(self.db_path.name) if name.startswith('plain.db')], ['plain.db'])
+        self.assertRaises(ValueError, DrugsDb, db_name='plain.db', db_path=self.db_path.name, profile='unknown')
+
+    def test_session_reused_until_closed(self):
+        session = self.db.create_session()
+        self.assertIs(self.db.create_session(), session)
+        self.db.close_db()
+        self.assertIsNot(self.db.create_session(), session)
+
+    def test_session_scope(self):
+        with self.db.session_scope() as session:
+            self.db.add_item(DbDrug('Committed'), session)
+        with self.assertRaises(RuntimeError):
+            with self.db.session_scope() as session:
+                self.db.add_item(DbDrug('Rolled Back'), session)
+                session.flush()
+                raise RuntimeError
+        names = [drug.name for drug in self.db.query_all(DbDrug, self.db.create_session())]
+        self.assertEqual(names, ['Committed'])
+
+
+class TestDatabaseSnapshot(unittest.TestCase):
+
+    def test_changes_discarded(self):
+        with tempfile.TemporaryDirectory() as db_path:
+            db = DrugsDb(db_name='live.db', db_path=db_path)
+            for table in (DbDrug.__table__, DbSource.__table__, DbHit.__table__):
+                table.create(db.engine)
+            with db.session_scope() as session:
+                db.add_item(DbDrug('Live Drug'), session)
+            db.close_db()
+
+            snapshot = DrugsDb(db_name='live.db', db_path=db_path, snapshot=True)
+            snapshot.create_database()
+            session = snapshot.create_session()
+            ids = snapshot.add_drugs_if_not_in_db(['Live Drug', 'Test Drug'], session)
+            snapshot.add_hits(session, [(ids['Test Drug'], 1, 10)])
+            snapshot.save_changes(session)
+            self.assertEqual(snapshot.get_hit_stats_for_drugs(session, [ids['Test Drug']])['drug_hits'],
+                             {ids['Test Drug']: 1})
+            snapshot.close_db()
+
+            db = DrugsDb(db_name='live.db', db_path=db_path)
+            self.assertFalse(inspect(db.engine).has_table(DbDrugSourceSummary.__tablename__))
+            session = db.create_session()
+            self.assertEqual([drug.name for drug in db.query_all(DbDrug, session)], ['Live Drug'])
+            self.assertEqual(db.query_all(DbHit, session), [])
+            db.close_db()
+
+    def test_live_file_not_locked_or_modified(self):
+        with tempfile.TemporaryDirectory() as db_path:
+            live_file = os.path.join(db_path, 'live.db')
+            db = DrugsDb(db_name='live.db', db_path=db_path, profile='sqlite')
+            db.create_database()
+            db.close_db()
+            with open(live_file, 'rb') as live:
+                checksum = hashlib.md5(live.read()).hexdigest()
+
+            snapshot = DrugsDb(db_name='live.db', db_path=db_path, snapshot=True)
+            snapshot.create_database()
+            session = snapshot.create_session()
+            snapshot.add_drugs_if_not_in_db(['Test Drug'], session)
+            snapshot.save_changes(session)
+            with open(live_file, 'rb') as live:
+                self.assertEqual(hashlib.md5(live.read()).hexdigest(), checksum)
+            # a live run writes while the test run is still open
+            db = DrugsDb(db_name='live.db', db_path=db_path, profile='sqlite')
+            with db.session_scope() as live_session:
+                db.add_drugs_if_not_in_db(['Live Drug'], live_session)
+            db.close_db()
+            self.assertEqual(snapshot.get_drug_names(session), ['Test Drug'])
+            snapshot.close_db()
+            self.assertEqual(sorted(os.listdir(db_path)), ['live.db'])
+
+            db = DrugsDb(db_name='live.db', db_path=db_path, profile='sqlite')
+            session = db.create_session()
+            self.assertEqual(db.get_drug_names(session), ['Live Drug'])
+            self.assertEqual(session.execute(text('PRAGMA journal_mode')).scalar(), 'delete')
+            db.close_db()
+
+
+class TestDrugMatching(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = tempfile.TemporaryDirectory()
+        self.db = DrugsDb(db_name='matching.db', db_path=self.db_path.name, merge_matches=True)
+        self.db.create_database()
+        self.session = self.db.create_session()
+        self.ids = self.db.add_drugs_if_not_in_db(['Xarelto', 'Zantac'], self.session)
+        self.db.save_changes(self.session)
+
+    def tearDown(self):
+        self.db.close_db()
+        self.db_path.cleanup()
+
+    def test_near_duplicates_resolved_to_known_drugs(self):
+        ids = self.db.add_drugs_if_not_in_db(['Xarelto (rivaroxaban)', 'Xareltto', 'Zantac', 'Onglyza'], self.session)
+        self.assertEqual(ids['Xarelto (rivaroxaban)'], self.ids['Xarelto'])
+        self.assertEqual(ids['Xareltto'], self.ids['Xarelto'])
+        self.assertEqual(ids['Zantac'], self.ids['Zantac'])
+        self.assertNotIn(ids['Onglyza'], self.ids.values())
+        self.assertEqual(sorted(self.db.get_drug_names(self.session)), ['Onglyza', 'Xarelto', 'Zantac'])
+
+    def test_index_persisted_and_updated(self):
+        self.db.add_drugs_if_not_in_db(['Onglyza'], self.session)
+        self.db.save_changes(self.session)
+        self.db.close_db()
+        db = DrugsDb(db_name='matching.db', db_path=self.db_path.name)
+        db.create_database()
+        session = db.create_session()
+        self.assertEqual(db.match_drugs(session, ['Onglyzza'])['Onglyzza'][1], 'Onglyza')
+        db.close_db()
+
+    def test_index_built_for_existing_database(self):
+        self.session.execute(DbDrugNgram.__table__.delete())
+        self.db.save_changes(self.session)
+        self.session.execute(text('DROP TABLE drug_ngrams'))
+        self.db.save_changes(self.session)
+        self.db.create_database()
+        self.assertEqual(self.db.match_drugs(self.session, ['Zantac (ranitidine)'])['Zantac (ranitidine)'][0],
+                         self.ids['Zantac'])
+
+    def test_matching_disabled(self):
+        self.db.matcher = None
+        ids = self.db.add_drugs_if_not_in_db(['Xareltto'], self.session)
+        self.assertNotEqual(ids['Xareltto'], self.ids['Xarelto'])
+
+    def test_matches_only_logged_by_default(self):
+        self.db.merge_matches = False
+        with self.assertLogs('database.lawsuit_database', level='INFO') as logs:
+            ids = self.db.add_drugs_if_not_in_db(['Xareltto'], self.session)
+        self.assertNotEqual(ids['Xareltto'], self.ids['Xarelto'])
+        self.assertIn('merging with Xarelto is disabled', logs.output[-1])
+        self.assertFalse(DrugsDb(db_name='matching.db', db_path=self.db_path.name).merge_matches)
+
+    def test_distinct_products_not_merged(self):
+        ids = self.db.add_drugs_if_not_in_db(['Exactech Hip Implant', 'Hip Implant'], self.session)
+        self.db.save_changes(self.session)
+        new_ids = self.db.add_drugs_if_not_in_db(['Exactech Knee Implant', 'Stryker Hip Implant'], self.session)
+        self.assertEqual(len(set(new_ids.values()) | set(ids.values())), 4)
+
 
 if __name__ == "__main__":
 
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestDatabaseReadOperations))
     test_suite.addTest(unittest.makeSuite(TestDatabaseWriteOperations))
+    test_suite.addTest(unittest.makeSuite(TestDatabaseMigration))
+    test_suite.addTest(unittest.makeSuite(TestDatabaseConnection))
+    test_suite.addTest(unittest.makeSuite(TestDatabaseSnapshot))
+    test_suite.addTest(unittest.makeSuite(TestDrugMatching))
     unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,46 @@
+import unittest
+
+from database.drug_matching import FuzzyMatcher
+
+
+class TestFuzzyMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = FuzzyMatcher()
+
+    def test_ngrams(self):
+        self.assertEqual(self.matcher.ngrams('Ab-C'), {' ab', 'ab ', ' c '})
+
+    def test_near_duplicates_match(self):
+        candidates = [(1, 'Xarelto'), (2, 'Zantac'), (3, 'Onglyza')]
+        for name in ['Xarelto (rivaroxaban)', 'Xareltto', 'XARELTO']:
+            with self.subTest(name=name):
+                self.assertEqual(self.matcher.best_match(name, candidates)[0], 1)
+
+    def test_different_drugs_do_not_match(self):
+        self.assertIsNone(self.matcher.best_match('Invokana', [(1, 'Onglyza'), (2, 'Invega')]))
+        self.assertIsNone(self.matcher.best_match('Batch Drug 2', [(1, 'Batch Drug 1')]))
+
+    def test_different_words_do_not_match(self):
+        pairs = [('Exactech Knee Implant', 'Exactech Hip Implant'), ('Philips CPAP', 'Philips BiPAP'),
+                 ('Stryker Hip Implant', 'Hip Implant'), ('Bard IVC Filter', 'IVC Filter')]
+        for name, other_name in pairs:
+            with self.subTest(name=name):
+                self.assertIsNone(self.matcher.best_match(name, [(1, other_name)]))
+                self.assertIsNone(self.matcher.best_match(other_name, [(1, name)]))
+
+    def test_generic_name_in_parentheses_not_distinguishing(self):
+        self.assertEqual(self.matcher.distinguishing_words('Xarelto (rivaroxaban) 10'), ['xarelto', '10'])
+        self.assertTrue(self.matcher.words_match('Xarelto (rivaroxaban)', 'Xareltto'))
+
+    def test_tunable_score(self):
+        strict = FuzzyMatcher(threshold=0.9)
+        self.assertIsNone(strict.best_match('Xarelto (rivaroxaban)', [(1, 'Xarelto')]))
+        containment = FuzzyMatcher(containment_weight=1)
+        self.assertEqual(containment.best_match('Xarelto (rivaroxaban)', [(1, 'Xarelto')])[2], 1)
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestFuzzyMatcher))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
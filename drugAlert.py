@@ -1,88 +1,122 @@
 import argparse
 import os
+import queue
 import sys
+import threading
 import logging.handlers
-from shutil import copy2
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
-from database.lawsuit_database import DbHit
-from database.lawsuit_database import DrugsDb
-from drug_sources.web_scraping_sources import *
-from twitter.twitter import LawsuitsTwitter, DuplicateTweet, TwitterLockedForSpam
+from database.storage_profiles import STORAGE_PROFILES, DEFAULT_PROFILE
+from drug_sources.drug_names import load_name_index
+
+
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_FETCH_TIMEOUT = 30
+DEFAULT_QUEUE_DEPTH = 2
+# how often workers waiting for a full queue check if the consumer stopped
+STOP_POLL_INTERVAL = 0.1
+DEFAULT_PUBLISH_TIMEOUT = 10 * 60
 
 
 class DrugAlert:
 
     def __init__(self):
         self.twitter = None
+        self.publisher = None
         self.db = None
         self.session = None
+        self.hit_pairs = set()
+        self.srcs = dict()
 
     def initalize_twitter(self):
         """
         Initlizes twitter and logs in
         :return: None
         """
+        from twitter.twitter import LawsuitsTwitter
         twitter_auth = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), 'twitter_auth.json')
         self.twitter = LawsuitsTwitter(twitter_auth)
 
+    def initialize_publisher(self, workers=1):
+        """
+        Starts publishing in the background, tweets left by previous runs are published first
+        :param workers: number of tweets published at the same time
+        :return: None
+        """
+        from twitter.publisher import Publisher, PublishQueue
+        queue_file = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), 'publish_queue.json')
+        self.publisher = Publisher(self.twitter, PublishQueue(queue_file), workers=workers)
+        self.publisher.start()
+
     def send_tweets(self, hits, live=False):
         """
-        Prepares tweets and (if in live mode) sends them to Twitter
+        Prepares tweets and (if in live mode) queues them for publishing
         :param hits: dictionary containing hit information
         :param live: If true, tweets will be posted
-        :return: errors, if any
+        :return: None
         """
         tweets = self.twitter.prepare_tweets(hits)
-        error = None
         for tweet in tweets:
             logger.info(tweet)
-            if live:
-                try:
-                    self.twitter.post_tweet(tweet)
-                    time.sleep(0.5)
-                except DuplicateTweet:
-                    logger.warning('Tweet already posted!')
-                except TwitterLockedForSpam:
-                    logger.error('Too many tweets resulted in spam')
-                    error = 'Twitter locked the account'
-        return error
+        if live:
+            self.publisher.tweet_all(tweets)
 
     def send_dm_if_error(self, errors):
         """
-        Sends DM via Twitter to admin
+        Queues a single DM to admin with all errors of the run
         :param errors: table of messages to send
         :return: None
         """
-        for err in errors:
-            if err is not None:
-                self.twitter.admin_fix_me_dm(err)
-                time.sleep(1)
+        errors = [err for err in errors if err is not None]
+        if errors:
+            self.publisher.dm(self.twitter.admin_profile, self.twitter.admin_fix_me_message('\n'.join(errors)))
 
-    def initialize_db(self, live=False):
+    def finish_publishing(self, errors, timeout=DEFAULT_PUBLISH_TIMEOUT):
+        """
+        Waits for queued tweets, then sends errors of the run to admin.
+        Tweets not published before timeout are left in the queue for the next run.
+        :param errors: error messages of the run
+        :param timeout: maximum wait in seconds for tweets and for messages
+        :return: None
         """
-        Initializes database. Non-live mode will copy current database and use it for test.
+        if not self.publisher.drain(timeout):
+            self.publisher.defer('tweet')
+        self.send_dm_if_error(errors + self.publisher.errors)
+        self.publisher.close(timeout)
+
+    def initialize_db(self, live=False, profile=DEFAULT_PROFILE, merge_matches=False):
+        """
+        Initializes database. Non-live mode works on an in-memory copy of current database, changes are discarded.
         :param live: If true, will use main database
+        :param profile: name of the storage profile
+        :param merge_matches: If true, near-duplicates of known drug names are saved as the known drugs
         :return: None
         """
+        from database.lawsuit_database import DrugsDb
         if not live:
-            test_run_db = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), 'test.db')
             drugs_db = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), 'drugs.db')
-            try:
-                os.remove(test_run_db)
-            except FileNotFoundError:
-                pass
-            try:
-                copy2(drugs_db, test_run_db)
-            except FileNotFoundError:
+            if not os.path.isfile(drugs_db):
                 logger.error('Cannot find database file drugs.db')
                 raise RuntimeError
-            self.db = DrugsDb(test_run_db)
-            self.db.create_database()
+            self.db = DrugsDb(drugs_db, profile=profile, snapshot=True, merge_matches=merge_matches)
         else:
-            self.db = DrugsDb()
+            self.db = DrugsDb(profile=profile, merge_matches=merge_matches)
+        self.db.create_database()
 
         self.session = self.db.create_session()
 
+    @staticmethod
+    def initialize_response_cache():
+        """
+        Installs response cache of all sources, pages that did not change are not parsed again
+        :return: None
+        """
+        from drug_sources.response_cache import ResponseCache
+        from drug_sources.web_scraping_sources import Source
+        Source.response_cache = ResponseCache(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
+                                                           'response_cache'))
+
     @staticmethod
     def postprocess_scans(all_scans):
         """
@@ -111,8 +145,7 @@ class DrugAlert:
         :param drugs: names of drugs
         :return: dictionary of drugs with their database IDs
         """
-        self.db.add_drugs_if_not_in_db(drugs, self.session)
-        return self.db.get_drug_ids(drugs, self.session)
+        return self.db.add_drugs_if_not_in_db(drugs, self.session)
 
     def process_sources_from_scan(self, sources):
         """
@@ -120,42 +153,120 @@ class DrugAlert:
         :param sources: names of sources
         :return: dictionary of sources with their database IDs
         """
-        self.db.add_sources_if_not_in_db(sources, self.session)
-        return self.db.get_sources_ids(sources, self.session)
+        return self.db.add_sources_if_not_in_db(sources, self.session)
 
-    def evaluate_postprocessed_scans(self, postprocessed_scans):
+    def evaluate_postprocessed_scans(self, postprocessed_scans, new_hits=None):
         """
         Evaluates hits. First it's checking if all scanned drugs and sources are in the database.
-        Then it's adding new hits to database
+        Then it's comparing drugs found in every source with drugs found in the last scan of the source.
+        Only drugs added to a source are evaluated and saved as new hits, drug and source pairs of new hits are kept
+        in hit_pairs. Drugs still found or no longer found only have their summary updated.
         :param postprocessed_scans: dictionary of results in following format:
                                         {'drugs':['drug_name'],
                                         'hits':[('drug_name',source_object,scan_timestamp)]
                                         'sources':[(source_object,scan_timestamp)]}
-        :return: dictionary of drugs with information if drug was just discovered
+        :param new_hits: results of previously evaluated scans of the same run, updated in place
+        :return: dictionary of drugs added to sources with information if drug was just discovered
                     {'drug_name': {'first_hit':bool_value,
                                     'new_sources':[source_object],
                                     'old_sources':[source_object]}}
         """
-        new_hits = dict()
+        from drug_sources.web_scraping_sources import registry
+        if new_hits is None:
+            new_hits = dict()
 
         drugs = self.process_drugs_from_scan(postprocessed_scans['drugs'])
         sources = self.process_sources_from_scan(postprocessed_scans['sources'])
-
-        for drug, source, scan_ts, desc in postprocessed_scans['hits']:
-
-            same_src_hits_for_drug, total_drug_hits = self.db.get_hit_stats_for_drug_and_source(self.session,
-                                                                                                drugs[drug],
-                                                                                                sources[source.name])
-            current_src_names_for_drug = self.db.get_sources_names_for_drug(self.session, drugs[drug])
-            current_srcs_for_drug = [getattr(sys.modules[__name__], item) for item in current_src_names_for_drug]
+        present = self.db.get_present_drugs(self.session, sources.values())
+        added, seen, removed = self.diff_hits(postprocessed_scans['hits'], drugs, sources, present)
+        stats = self.db.get_hit_stats_for_drugs(self.session, [drugs[drug] for drug, source, scan_ts in added])
+        old_srcs = dict()
+        db_hits = []
+
+        for drug, source, scan_ts in added:
+            drug_id, source_id = drugs[drug], sources[source.name]
+            same_src_hits_for_drug = stats['source_hits'].get((drug_id, source_id), 0)
+            total_drug_hits = stats['drug_hits'].get(drug_id, 0)
+            if drug_id not in old_srcs:
+                old_srcs[drug_id] = [self.srcs[item] if item in self.srcs else registry[item]
+                                     for item in stats['source_names'].get(drug_id, [])]
 
             DrugAlert.process_new_hit(new_hits, drug, source, same_src_hits_for_drug, total_drug_hits,
-                                      current_srcs_for_drug)
-            new_hit = DbHit(drugs[drug], sources[source.name], scan_ts)
-            self.db.add_item(new_hit, self.session)
+                                      old_srcs[drug_id])
+            db_hits.append((drug_id, source_id, scan_ts))
+            self.hit_pairs.add((drug_id, source_id))
+
+        self.db.add_hits(self.session, db_hits)
+        self.db.update_presence(self.session, seen, removed)
+        logger.info('{} drugs added to sources, {} still found, {} removed'.format(
+            len(added), sum(len(item) for item in seen.values()), sum(len(item) for item in removed.values())))
+        return new_hits
 
+    def evaluate_scans(self, scans):
+        """
+        Normalizes drug names, evaluates and saves scans one by one, as soon as they are delivered.
+        Drugs first found by this run are renamed at the end to the spelling that sorts first,
+        so names do not depend on the order sources finished in.
+        :param scans: iterable of scans [{'drugs':{'drug_name':'drug_url'}, 'source':source_object,
+                                          'ts':scan_timestamp}]
+        :return: dictionary of drugs added to sources, the same as evaluate_postprocessed_scans returns for all scans
+        """
+        new_hits = dict()
+        names = load_name_index(known_names=self.db.get_drug_names(self.session))
+        for scan in scans:
+            self.evaluate_postprocessed_scans(self.postprocess_scans([self.normalize_scan(scan, names)]), new_hits)
+        renames = names.renames()
+        self.db.rename_drugs(self.session, renames)
+        for name, new_name in renames.items():
+            if name in new_hits:
+                new_hits[new_name] = new_hits.pop(name)
         return new_hits
 
+    @staticmethod
+    def normalize_scan(scan, names):
+        """
+        Replaces drug names of a scan with their canonical names, first link is kept for names that are merged
+        :param scan: dictionary {'drugs':{'drug_name':'drug_url'}, 'source':source_object, 'ts':scan_timestamp}
+        :param names: DrugNameIndex object
+        :return: scan with canonical drug names
+        """
+        drugs = dict()
+        for drug, link in scan['drugs'].items():
+            drugs.setdefault(names.canonical(drug), link)
+        return dict(scan, drugs=drugs)
+
+    @staticmethod
+    def diff_hits(hits, drugs, sources, present):
+        """
+        Compares drugs found in every source with drugs found in the last scan of the source
+        :param hits: list of hits [('drug_name',source_object,scan_timestamp,'drug_url')]
+        :param drugs: dictionary of drugs with their database IDs
+        :param sources: dictionary of sources with their database IDs
+        :param present: dictionary of drugs found in the last scan of sources {source_id: set(drug_id)}
+        :return: tuple of added hits [('drug_name',source_object,scan_timestamp)],
+                 drugs still found {(source_id, scan_timestamp): [drug_id]}
+                 and drugs no longer found {source_id: [drug_id]}
+        """
+        added = []
+        seen = dict()
+        found = {source_id: set() for source_id in sources.values()}
+        for drug, source, scan_ts, desc in hits:
+            drug_id, source_id = drugs[drug], sources[source.name]
+            if drug_id in found[source_id]:
+                # names resolved to the same drug
+                continue
+            found[source_id].add(drug_id)
+            if drug_id in present.get(source_id, ()):
+                seen.setdefault((source_id, scan_ts), []).append(drug_id)
+            else:
+                added.append((drug, source, scan_ts))
+        removed = dict()
+        for source_id, drug_ids in found.items():
+            missing = present.get(source_id, set()) - drug_ids
+            if missing:
+                removed[source_id] = sorted(missing)
+        return added, seen, removed
+
     @staticmethod
     def process_new_hit(drugs_with_new_hits, drug, source, same_src_hits_for_drug, total_drug_hits, old_srcs):
         """
@@ -184,36 +295,178 @@ class DrugAlert:
             if same_src_hits_for_drug == 0:
                 drugs_with_new_hits[drug]['new_sources'].append(source)
 
-    def run(self, live, from_file):
+    @staticmethod
+    def create_sources(srcs, timeout=DEFAULT_FETCH_TIMEOUT):
         """
-        Main task that scans drug sources, evaluates them, saves results to database and publishes to twitter
-        :param live: True saves results to database and publishes on Twitter
-        :param from_file: True reads data from files instead of urls,
-        does not publish on twitter regardless of live setting
+        Creates source objects in source name order
+        :param srcs: dictionary of source classes {'source_name': source_class}
+        :param timeout: time limit in seconds for downloading a single source, retries included
+        :return: list of source objects
+        """
+        sources = []
+        for _, src_class in sorted(srcs.items()):
+            source = src_class()
+            source.timeout = timeout
+            sources.append(source)
+        return sources
+
+    @staticmethod
+    def collect_scans(sources, results):
+        """
+        Splits results of source scans into scans and errors
+        :param sources: list of source objects
+        :param results: list of scan dictionaries or raised exceptions, in the same order as sources
+        :return: tuple of scans [{'drugs':{'drug_name':'drug_url'}, 'source':source_object, 'ts':scan_timestamp}]
+                 and error messages
         """
-        self.initialize_db(live)
-        self.initalize_twitter()
-        srcs = get_all_scraping_sources()
-        scans = []
         errors = []
+        scans = list(DrugAlert.split_scan_results(zip(sources, results), errors))
+        return scans, errors
 
-        for src_class in srcs.values():
-            source = src_class()
-            try:
-                scans.append(source.get_drugs(from_file=from_file))
-            except NoDrugsFound:
+    @staticmethod
+    def split_scan_results(results, errors):
+        """
+        Passes scans through and collects errors of failed sources
+        :param results: iterable of tuples (source_object, scan dictionary or raised exception)
+        :param errors: list that error messages are appended to
+        :return: generator of scans [{'drugs':{'drug_name':'drug_url'}, 'source':source_object, 'ts':scan_timestamp}]
+        """
+        from drug_sources.web_scraping_sources import NoDrugsFound, HTML_RetrievalFail
+        for source, result in results:
+            if isinstance(result, NoDrugsFound):
                 logger.error('No drugs found in scraping source {}'.format(source.url))
                 errors.append('No drugs found in scraping source {}'.format(source.url))
+            elif isinstance(result, HTML_RetrievalFail):
+                logger.error(str(result))
+                errors.append(str(result))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                yield result
+
+    @staticmethod
+    def stream_sources(srcs, from_file=False, workers=DEFAULT_FETCH_WORKERS, timeout=DEFAULT_FETCH_TIMEOUT,
+                       depth=DEFAULT_QUEUE_DEPTH):
+        """
+        Scans all sources concurrently and delivers results as soon as sources finish.
+        Finished scans wait in a bounded queue, workers stop when the queue is full until results are consumed.
+        When the generator is closed, waiting workers drop their results and sources that did not start are skipped.
+        :param srcs: dictionary of source classes {'source_name': source_class}
+        :param from_file: True reads data from files instead of urls
+        :param workers: maximum number of sources fetched at the same time
+        :param timeout: time limit in seconds for downloading a single source, retries included
+        :param depth: maximum number of finished scans waiting to be consumed
+        :return: generator of tuples (source_object, scan dictionary or raised exception) in order of completion
+        """
+        sources = DrugAlert.create_sources(srcs, timeout)
+        results = queue.Queue(maxsize=max(1, depth))
+        stop = threading.Event()
+
+        def scan(source):
+            try:
+                result = source.get_drugs(from_file=from_file)
+            except Exception as e:
+                result = e
+            while not stop.is_set():
+                try:
+                    results.put((source, result), timeout=STOP_POLL_INTERVAL)
+                    return
+                except queue.Full:
+                    pass
+
+        delivered = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(scan, source) for source in sources]
+            try:
+                while delivered < len(sources):
+                    item = results.get()
+                    delivered += 1
+                    yield item
+            finally:
+                # the consumer stopped early or failed, running scans finish and are dropped
+                stop.set()
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def fetch_all_sources_async(srcs, from_file=False, timeout=DEFAULT_FETCH_TIMEOUT):
+        """
+        Scans all sources at once on the event loop shared by all sources.
+        Results are collected in source name order, regardless of the order in which sources finish.
+        :param srcs: dictionary of source classes {'source_name': source_class}
+        :param from_file: True reads data from files instead of urls
+        :param timeout: time limit in seconds for downloading a single source, retries included
+        :return: tuple of scans [{'drugs':{'drug_name':'drug_url'}, 'source':source_object, 'ts':scan_timestamp}]
+                 and error messages
+        """
+        import asyncio
+        from drug_sources.async_fetch import get_fetcher
+        from drug_sources.http_session import HEADERS
+        sources = DrugAlert.create_sources(srcs, timeout)
 
-        pp_scans = self.postprocess_scans(scans)
-        new_hits = self.evaluate_postprocessed_scans(pp_scans)
-        self.db.optimize_hits_table(self.session)
+        async def scan_all():
+            return await asyncio.gather(*[source.get_drugs_async(from_file=from_file) for source in sources],
+                                        return_exceptions=True)
 
-        errors.append(self.send_tweets(new_hits, live=live))
+        results = get_fetcher(HEADERS).run(scan_all())
+        return DrugAlert.collect_scans(sources, results)
 
-        self.db.save_changes(self.session)
-        if live and not from_file:
-            self.send_dm_if_error(errors)
+    def run(self, live, from_file, workers=DEFAULT_FETCH_WORKERS, timeout=DEFAULT_FETCH_TIMEOUT, engine='threads',
+            db_profile=DEFAULT_PROFILE, publish_timeout=DEFAULT_PUBLISH_TIMEOUT, srcs=None, merge_matches=False):
+        """
+        Main task that scans drug sources, evaluates them, saves results to database and publishes to twitter
+        :param live: True saves results to database and publishes on Twitter
+        :param from_file: True reads data from files instead of urls,
+        does not publish on twitter regardless of live setting
+        :param workers: maximum number of sources fetched at the same time
+        :param timeout: time limit in seconds for downloading a single source, retries included
+        :param engine: 'threads' fetches sources on a thread pool, 'asyncio' on the shared event loop
+        :param db_profile: storage profile of the database
+        :param publish_timeout: seconds the run waits for tweets to be published, the rest is published by next run
+        :param srcs: dictionary of source classes {'source_name': source_class}, all registered sources by default
+        :param merge_matches: True saves near-duplicates of known drug names as the known drugs, False only logs them
+        """
+        from drug_sources.http_session import get_session
+        from drug_sources.web_scraping_sources import Source, get_all_scraping_sources
+        self.initialize_db(live, db_profile, merge_matches)
+        try:
+            self.initalize_twitter()
+            publish = live and not from_file
+            if publish:
+                # runs while sources are scanned
+                self.initialize_publisher()
+            if srcs is None:
+                srcs = get_all_scraping_sources()
+            self.srcs = srcs
+            get_session().reset_budget()
+            if not from_file:
+                self.initialize_response_cache()
+            if engine == 'asyncio':
+                scans, errors = self.fetch_all_sources_async(srcs, from_file=from_file, timeout=timeout)
+                new_hits = self.evaluate_scans(scans)
+            else:
+                errors = []
+                # closed when evaluation fails, so that workers waiting for the queue stop and the process can exit
+                results = self.stream_sources(srcs, from_file=from_file, workers=workers, timeout=timeout)
+                with closing(results):
+                    # scans are evaluated while slower sources are still downloading,
+                    # tweets need results of all sources because they group sources of a drug
+                    new_hits = self.evaluate_scans(self.split_scan_results(results, errors))
+
+            if Source.response_cache is not None:
+                logger.info(Source.response_cache.stats_message())
+                Source.response_cache.save()
+
+            self.db.optimize_hits_table(self.session, pairs=self.hit_pairs)
+
+            self.send_tweets(new_hits, live=publish)
+
+            self.db.save_changes(self.session)
+        finally:
+            # discards the snapshot of test modes and releases the database when the run fails
+            self.db.close_db()
+        if publish:
+            self.finish_publishing(errors, publish_timeout)
         logger.info("Finished!")
 
 
@@ -250,6 +503,24 @@ def setup_arg_parser():
                       choices=["LIVE", "TEST_LIVE", "TEST_FILE", "UPDATE_TEST_FILES"], required=True)
 
     prsr.add_argument("-debug", help="Debug level", default='INFO', choices=['INFO', 'WARNING', 'CRITICAL', 'DEBUG'])
+
+    prsr.add_argument("-workers", help="Number of sources fetched at the same time", type=int,
+                      default=DEFAULT_FETCH_WORKERS)
+
+    prsr.add_argument("-timeout", help="Time limit in seconds for downloading a single source, retries included",
+                      type=float, default=DEFAULT_FETCH_TIMEOUT)
+
+    prsr.add_argument("-engine", help="Fetch engine used to scan sources", default='threads',
+                      choices=['threads', 'asyncio'])
+
+    prsr.add_argument("-publish_timeout", help="Seconds to wait for tweets to be published, the rest is published by "
+                                               "the next run", type=float, default=DEFAULT_PUBLISH_TIMEOUT)
+
+    prsr.add_argument("-db_profile", help="SQLite storage profile", default=DEFAULT_PROFILE,
+                      choices=sorted(STORAGE_PROFILES))
+
+    prsr.add_argument("-merge_matches", help="Save near-duplicates of known drug names as the known drugs instead of "
+                                             "new drugs", action='store_true')
     return prsr
 
 
@@ -264,10 +535,14 @@ if __name__ == "__main__":
     DA = DrugAlert()
 
     if args.mode == "LIVE":
-        DA.run(live=True, from_file=False)
+        DA.run(live=True, from_file=False, workers=args.workers, timeout=args.timeout, engine=args.engine,
+               db_profile=args.db_profile, publish_timeout=args.publish_timeout, merge_matches=args.merge_matches)
     elif args.mode == "TEST_LIVE":
-        DA.run(live=False, from_file=False)
+        DA.run(live=False, from_file=False, workers=args.workers, timeout=args.timeout, engine=args.engine,
+               db_profile=args.db_profile, merge_matches=args.merge_matches)
     elif args.mode == "TEST_FILE":
-        DA.run(live=False, from_file=True)
+        DA.run(live=False, from_file=True, workers=args.workers, timeout=args.timeout, engine=args.engine,
+               db_profile=args.db_profile, merge_matches=args.merge_matches)
     elif args.mode == 'UPDATE_TEST_FILES':
+        from drug_sources.web_scraping_sources import update_test_sources
         update_test_sources()
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from drug_sources.http_session import get_session, make_deadline, read_body
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger('__main__')
+
+
+class FetchFailed(Exception):
+    pass
+
+
+class AsyncFetcher:
+    """
+    Fetches pages on a single event loop shared by all sources.
+    Uses aiohttp when it is installed, otherwise requests of the shared session are run in a thread pool owned by
+    the loop.
+    """
+    def __init__(self, max_in_flight=64, headers=None):
+        self.max_in_flight = max_in_flight
+        self.headers = headers or {}
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._session = None
+        self._executor = None
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def fetch(self, url, timeout=None):
+        """
+        Downloads url without blocking the event loop
+        :param url: address of the page
+        :param timeout: timeout in seconds for the whole request
+        :return: body of the response as bytes
+        """
+        async with self.semaphore:
+            logger.debug('Fetching url asynchronously: {}'.format(url))
+            if aiohttp is not None:
+                return await self._fetch_aiohttp(url, timeout)
+            return await self._fetch_executor(url, timeout)
+
+    async def _fetch_aiohttp(self, url, timeout):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(headers=self.headers)
+        try:
+            async with self._session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                return await r.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchFailed(str(e))
+
+    async def _fetch_executor(self, url, timeout):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        try:
+            return await self.loop.run_in_executor(self._executor, self._blocking_get, url, timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            raise FetchFailed(str(e))
+
+    def _blocking_get(self, url, timeout):
+        deadline = make_deadline(timeout)
+        return read_body(get_session().get(url, timeout=timeout, stream=True, deadline=deadline), deadline)
+
+    def run(self, coroutine):
+        """
+        Runs coroutine on the shared event loop
+        :param coroutine: coroutine to run
+        :return: result of the coroutine
+        """
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.loop.close()
+
+
+_fetcher = None
+
+
+def get_fetcher(headers=None):
+    """
+    Returns fetcher shared by all sources, creates it on first use
+    :param headers: headers sent with every request, used only when fetcher is created
+    :return: AsyncFetcher object
+    """
+    global _fetcher
+    if _fetcher is None or _fetcher.loop.is_closed():
+        _fetcher = AsyncFetcher(headers=headers)
+    return _fetcher
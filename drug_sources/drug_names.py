@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import unicodedata
+
+NAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drug_names.json')
+PUNCTUATION = re.compile(r'[\W_]+')
+
+
+def split_name(name):
+    """
+    Splits name into words and their keys, keys are case folded and have punctuation replaced by spaces
+    :param name: drug name
+    :return: tuple of lists (words, word keys), key of a word made only of punctuation is empty
+    """
+    words = unicodedata.normalize('NFKC', name).split()
+    return words, [' '.join(PUNCTUATION.sub(' ', word.casefold()).split()) for word in words]
+
+
+class DrugNameIndex:
+    """
+    Resolves names of the same drug written differently by sources to one canonical name.
+    Names are compared by their key: case folded tokens without punctuation and trailing suffix tokens like 'Lawsuit'.
+    Known names (already stored in the database) take precedence, then canonical names of the alias table.
+    Unknown names become canonical the first time they are seen. Other spellings of unknown names are collected,
+    so that the spelling that sorts first can replace the first one seen when all sources were read.
+    """
+    def __init__(self, aliases=None, suffix_tokens=(), known_names=()):
+        """
+        :param aliases: dictionary {'canonical_name': ['alias']}, e.g. brand name and its generic names
+        :param suffix_tokens: words removed from the end of names, may hold several words
+        :param known_names: names in order of precedence
+        """
+        self.suffixes = sorted((tuple(split_name(token)[1]) for token in suffix_tokens), key=len, reverse=True)
+        self.names = dict()
+        # spellings of names that were not known, {'key': {'spelling'}}
+        self.spellings = dict()
+        for name in known_names:
+            self.names.setdefault(self.key(name), name)
+        known = set(self.names)
+        for canonical, names in (aliases or {}).items():
+            target = self.names.get(self.key(canonical), canonical)
+            for name in [canonical] + list(names):
+                if self.key(name) not in known:
+                    self.names[self.key(name)] = target
+
+    def split(self, name):
+        """
+        Splits name into words and word keys, without trailing suffix tokens and punctuation
+        :param name: drug name
+        :return: tuple of lists (words, word keys)
+        """
+        words, keys = split_name(name)
+        end = len(words)
+        stripped = True
+        while stripped and end:
+            stripped = False
+            if not keys[end - 1]:
+                end -= 1
+                stripped = True
+                continue
+            for suffix in self.suffixes:
+                if len(suffix) <= end and tuple(keys[end - len(suffix):end]) == suffix:
+                    end -= len(suffix)
+                    stripped = True
+                    break
+        if not any(keys[:end]):
+            # name made only of suffix tokens is kept as it is
+            return words, keys
+        return words[:end], keys[:end]
+
+    def key(self, name):
+        return ' '.join(key for key in self.split(name)[1] if key)
+
+    def canonical(self, name):
+        """
+        Resolves name to its canonical name, unknown names are added to the index
+        :param name: drug name as found in source
+        :return: canonical name
+        """
+        words, keys = self.split(name)
+        key = ' '.join(key for key in keys if key)
+        spelling = ' '.join(words)
+        if key in self.spellings:
+            self.spellings[key].add(spelling)
+        try:
+            return self.names[key]
+        except KeyError:
+            self.names[key] = spelling
+            self.spellings[key] = {spelling}
+            return spelling
+
+    def renames(self):
+        """
+        Picks spellings of unknown names that do not depend on the order names were seen in
+        :return: dictionary {'first_spelling': 'spelling_that_sorts_first'} of names spelled differently
+        """
+        return {self.names[key]: min(spellings) for key, spellings in self.spellings.items()
+                if min(spellings) != self.names[key]}
+
+
+def load_name_index(names_file=NAMES_FILE, known_names=()):
+    """
+    Loads alias table and suffix tokens
+    :param names_file: path to JSON file {'suffix_tokens': ['token'], 'aliases': {'canonical_name': ['alias']}}
+    :param known_names: names in order of precedence, usually names stored in the database
+    :return: DrugNameIndex object
+    """
+    with open(names_file, 'r', encoding='utf8') as in_file:
+        definitions = json.load(in_file)
+    return DrugNameIndex(definitions.get('aliases'), definitions.get('suffix_tokens', ()), known_names)
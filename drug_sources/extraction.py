@@ -0,0 +1,141 @@
+import hashlib
+import json
+import urllib.parse
+from collections import OrderedDict
+
+
+class InvalidSourceDefinition(Exception):
+    pass
+
+
+def compile_selector(selector):
+    """
+    Compiles selector definition {'tag': 'div', 'class': 'name'} into find/find_all arguments
+    :param selector: selector definition, None matches the current element
+    :return: dictionary of find/find_all arguments or None
+    """
+    if selector is None:
+        return None
+    if 'tag' not in selector:
+        raise InvalidSourceDefinition('Selector {} has no tag'.format(selector))
+    compiled = {'name': selector['tag']}
+    if 'class' in selector:
+        compiled['class_'] = selector['class']
+    return compiled
+
+
+class SourceDefinition:
+    """
+    Source described by selectors. Definition is compiled once and extracts drugs from parsed documents.
+    Keys of the definition:
+        url, test_file, display_name, twitter_name - attributes of the source
+        container - selector of the element that holds all items, whole document is used if not set
+        items - selector of elements that hold a single drug
+        name - drug name: 'selector' of the element inside the item, 'attribute' to read instead of text,
+               'strip_tokens' removed from the name and 'strip' of surrounding whitespace
+        link - drug link: 'selector' of the element inside the item, 'attribute' holding the link and
+               'join' the link with source 'url' or its 'root'. Links point to the source url if attribute is not set
+        discard - names that are not drugs
+        stream - extract drugs while the page is downloaded instead of parsing the whole document
+    """
+    def __init__(self, name, definition):
+        # identifies the definition in the response cache, drugs extracted by an older definition are not used
+        self.fingerprint = hashlib.sha1(json.dumps(definition, sort_keys=True).encode('utf8')).hexdigest()
+        try:
+            self.name = name
+            self.url = definition['url']
+            self.test_file = definition['test_file']
+            self.display_name = definition['display_name']
+            self.twitter_name = definition.get('twitter_name', "None")
+            self.container = compile_selector(definition.get('container'))
+            self.items = compile_selector(definition['items'])
+            name_definition = definition.get('name', {})
+            link_definition = definition.get('link', {})
+        except KeyError as e:
+            raise InvalidSourceDefinition('Source {} is missing {}'.format(name, e))
+        self.name_selector = compile_selector(name_definition.get('selector'))
+        self.name_attribute = name_definition.get('attribute')
+        self.strip_tokens = tuple(name_definition.get('strip_tokens', ()))
+        self.strip = name_definition.get('strip', False)
+        self.link_selector = compile_selector(link_definition.get('selector'))
+        self.link_attribute = link_definition.get('attribute')
+        self.link_base = self.compile_link_base(link_definition.get('join'))
+        self.discard = frozenset(definition.get('discard', ()))
+        self.stream = definition.get('stream', False)
+
+    def compile_link_base(self, join):
+        if join is None:
+            return None
+        if join == 'url':
+            return self.url
+        if join == 'root':
+            return "{0.scheme}://{0.netloc}/".format(urllib.parse.urlsplit(self.url))
+        raise InvalidSourceDefinition('Source {} has unknown link join {}'.format(self.name, join))
+
+    def clean_name(self, drug_name):
+        for token in self.strip_tokens:
+            drug_name = drug_name.replace(token, '')
+        if self.strip:
+            drug_name = drug_name.strip()
+        return drug_name
+
+    def get_name(self, item):
+        element = item if self.name_selector is None else item.find(**self.name_selector)
+        if element is None:
+            return None
+        if self.name_attribute:
+            drug_name = element.get(self.name_attribute)
+        else:
+            drug_name = element.text
+        if drug_name is None:
+            return None
+        return self.clean_name(drug_name)
+
+    def get_link(self, item):
+        """
+        Reads link of a single item
+        :param item: element holding a single drug
+        :return: tuple (found, link), found is False if the element holding the link does not exist
+        """
+        if self.link_attribute is None:
+            return True, self.url
+        element = item if self.link_selector is None else item.find(**self.link_selector)
+        if element is None:
+            return False, None
+        link = element.get(self.link_attribute)
+        if self.link_base is not None:
+            link = urllib.parse.urljoin(self.link_base, link)
+        return True, link
+
+    def extract(self, soup):
+        """
+        Extracts drugs from parsed document
+        :param soup: BeautifulSoup object
+        :return: dictionary of drugs {'drug_name':'drug_url'}
+        """
+        drugs_dict = {}
+        root = soup
+        if self.container is not None:
+            root = soup.find(**self.container)
+            if root is None:
+                raise AttributeError('Container {} not found for source {}'.format(self.container, self.name))
+        for item in root.find_all(**self.items):
+            drug_name = self.get_name(item)
+            if drug_name is None or drug_name in self.discard:
+                continue
+            found, drug_link = self.get_link(item)
+            if not found:
+                continue
+            drugs_dict[drug_name] = drug_link
+        return drugs_dict
+
+
+def load_definitions(definitions_file):
+    """
+    Loads and compiles source definitions
+    :param definitions_file: path to JSON file with definitions {'SourceName': {definition}}
+    :return: ordered dictionary of SourceDefinition objects
+    """
+    with open(definitions_file, 'r', encoding='utf8') as in_file:
+        definitions = json.load(in_file, object_pairs_hook=OrderedDict)
+    return OrderedDict((name, SourceDefinition(name, definition)) for name, definition in definitions.items())
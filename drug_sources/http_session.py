@@ -0,0 +1,210 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('__main__')
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                         'Chrome/66.0.3359.117 Safari/537.36'}
+BODY_CHUNK_SIZE = 16 * 1024
+
+
+def make_deadline(timeout):
+    """
+    :param timeout: time limit in seconds, None for no limit
+    :return: time.monotonic() value of the deadline or None
+    """
+    return time.monotonic() + timeout if timeout else None
+
+
+def until_deadline(chunks, deadline):
+    """
+    Passes chunks of a streamed response through, fails with Timeout when deadline passes.
+    Deadline is checked between chunks, so a source may overrun it by the time a single chunk takes to arrive.
+    :param chunks: iterable of chunks of the response
+    :param deadline: time.monotonic() value or None
+    :return: generator of chunks
+    """
+    if deadline is None:
+        yield from chunks
+        return
+    for chunk in chunks:
+        if time.monotonic() > deadline:
+            raise requests.exceptions.Timeout('Deadline exceeded while reading response')
+        yield chunk
+    # the last chunk may end the body after deadline, the page is then not trusted to be complete
+    if time.monotonic() > deadline:
+        raise requests.exceptions.Timeout('Deadline exceeded while reading response')
+
+
+def read_body(r, deadline):
+    """
+    Reads body of a streamed response before deadline and closes the response
+    :param r: response requested with stream=True
+    :param deadline: time.monotonic() value or None
+    :return: body as bytes
+    """
+    try:
+        return b''.join(until_deadline(r.iter_content(BODY_CHUNK_SIZE), deadline))
+    finally:
+        r.close()
+
+
+class RetryBudget:
+    """
+    Number of retries shared by all requests of a single run
+    """
+    def __init__(self, retries):
+        self.retries = retries
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Takes one retry from the budget
+        :return: True if retry is allowed
+        """
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def reset(self, retries=None):
+        with self._lock:
+            if retries is not None:
+                self.retries = retries
+            self.remaining = self.retries
+
+
+class HttpSession:
+    """
+    Connection pooled session with keep-alive, timeouts and retries with jittered exponential backoff
+    """
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, headers=None, pool_connections=10, pool_maxsize=4, timeout=(10, 30), max_retries=3,
+                 backoff_factor=0.5, backoff_max=30, retry_budget=20):
+        """
+        :param headers: headers sent with every request
+        :param pool_connections: number of hosts that keep their connection pools
+        :param pool_maxsize: number of connections kept alive for a single host
+        :param timeout: default (connect, read) timeout in seconds
+        :param max_retries: maximum number of retries of a single request
+        :param backoff_factor: base of exponential backoff in seconds
+        :param backoff_max: maximum backoff in seconds
+        :param retry_budget: maximum number of retries of all requests in a single run
+        """
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS if headers is None else headers)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.budget = RetryBudget(retry_budget)
+
+    def backoff(self, attempt):
+        """
+        Calculates delay before the next retry, uses full jitter
+        :param attempt: number of the failed attempt, starting from 0
+        :return: delay in seconds
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def get(self, url, timeout=None, headers=None, stream=False, deadline=None):
+        """
+        Sends GET request, retries on connection errors, timeouts and server errors
+        :param url: address of the page
+        :param timeout: timeout in seconds, default timeout of the session is used if not set
+        :param headers: additional headers
+        :param stream: if True, body is not downloaded until it is read, response has to be closed by the caller
+        :param deadline: time.monotonic() value, requests and retries that would end later fail with Timeout,
+                         timeout of every request is shortened to the time left. Bodies of streamed responses
+                         are read before deadline by read_body or until_deadline.
+        :return: response object, last response is returned if all retries failed on server errors
+        """
+        attempt = 0
+        while True:
+            request_timeout = self.limit_timeout(timeout or self.timeout, deadline)
+            try:
+                r = self.session.get(url, timeout=request_timeout, headers=headers, stream=stream)
+                if r.status_code not in self.retry_statuses:
+                    return r
+                reason = 'status code {}'.format(r.status_code)
+                error = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                r = None
+                reason = str(e)
+                error = e
+            delay = self.backoff(attempt)
+            late = deadline is not None and time.monotonic() + delay >= deadline
+            if attempt >= self.max_retries or late or not self.budget.take():
+                logger.warning('Giving up on {} after {} retries: {}'.format(url, attempt, reason))
+                if error is not None:
+                    raise error
+                return r
+            if r is not None:
+                r.close()
+            logger.debug('Retrying {} in {:.2f}s: {}'.format(url, delay, reason))
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def limit_timeout(timeout, deadline):
+        """
+        Shortens timeout of a request to the time left before deadline
+        :param timeout: timeout in seconds or tuple (connect, read)
+        :param deadline: time.monotonic() value or None
+        :return: timeout of the request
+        """
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout('Deadline exceeded before request')
+        if isinstance(timeout, tuple):
+            return tuple(min(item, remaining) for item in timeout)
+        return min(timeout, remaining)
+
+    def reset_budget(self, retries=None):
+        self.budget.reset(retries)
+
+    def close(self):
+        self.session.close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns session shared by all sources, creates it on first use
+    :return: HttpSession object
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = HttpSession()
+        return _session
+
+
+def configure_session(**kwargs):
+    """
+    Replaces session shared by all sources
+    :param kwargs: HttpSession parameters
+    :return: HttpSession object
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = HttpSession(**kwargs)
+        return _session
@@ -0,0 +1,62 @@
+import logging
+import os
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+logger = logging.getLogger('__main__')
+
+# Fastest first, html.parser is always available as a fallback
+PARSER_BACKENDS = ('lxml', 'html.parser')
+PARSER_ENV_VARIABLE = 'DRUGALERT_PARSER'
+
+_backend = None
+
+
+def available_backends():
+    """
+    Lists parser backends that can be used by BeautifulSoup
+    :return: list of backend names, fastest first
+    """
+    return [backend for backend in PARSER_BACKENDS if builder_registry.lookup(backend) is not None]
+
+
+def get_parser_backend():
+    """
+    Chooses parser backend on first use. Backend set in DRUGALERT_PARSER environment variable takes precedence,
+    otherwise the fastest available backend is used.
+    :return: backend name
+    """
+    global _backend
+    if _backend is None:
+        requested = os.environ.get(PARSER_ENV_VARIABLE)
+        backends = available_backends()
+        if requested in backends:
+            _backend = requested
+        else:
+            if requested:
+                logger.warning('Parser backend {} is not available, using {}'.format(requested, backends[0]))
+            _backend = backends[0]
+        logger.debug('Using parser backend {}'.format(_backend))
+    return _backend
+
+
+def set_parser_backend(backend):
+    """
+    Overrides parser backend
+    :param backend: backend name, None chooses the backend again on next use
+    """
+    global _backend
+    if backend is not None and backend not in available_backends():
+        raise ValueError('Parser backend {} is not available'.format(backend))
+    _backend = backend
+
+
+def make_soup(r, backend=None):
+    """
+    Parses HTML document
+    :param r: HTML document as string or bytes
+    :param backend: backend name, chosen backend is used if not set
+    :return: BeautifulSoup object
+    """
+    return BeautifulSoup(r, backend or get_parser_backend())
@@ -0,0 +1,122 @@
+import logging
+
+try:
+    from importlib import metadata
+except ImportError:
+    # Python 3.7, backport is used if installed
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+
+ENTRY_POINT_GROUP = 'drug_alert.sources'
+
+
+def select_entry_points(entry_points, group):
+    """
+    Selects entry points of a group from the result of metadata.entry_points()
+    :param entry_points: object with select method (Python 3.10+) or dictionary {'group': [entry_point]}
+    :param group: entry point group
+    :return: iterable of entry points
+    """
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=group)
+    return entry_points.get(group, [])
+
+
+def installed_entry_points(group):
+    """
+    :return: installed entry points of a group, none without importlib.metadata
+    """
+    if metadata is None:
+        return []
+    return select_entry_points(metadata.entry_points(), group)
+
+
+class InvalidSource(Exception):
+    pass
+
+
+class SourceRegistry:
+    """
+    Maps source names, as stored in the database, to source classes and their cached objects.
+    Built-in sources are registered when web_scraping_sources is imported,
+    sources of other packages are discovered once through entry points of ENTRY_POINT_GROUP.
+    Entry point may point to a source class or to an iterable of source classes.
+    """
+    def __init__(self, base_class, group=ENTRY_POINT_GROUP):
+        """
+        :param base_class: class all registered sources derive from
+        :param group: entry point group of source plugins, None disables discovery
+        """
+        self.base_class = base_class
+        self.group = group
+        self.classes = dict()
+        self.instances = dict()
+        self.discovered = group is None
+        self.logger = logging.getLogger('__main__')
+
+    def register(self, src_class):
+        """
+        Registers source class under its name, may be used as class decorator
+        :param src_class: subclass of base_class
+        :return: registered class
+        """
+        if not isinstance(src_class, type) or not issubclass(src_class, self.base_class):
+            raise InvalidSource('{} is not a subclass of {}'.format(src_class, self.base_class.__name__))
+        name = src_class.__name__
+        if self.classes.get(name, src_class) is not src_class:
+            raise InvalidSource('Source {} is already registered'.format(name))
+        self.classes[name] = src_class
+        self.instances.pop(name, None)
+        return src_class
+
+    def discover(self, entry_points=None):
+        """
+        Registers sources of entry points, only the first call looks them up
+        :param entry_points: entry points to load, installed entry points of the group by default
+        """
+        if self.discovered:
+            return
+        self.discovered = True
+        if entry_points is None:
+            entry_points = installed_entry_points(self.group)
+        for entry_point in entry_points:
+            try:
+                loaded = entry_point.load()
+                src_classes = [loaded] if isinstance(loaded, type) else list(loaded)
+            except Exception as e:
+                self.logger.error('Failed to load source plugin {}: {}'.format(entry_point.name, e))
+                continue
+            for src_class in src_classes:
+                try:
+                    self.register(src_class)
+                except InvalidSource as e:
+                    self.logger.error('Failed to register source of plugin {}: {}'.format(entry_point.name, e))
+            self.logger.debug('Loaded source plugin {}'.format(entry_point.name))
+
+    def __getitem__(self, name):
+        if name not in self.classes:
+            # source stored in the database may come from a plugin
+            self.discover()
+        return self.classes[name]
+
+    def __contains__(self, name):
+        return name in self.classes
+
+    def instance(self, name):
+        """
+        :param name: source name
+        :return: source object, created on first request and reused later
+        """
+        try:
+            return self.instances[name]
+        except KeyError:
+            return self.instances.setdefault(name, self[name]())
+
+    def as_dict(self):
+        """
+        :return: dictionary of all registered source classes {'source_name': source_class}
+        """
+        self.discover()
+        return dict(self.classes)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('__main__')
+
+
+class ResponseCache:
+    """
+    Persistent cache of source responses keyed by url.
+    Stores validators (ETag, Last-Modified), hashes of bodies and drugs extracted from them, together with
+    the fingerprint of the source definition and parser that extracted the drugs. Entries with another
+    fingerprint are misses, so a changed definition or parser never gets drugs extracted by the old one.
+    Least recently used entries are evicted when there are more than max_entries.
+    """
+    index_name = 'index.json'
+
+    def __init__(self, cache_dir, max_entries=500):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'unchanged': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self.load()
+
+    @property
+    def index_file(self):
+        return os.path.join(self.cache_dir, self.index_name)
+
+    @staticmethod
+    def hasher():
+        """
+        :return: hash object of bodies, fed chunk by chunk when the body is streamed
+        """
+        return hashlib.sha256()
+
+    @staticmethod
+    def digest(body):
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        hasher = ResponseCache.hasher()
+        hasher.update(body)
+        return hasher.hexdigest()
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf8') as in_file:
+                entries = json.load(in_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning('Response cache index {} is corrupted, starting with empty cache'.format(self.index_file))
+            return
+        self.entries = OrderedDict(entries)
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf8') as out_file:
+                json.dump(list(self.entries.items()), out_file)
+            os.replace(tmp_file, self.index_file)
+
+    def entry(self, url, fingerprint):
+        """
+        :param url: address of the page
+        :param fingerprint: fingerprint of the source extracting drugs
+        :return: cached entry or None if url is not cached or was extracted with another fingerprint
+        """
+        entry = self.entries.get(url)
+        if entry is None or entry.get('fingerprint') != fingerprint:
+            return None
+        return entry
+
+    def conditional_headers(self, url, fingerprint):
+        """
+        Prepares validators of cached response
+        :param url: address of the page
+        :param fingerprint: fingerprint of the source extracting drugs
+        :return: dictionary of headers, empty if url is not cached
+        """
+        headers = dict()
+        with self._lock:
+            entry = self.entry(url, fingerprint)
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def not_modified(self, url, fingerprint):
+        """
+        Returns drugs extracted from cached response, used when server responded with 304 Not Modified
+        :param url: address of the page
+        :param fingerprint: fingerprint of the source extracting drugs
+        :return: dictionary of drugs {'drug_name':'drug_url'} or None if url is not cached
+        """
+        with self._lock:
+            entry = self.entry(url, fingerprint)
+            if entry is None:
+                return None
+            self.entries.move_to_end(url)
+            self.stats['hits'] += 1
+            return dict(entry['drugs'])
+
+    def unchanged(self, url, digest, fingerprint):
+        """
+        Returns drugs extracted from cached response if the new body has the same hash
+        :param url: address of the page
+        :param digest: hash of the new body
+        :param fingerprint: fingerprint of the source extracting drugs
+        :return: dictionary of drugs {'drug_name':'drug_url'} or None if body changed or url is not cached
+        """
+        with self._lock:
+            entry = self.entry(url, fingerprint)
+            if entry is None or entry.get('digest') != digest:
+                return None
+            self.entries.move_to_end(url)
+            self.stats['unchanged'] += 1
+            return dict(entry['drugs'])
+
+    def store(self, url, headers, digest, drugs, fingerprint):
+        """
+        Stores validators of response and drugs extracted from it, bodies are not kept
+        :param url: address of the page
+        :param headers: headers of the response
+        :param digest: hash of the body
+        :param drugs: dictionary of drugs {'drug_name':'drug_url'}
+        :param fingerprint: fingerprint of the source that extracted drugs
+        """
+        with self._lock:
+            self.stats['misses'] += 1
+            self.stats['stores'] += 1
+            self.entries[url] = {'etag': headers.get('ETag'),
+                                 'last_modified': headers.get('Last-Modified'),
+                                 'digest': digest,
+                                 'fingerprint': fingerprint,
+                                 'drugs': drugs}
+            self.entries.move_to_end(url)
+            self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def stats_message(self):
+        return 'Response cache: {hits} hits, {unchanged} unchanged, {misses} misses, ' \
+               '{evictions} evictions'.format(**self.stats)
@@ -0,0 +1,43 @@
+"""
+Stand-in web server and source shared by tests of fetching and caching
+"""
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+
+from drug_sources.web_scraping_sources import Source
+
+
+class StandInServerTestCase(unittest.TestCase):
+    """
+    Serves handler on a local port for all tests of the class, base_url points to the server
+    """
+    handler = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), cls.handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class LinkSource(Source):
+    """
+    Source listing every link of the page as a drug, counts pages it parsed
+    """
+    def __init__(self, url):
+        Source.__init__(self)
+        self._url = url
+        self.extractions = 0
+
+    def extract_drugs(self, r):
+        self.extractions += 1
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(r, 'html.parser')
+        return {item.text: item.get('href') for item in soup.find_all('a')}
@@ -0,0 +1,193 @@
+import codecs
+import urllib.parse
+from html.parser import HTMLParser
+
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                           'source', 'track', 'wbr'])
+CHUNK_SIZE = 16 * 1024
+
+
+def matches(selector, tag, attrs):
+    """
+    Checks if element matches compiled selector, classes are matched the same way as in BeautifulSoup
+    :param selector: compiled selector {'name': tag, 'class_': class}
+    :param tag: tag of the element
+    :param attrs: dictionary of element attributes
+    :return: True if element matches
+    """
+    if selector['name'] != tag:
+        return False
+    if 'class_' not in selector:
+        return True
+    classes = attrs.get('class') or ''
+    return selector['class_'] == classes or selector['class_'] in classes.split()
+
+
+class StreamingExtractor(HTMLParser):
+    """
+    Incremental extractor for a compiled SourceDefinition.
+    Keeps only the open tags and the current item in memory and stops when the container closes.
+    """
+    def __init__(self, definition):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.definition = definition
+        self.stack = []
+        self.container_depth = None if definition.container is not None else 0
+        self.done = False
+        self.found = []
+        self.item = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+        depth = len(self.stack)
+        if self.container_depth is None:
+            if matches(self.definition.container, tag, attrs) and tag not in VOID_ELEMENTS:
+                self.container_depth = depth
+            return
+        if self.item is None:
+            if matches(self.definition.items, tag, attrs):
+                self.item = {'depth': depth, 'text': [], 'attrs': attrs, 'name': None, 'link': None}
+                self.start_parts(self.item['depth'], tag, attrs)
+                if tag in VOID_ELEMENTS:
+                    self.finish_item()
+            return
+        self.start_parts(depth, tag, attrs)
+
+    def start_parts(self, depth, tag, attrs):
+        item = self.item
+        if item['name'] is None and self.definition.name_selector is not None and depth > item['depth'] and \
+                matches(self.definition.name_selector, tag, attrs):
+            item['name'] = {'depth': depth, 'text': [], 'attrs': attrs, 'open': tag not in VOID_ELEMENTS}
+        if item['link'] is None and self.definition.link_selector is not None and depth > item['depth'] and \
+                matches(self.definition.link_selector, tag, attrs):
+            item['link'] = {'attrs': attrs}
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.done or tag not in self.stack:
+            return
+        while self.stack:
+            depth = len(self.stack)
+            closed = self.stack.pop()
+            if self.item is not None:
+                name = self.item['name']
+                if name is not None and name['open'] and depth == name['depth']:
+                    name['open'] = False
+                if depth == self.item['depth']:
+                    self.finish_item()
+            if self.container_depth is not None and self.container_depth > 0 and depth == self.container_depth:
+                self.done = True
+                return
+            if closed == tag:
+                return
+
+    def handle_data(self, data):
+        if self.item is None:
+            return
+        self.item['text'].append(data)
+        name = self.item['name']
+        if name is not None and name['open']:
+            name['text'].append(data)
+
+    def finish_item(self):
+        item, self.item = self.item, None
+        definition = self.definition
+        if definition.name_selector is None:
+            name_source = {'text': item['text'], 'attrs': item['attrs']}
+        else:
+            name_source = item['name']
+        if name_source is None:
+            return
+        if definition.name_attribute:
+            drug_name = name_source['attrs'].get(definition.name_attribute)
+        else:
+            drug_name = ''.join(name_source['text'])
+        if drug_name is None:
+            return
+        drug_name = definition.clean_name(drug_name)
+        if drug_name in definition.discard:
+            return
+        if definition.link_attribute is None:
+            drug_link = definition.url
+        else:
+            link_source = item if definition.link_selector is None else item['link']
+            if link_source is None:
+                return
+            drug_link = link_source['attrs'].get(definition.link_attribute)
+            if definition.link_base is not None:
+                drug_link = urllib.parse.urljoin(definition.link_base, drug_link)
+        self.found.append((drug_name, drug_link))
+
+    def close(self):
+        """
+        Finishes parsing, item left open by truncated document is closed with its parents
+        """
+        HTMLParser.close(self)
+        while self.item is not None and self.stack:
+            self.handle_endtag(self.stack[-1])
+
+    def iter_drugs(self, chunks, encoding='utf8'):
+        """
+        Feeds chunks of the document and yields drugs as soon as their items close
+        :param chunks: iterable of bytes or strings
+        :param encoding: encoding of bytes chunks
+        :return: generator of (drug_name, drug_link) tuples
+        """
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            self.feed(chunk)
+            for found in self.drain():
+                yield found
+            if self.done:
+                return
+        self.feed(decoder.decode(b'', final=True))
+        self.close()
+        for found in self.drain():
+            yield found
+        if self.container_depth is None:
+            raise AttributeError('Container {} not found for source {}'.format(self.definition.container,
+                                                                               self.definition.name))
+
+    def drain(self):
+        """
+        Takes drugs found since the last call
+        :return: list of (drug_name, drug_link) tuples
+        """
+        found, self.found = self.found, []
+        return found
+
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Reads file in chunks
+    :param path: path to the file
+    :param chunk_size: size of a single chunk in bytes
+    :return: generator of bytes chunks
+    """
+    with open(path, 'rb') as in_file:
+        while True:
+            chunk = in_file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_drugs(definition, chunks, encoding='utf8'):
+    """
+    Extracts drugs from document delivered in chunks, stops reading when the container closes
+    :param definition: SourceDefinition object
+    :param chunks: iterable of bytes or strings
+    :param encoding: encoding of bytes chunks
+    :return: dictionary of drugs {'drug_name':'drug_url'}
+    """
+    return dict(StreamingExtractor(definition).iter_drugs(chunks, encoding))
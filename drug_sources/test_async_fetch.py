@@ -0,0 +1,68 @@
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+from .web_scraping_sources import HTML_RetrievalFail
+from .async_fetch import get_fetcher
+from .stand_in import StandInServerTestCase, LinkSource
+
+PAGE = b'<html><body><ul><li><a href="/first">First Drug</a></li><li><a href="/second">Second Drug</a></li>' \
+       b'</ul></body></html>'
+DELAY = 0.3
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(DELAY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncFetch(StandInServerTestCase):
+    handler = StandInHandler
+
+    def test_get_drugs_async(self):
+        source = LinkSource(self.base_url + '/drugs')
+        scan = get_fetcher().run(source.get_drugs_async())
+        self.assertEqual(scan['drugs'], {'First Drug': '/first', 'Second Drug': '/second'})
+        self.assertIs(scan['source'], source)
+
+    def test_fetches_in_flight_at_once(self):
+        import asyncio
+        sources = [LinkSource('{}/drugs{}'.format(self.base_url, idx)) for idx in range(8)]
+
+        async def scan_all():
+            return await asyncio.gather(*[source.get_drugs_async() for source in sources])
+
+        started = time.time()
+        scans = get_fetcher().run(scan_all())
+        self.assertLess(time.time() - started, 4 * DELAY)
+        self.assertEqual(len(scans), 8)
+
+    def test_shared_event_loop(self):
+        self.assertIs(get_fetcher(), get_fetcher())
+
+    def test_deadline(self):
+        source = LinkSource(self.base_url + '/drugs')
+        source.timeout = DELAY / 3
+        started = time.time()
+        with self.assertRaises(HTML_RetrievalFail):
+            get_fetcher().run(source.get_drugs_async())
+        self.assertLess(time.time() - started, DELAY)
+
+    def test_connection_failure(self):
+        source = LinkSource('http://127.0.0.1:1/drugs')
+        with self.assertRaises(HTML_RetrievalFail):
+            get_fetcher().run(source.get_data_async(source.url))
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestAsyncFetch))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,59 @@
+import unittest
+
+from .drug_names import DrugNameIndex, load_name_index
+
+
+class TestDrugNames(unittest.TestCase):
+
+    def setUp(self):
+        self.names = DrugNameIndex(aliases={'Zantac': ['ranitidine'], 'Xarelto': ['rivaroxaban']},
+                                   suffix_tokens=['lawsuit', 'lawsuits', 'side effects'])
+
+    def test_case_punctuation_and_suffixes(self):
+        for name in ['Zantac', 'ZANTAC', ' zantac ', 'Zantac Lawsuit', 'Zantac - Lawsuits', 'Zantac®',
+                     'Zantac Side Effects Lawsuit']:
+            with self.subTest(name=name):
+                self.assertEqual(self.names.canonical(name), 'Zantac')
+
+    def test_aliases(self):
+        self.assertEqual(self.names.canonical('Ranitidine Lawsuit'), 'Zantac')
+        self.assertEqual(self.names.canonical('rivaroxaban'), 'Xarelto')
+
+    def test_unknown_names_become_canonical(self):
+        self.assertEqual(self.names.canonical('IVC  Filter Lawsuit'), 'IVC Filter')
+        self.assertEqual(self.names.canonical('ivc-filter'), 'IVC Filter')
+        self.assertEqual(self.names.canonical('Johnson & Johnson Talc'), 'Johnson & Johnson Talc')
+        self.assertEqual(self.names.canonical('Lawsuit'), 'Lawsuit')
+
+    def test_known_names_take_precedence(self):
+        names = DrugNameIndex(aliases={'Zantac': ['ranitidine']}, suffix_tokens=['lawsuit'],
+                              known_names=['Zantac Lawsuit', 'Actos ', 'ACTOS'])
+        self.assertEqual(names.canonical('ranitidine'), 'Zantac Lawsuit')
+        self.assertEqual(names.canonical('Actos'), 'Actos ')
+
+    def test_known_names_not_remapped_by_aliases(self):
+        names = DrugNameIndex(aliases={'Zantac': ['ranitidine']}, known_names=['ranitidine', 'Zantac'])
+        self.assertEqual(names.canonical('Ranitidine'), 'ranitidine')
+        self.assertEqual(names.canonical('zantac'), 'Zantac')
+
+    def test_renames_do_not_depend_on_order(self):
+        spellings = ['bard ivc filter', 'Bard IVC Filter Lawsuit', 'Bard IVC-Filter']
+        for ordered in (spellings, spellings[::-1]):
+            with self.subTest(first=ordered[0]):
+                names = DrugNameIndex(suffix_tokens=['lawsuit'], known_names=['Zantac'])
+                first = [names.canonical(name) for name in ordered + ['ZANTAC']]
+                self.assertEqual(len(set(first[:-1])), 1)
+                renames = names.renames()
+                self.assertEqual(renames.get(first[0], first[0]), 'Bard IVC Filter')
+                self.assertNotIn('Zantac', renames)
+
+    def test_alias_file(self):
+        names = load_name_index()
+        self.assertEqual(names.canonical('Pioglitazone Lawsuit'), 'Actos')
+        self.assertEqual(names.canonical('Elmiron Injuries'), 'Elmiron')
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestDrugNames))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
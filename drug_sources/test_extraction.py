@@ -0,0 +1,82 @@
+import unittest
+
+from .extraction import SourceDefinition, InvalidSourceDefinition, load_definitions
+from .parsers import make_soup
+from .web_scraping_sources import SOURCES_FILE, get_all_scraping_sources
+
+PAGES = {
+    'TorHoermanLawSource': (
+        '<html><body><div class="menu"><a href="/menu">Menu</a></div>'
+        '<div class="mainContent"><ul><li><a href="/xarelto/"> Xarelto </a></li>'
+        '<li><a href="https://other.com/taxotere">Taxotere</a></li><li><a>No Link</a></li></ul></div></body></html>',
+        {'Xarelto': 'https://www.torhoermanlaw.com/xarelto/',
+         'Taxotere': 'https://other.com/taxotere',
+         'No Link': 'https://www.torhoermanlaw.com/lawsuits/'}),
+    'TheJusticeSource': (
+        '<html><body><h3><a href="http://a.com/invokana">Invokana Lawsuit</a></h3><h3>No link</h3>'
+        '<h3><a href="http://a.com/zantac"> Zantac </a></h3></body></html>',
+        {'Invokana': 'http://a.com/invokana', 'Zantac': 'http://a.com/zantac'}),
+    'DrugLawsuitSource': (
+        '<html><body><table><tr><td class="column-1"><a href="http://a.com/actos">Actos </a></td>'
+        '<td class="column-2"><a href="http://a.com/other">Other</a></td></tr>'
+        '<tr><td class="column-1">Unlinked</td></tr></table></body></html>',
+        {'Actos ': 'http://a.com/actos'}),
+    'LevinLawSource': (
+        '<html><body><div class="one-third-column"><span> Talc </span></div>'
+        '<div class="one-third-column"><span>MAIN OFFICE</span></div>'
+        '<div class="one-third-column"><span>Click to Chat</span></div></body></html>',
+        {'Talc': 'https://www.levinlaw.com/drug-injuries'}),
+    'ClassActionSource': (
+        '<html><body><div class="blurb-wrapper" data-url="http://a.com/elmiron"><h4>Elmiron Lawsuit</h4></div>'
+        '<div class="blurb-wrapper" data-url="http://a.com/belviq"><h4>Belviq</h4></div></body></html>',
+        {'Elmiron': 'http://a.com/elmiron', 'Belviq': 'http://a.com/belviq'}),
+    'YouHaveALawyer': (
+        '<html><body><h4>Outside</h4><div class="flex-accordian"><h4>Risperdal</h4><h4>Abilify</h4></div>'
+        '</body></html>',
+        {'Risperdal': 'https://www.youhavealawyer.com/side-effects/',
+         'Abilify': 'https://www.youhavealawyer.com/side-effects/'}),
+    'ForTheInjured': (
+        '<html><body><div class="col-12 col-md-6 col-lg-4"><a title="Onglyza" href="/onglyza/">x</a></div>'
+        '<div class="col-12 col-md-6"><a title="Skipped" href="/skipped/">x</a></div></body></html>',
+        {'Onglyza': 'https://www.fortheinjured.com/onglyza/'}),
+}
+
+
+class TestExtraction(unittest.TestCase):
+
+    def test_sources_created_from_definitions(self):
+        definitions = load_definitions(SOURCES_FILE)
+        self.assertEqual(sorted(get_all_scraping_sources()), sorted(definitions))
+
+    def test_extract_layouts(self):
+        srcs = get_all_scraping_sources()
+        for name, (page, expected) in PAGES.items():
+            with self.subTest(name=name):
+                self.assertEqual(srcs[name]().extract_drugs(page), expected)
+
+    def test_missing_container(self):
+        source = get_all_scraping_sources()['YouHaveALawyer']()
+        self.assertRaises(AttributeError, source.extract_drugs, '<html><body><h4>Risperdal</h4></body></html>')
+
+    def test_invalid_definitions(self):
+        self.assertRaises(InvalidSourceDefinition, SourceDefinition, 'NoUrl', {'items': {'tag': 'a'}})
+        definition = {'url': 'http://a.com', 'test_file': 'a.html', 'display_name': 'A'}
+        self.assertRaises(InvalidSourceDefinition, SourceDefinition, 'NoItems', definition)
+        self.assertRaises(InvalidSourceDefinition, SourceDefinition, 'NoTag', dict(definition, items={'class': 'x'}))
+        self.assertRaises(InvalidSourceDefinition, SourceDefinition, 'BadJoin',
+                          dict(definition, items={'tag': 'a'}, link={'attribute': 'href', 'join': 'nowhere'}))
+
+    def test_new_source_is_data(self):
+        definition = SourceDefinition('NewFirm', {'url': 'http://new.com/drugs/', 'test_file': 'new.html',
+                                                  'display_name': 'New Firm', 'items': {'tag': 'li'},
+                                                  'name': {'strip_tokens': ['Injury'], 'strip': True},
+                                                  'link': {'selector': {'tag': 'a'}, 'attribute': 'href',
+                                                           'join': 'url'}})
+        soup = make_soup('<ul><li><a href="lipitor">Lipitor Injury</a></li></ul>', 'html.parser')
+        self.assertEqual(definition.extract(soup), {'Lipitor': 'http://new.com/drugs/lipitor'})
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestExtraction))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
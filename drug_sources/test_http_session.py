@@ -0,0 +1,157 @@
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+
+import requests
+
+from .extraction import SourceDefinition
+from .http_session import HttpSession, make_deadline, read_body
+from .stand_in import StandInServerTestCase, LinkSource
+from .web_scraping_sources import HTML_RetrievalFail, DeclarativeSource
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_count = Counter()
+
+    def do_GET(self):
+        self.requests_count[self.path] += 1
+        if self.path == '/drip':
+            # every chunk arrives well within the read timeout, the whole body does not
+            body = b'<html><a href="/drip">Drip</a></html>'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            for idx in range(len(body)):
+                self.wfile.write(body[idx:idx + 1])
+                self.wfile.flush()
+                time.sleep(0.05)
+            return
+        if self.path == '/endless':
+            # body without length, ends only when the client goes away
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            started = time.monotonic()
+            try:
+                self.wfile.write(b'<html><body><ul class="drugs">')
+                while time.monotonic() - started < 5:
+                    self.wfile.write(b''.join(b'<li><a href="/drug">Drug</a></li>' for _ in range(30)))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        if self.path == '/down' or (self.path == '/flaky' and self.requests_count[self.path] <= 2):
+            status, body = 503, b'unavailable'
+        else:
+            status, body = 200, b'<html></html>'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpSession(StandInServerTestCase):
+    handler = FlakyHandler
+
+    def setUp(self):
+        FlakyHandler.requests_count.clear()
+        self.session = HttpSession(backoff_factor=0.001, max_retries=3, retry_budget=4)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_retries_until_success(self):
+        r = self.session.get(self.base_url + '/flaky')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(FlakyHandler.requests_count['/flaky'], 3)
+        self.assertEqual(self.session.budget.remaining, 2)
+
+    def test_gives_up_after_max_retries(self):
+        r = self.session.get(self.base_url + '/down')
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(FlakyHandler.requests_count['/down'], 4)
+
+    def test_retry_budget_shared_by_run(self):
+        self.session.get(self.base_url + '/down')
+        self.session.get(self.base_url + '/down')
+        self.assertEqual(FlakyHandler.requests_count['/down'], 6)
+        self.session.reset_budget()
+        self.assertEqual(self.session.budget.remaining, 4)
+
+    def test_backoff_jitter(self):
+        session = HttpSession(backoff_factor=1, backoff_max=5)
+        for attempt in range(6):
+            delay = session.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2 ** attempt))
+
+    def test_deadline_stops_slow_body(self):
+        deadline = make_deadline(0.3)
+        r = self.session.get(self.base_url + '/drip', timeout=5, stream=True, deadline=deadline)
+        # the whole body arrives in a single chunk after deadline
+        self.assertRaises(requests.exceptions.Timeout, read_body, r, deadline)
+
+    def test_deadline_stops_endless_body(self):
+        deadline = make_deadline(0.3)
+        r = self.session.get(self.base_url + '/endless', timeout=5, stream=True, deadline=deadline)
+        started = time.monotonic()
+        self.assertRaises(requests.exceptions.Timeout, read_body, r, deadline)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_deadline_stops_retries(self):
+        session = HttpSession(max_retries=3)
+        # jitter could pick a delay that still fits before deadline
+        session.backoff = lambda attempt: 10
+        started = time.monotonic()
+        r = session.get(self.base_url + '/down', deadline=make_deadline(1))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(r.content, b'unavailable')
+        self.assertEqual(FlakyHandler.requests_count['/down'], 1)
+        session.close()
+
+    def test_body_read_before_deadline(self):
+        deadline = make_deadline(5)
+        r = self.session.get(self.base_url + '/flaky', stream=True, deadline=deadline)
+        self.assertEqual(read_body(r, deadline), b'<html></html>')
+        self.assertRaises(requests.exceptions.Timeout, self.session.get, self.base_url + '/flaky',
+                          deadline=time.monotonic() - 1)
+
+    def test_limit_timeout(self):
+        self.assertEqual(HttpSession.limit_timeout((10, 30), None), (10, 30))
+        self.assertLessEqual(max(HttpSession.limit_timeout((10, 30), make_deadline(2))), 2)
+        self.assertLessEqual(HttpSession.limit_timeout(1.5, make_deadline(5)), 1.5)
+
+    def test_source_deadline(self):
+        source = LinkSource(self.base_url + '/endless')
+        source.timeout = 0.3
+        started = time.monotonic()
+        self.assertRaises(HTML_RetrievalFail, source.get_drugs)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_streamed_source_deadline(self):
+        definition = SourceDefinition('EndlessSource', {
+            'url': self.base_url + '/endless', 'test_file': 'endless.html', 'display_name': 'Endless',
+            'container': {'tag': 'ul', 'class': 'drugs'}, 'items': {'tag': 'li'},
+            'link': {'selector': {'tag': 'a'}, 'attribute': 'href'}, 'stream': True})
+        source = type('EndlessSource', (DeclarativeSource,), {'_url': definition.url, 'definition': definition})()
+        source.timeout = 0.3
+        # a page cut off at deadline would miss drugs, they must not be reported as removed
+        self.assertRaises(HTML_RetrievalFail, source.get_drugs)
+
+    def test_connection_error_raised(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.session.get('http://127.0.0.1:1/')
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestHttpSession))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,88 @@
+import unittest
+
+from .registry import SourceRegistry, InvalidSource, select_entry_points
+from .web_scraping_sources import Source, registry, get_all_scraping_sources
+
+
+class PluginSource(Source):
+    _url = "http://plugin.example.com"
+
+
+class OtherPluginSource(Source):
+    _url = "http://other.example.com"
+
+
+class EntryPoint:
+
+    def __init__(self, name, loaded):
+        self.name = name
+        self.loaded = loaded
+
+    def load(self):
+        if isinstance(self.loaded, Exception):
+            raise self.loaded
+        return self.loaded
+
+
+class TestSourceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SourceRegistry(Source)
+
+    def test_builtin_sources_registered(self):
+        self.assertIn('DrugLawsuitSource', registry)
+        self.assertEqual(registry['DrugLawsuitSource'].__name__, 'DrugLawsuitSource')
+        self.assertEqual(sorted(get_all_scraping_sources()), sorted(registry.classes))
+
+    def test_register(self):
+        self.assertIs(self.registry.register(PluginSource), PluginSource)
+        self.assertIs(self.registry['PluginSource'], PluginSource)
+        self.registry.register(PluginSource)
+        self.assertRaises(InvalidSource, self.registry.register, type('PluginSource', (Source,), {}))
+        self.assertRaises(InvalidSource, self.registry.register, EntryPoint)
+        self.assertRaises(InvalidSource, self.registry.register, PluginSource())
+
+    def test_instance_cached(self):
+        self.registry.register(PluginSource)
+        self.assertIs(self.registry.instance('PluginSource'), self.registry.instance('PluginSource'))
+        self.assertRaises(KeyError, self.registry.instance, 'MissingSource')
+
+    def test_discover_once(self):
+        entry_points = [EntryPoint('plugin', PluginSource), EntryPoint('broken', ImportError('no module')),
+                        EntryPoint('others', [OtherPluginSource])]
+        self.registry.discover(entry_points)
+        self.assertEqual(sorted(self.registry.as_dict()), ['OtherPluginSource', 'PluginSource'])
+        self.registry.classes.clear()
+        self.registry.discover(entry_points)
+        self.assertEqual(self.registry.as_dict(), {})
+
+    def test_invalid_plugin_sources_skipped(self):
+        duplicate = type('PluginSource', (Source,), {})
+        entry_points = [EntryPoint('plugin', PluginSource), EntryPoint('duplicate', duplicate),
+                        EntryPoint('mixed', [EntryPoint, OtherPluginSource]), EntryPoint('function', len)]
+        with self.assertLogs('__main__', level='ERROR') as logs:
+            self.registry.discover(entry_points)
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(self.registry.as_dict(), {'PluginSource': PluginSource,
+                                                   'OtherPluginSource': OtherPluginSource})
+
+    def test_select_entry_points(self):
+        class EntryPoints(dict):
+            def select(self, group):
+                return self[group]
+
+        plugin = EntryPoint('plugin', PluginSource)
+        self.assertEqual(select_entry_points({'drug_alert.sources': [plugin]}, 'drug_alert.sources'), [plugin])
+        self.assertEqual(select_entry_points({}, 'drug_alert.sources'), [])
+        self.assertEqual(select_entry_points(EntryPoints({'drug_alert.sources': [plugin]}), 'drug_alert.sources'),
+                         [plugin])
+
+    def test_discover_disabled(self):
+        self.registry = SourceRegistry(Source, group=None)
+        self.assertRaises(KeyError, self.registry.__getitem__, 'PluginSource')
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestSourceRegistry))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
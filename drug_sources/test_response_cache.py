@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+from .web_scraping_sources import Source, DeclarativeSource
+from .response_cache import ResponseCache
+from .extraction import SourceDefinition
+from .stand_in import StandInServerTestCase, LinkSource
+
+PAGE = b'<html><body><a href="/first">First Drug</a></body></html>'
+ETAG = '"v1"'
+
+
+class ValidatingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/plain':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResponseCache(StandInServerTestCase):
+    handler = ValidatingHandler
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        Source.response_cache = None
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_not_modified_skips_parsing(self):
+        Source.response_cache = ResponseCache(self.cache_dir)
+        source = LinkSource(self.base_url + '/drugs')
+        first = source.get_drugs()
+        second = source.get_drugs()
+        self.assertEqual(first['drugs'], second['drugs'])
+        self.assertEqual(source.extractions, 1)
+        self.assertEqual(Source.response_cache.stats['hits'], 1)
+        self.assertEqual(Source.response_cache.stats['misses'], 1)
+
+    def test_cache_persisted(self):
+        Source.response_cache = ResponseCache(self.cache_dir)
+        LinkSource(self.base_url + '/drugs').get_drugs()
+        Source.response_cache.save()
+
+        Source.response_cache = ResponseCache(self.cache_dir)
+        source = LinkSource(self.base_url + '/drugs')
+        self.assertEqual(source.get_drugs()['drugs'], {'First Drug': '/first'})
+        self.assertEqual(source.extractions, 0)
+        self.assertEqual(os.listdir(self.cache_dir), [ResponseCache.index_name])
+
+    def test_unchanged_content_skips_parsing(self):
+        Source.response_cache = ResponseCache(self.cache_dir)
+        source = LinkSource(self.base_url + '/plain')
+        first = source.get_drugs()
+        second = source.get_drugs()
+        self.assertEqual(first['drugs'], second['drugs'])
+        self.assertEqual(source.extractions, 1)
+        self.assertEqual(Source.response_cache.stats['unchanged'], 1)
+        self.assertEqual(Source.response_cache.stats['hits'], 0)
+
+    def test_changed_content_parsed(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.store('http://a', {}, cache.digest(b'first'), {'A': 'http://a'}, 'v1')
+        self.assertEqual(cache.unchanged('http://a', cache.digest(b'first'), 'v1'), {'A': 'http://a'})
+        self.assertIsNone(cache.unchanged('http://a', cache.digest(b'second'), 'v1'))
+        self.assertIsNone(cache.unchanged('http://b', cache.digest(b'first'), 'v1'))
+
+    def test_changed_fingerprint_is_miss(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.store('http://a', {'ETag': ETAG}, cache.digest(b'first'), {'A': 'http://a'}, 'v1')
+        self.assertIsNone(cache.unchanged('http://a', cache.digest(b'first'), 'v2'))
+        self.assertIsNone(cache.not_modified('http://a', 'v2'))
+        self.assertEqual(cache.conditional_headers('http://a', 'v2'), {})
+        self.assertEqual(cache.conditional_headers('http://a', 'v1'), {'If-None-Match': ETAG})
+
+    def test_changed_definition_extracts_again(self):
+        Source.response_cache = ResponseCache(self.cache_dir)
+        definition = {'url': self.base_url + '/drugs', 'test_file': 'drugs.html', 'display_name': 'Drugs',
+                      'items': {'tag': 'a'}}
+        old = type('Drugs', (DeclarativeSource,), {'_url': definition['url'],
+                                                   'definition': SourceDefinition('Drugs', definition)})
+        self.assertEqual(old().get_drugs()['drugs'], {'First Drug': definition['url']})
+        definition['name'] = {'attribute': 'href'}
+        new = type('Drugs', (DeclarativeSource,), {'_url': definition['url'],
+                                                   'definition': SourceDefinition('Drugs', definition)})
+        self.assertEqual(new().get_drugs()['drugs'], {'/first': definition['url']})
+        self.assertEqual(Source.response_cache.stats['hits'], 0)
+
+    def test_eviction(self):
+        cache = ResponseCache(self.cache_dir, max_entries=1)
+        cache.store('http://a', {'ETag': ETAG}, cache.digest(b'123456'), {'A': 'http://a'}, 'v1')
+        cache.store('http://b', {}, cache.digest(b'123456'), {'B': 'http://b'}, 'v1')
+        self.assertEqual(list(cache.entries), ['http://b'])
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.conditional_headers('http://a', 'v1'), {})
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestResponseCache))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+from .extraction import SourceDefinition, load_definitions
+from .streaming import StreamingExtractor, stream_drugs, iter_file_chunks
+
+SOURCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json')
+
+
+def chunked(page, size=7):
+    data = page.encode('utf8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestStreaming(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.definitions = load_definitions(SOURCES_FILE)
+
+    def test_items_in_table(self):
+        page = ('<html><body><table><tr><td class="column-1"><a href="http://a.com/actos">Actos </a></td>'
+                '<td class="column-2"><a href="http://a.com/other">Other</a></td></tr>'
+                '<tr><td class="column-1">Unlinked</td></tr></table></body></html>')
+        self.assertEqual(stream_drugs(self.definitions['DrugLawsuitSource'], chunked(page)),
+                         {'Actos ': 'http://a.com/actos'})
+
+    def test_nested_name_and_joined_link(self):
+        page = ('<html><body><div class="col-12 col-md-6 col-lg-4"><a title="Onglyza" href="/onglyza/">x</a>'
+                '</div><div class="col-12 col-md-6"><a title="Skipped" href="/skipped/">x</a></div></body></html>')
+        self.assertEqual(stream_drugs(self.definitions['ForTheInjured'], chunked(page)),
+                         {'Onglyza': 'https://www.fortheinjured.com/onglyza/'})
+
+    def test_stops_when_container_closes(self):
+        consumed = []
+
+        def chunks():
+            for chunk in ['<html><body><h4>Outside</h4><div class="flex-accordian"><div><h4>Risperdal</h4></div>',
+                          '<h4>Abilify</h4></div>', '<h4>After</h4>', '</body></html>']:
+                consumed.append(chunk)
+                yield chunk
+
+        drugs = stream_drugs(self.definitions['YouHaveALawyer'], chunks())
+        self.assertEqual(sorted(drugs), ['Abilify', 'Risperdal'])
+        self.assertEqual(len(consumed), 2)
+
+    def test_yields_items_as_they_close(self):
+        extractor = StreamingExtractor(self.definitions['YouHaveALawyer'])
+        found = extractor.iter_drugs(['<div class="flex-accordian"><h4>Risperdal</h4>', '<h4>Abili', 'fy</h4>'])
+        self.assertEqual(next(found)[0], 'Risperdal')
+        self.assertEqual(next(found)[0], 'Abilify')
+
+    def test_missing_container(self):
+        self.assertRaises(AttributeError, stream_drugs, self.definitions['YouHaveALawyer'],
+                          ['<html><body><h4>Risperdal</h4></body></html>'])
+
+    def test_multibyte_characters_split_between_chunks(self):
+        definition = SourceDefinition('Accents', {'url': 'http://a.com/', 'test_file': 'a.html',
+                                                  'display_name': 'A', 'items': {'tag': 'li'}})
+        page = '<ul><li>Zóloft</li><li>Paxil</li></ul>'
+        self.assertEqual(sorted(stream_drugs(definition, chunked(page, 1))), ['Paxil', 'Zóloft'])
+
+    def test_unclosed_item_at_end_of_document(self):
+        definition = SourceDefinition('Truncated', {'url': 'http://a.com/', 'test_file': 'a.html',
+                                                    'display_name': 'A', 'items': {'tag': 'li'}})
+        self.assertEqual(sorted(stream_drugs(definition, ['<ul><li>Zoloft</li><li>Paxil'])), ['Paxil', 'Zoloft'])
+
+    def test_file_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'page.html')
+            with open(path, 'wb') as out_file:
+                out_file.write(b'<div class="flex-accordian"><h4>Risperdal</h4></div>')
+            chunks = list(iter_file_chunks(path, chunk_size=8))
+            self.assertTrue(all(len(chunk) <= 8 for chunk in chunks))
+            self.assertEqual(stream_drugs(self.definitions['YouHaveALawyer'], iter_file_chunks(path)),
+                             {'Risperdal': 'https://www.youhavealawyer.com/side-effects/'})
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestStreaming))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
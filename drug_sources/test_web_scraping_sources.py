@@ -1,5 +1,11 @@
+import os
 import unittest
-from .web_scraping_sources import get_all_scraping_sources
+from benchmarks.datasets import drug_names, synthetic_page
+from .web_scraping_sources import get_all_scraping_sources, DeclarativeSource
+from .parsers import PARSER_ENV_VARIABLE, available_backends, make_soup
+from .streaming import CHUNK_SIZE, stream_drugs, iter_file_chunks
+
+AWKWARD_CHUNK_SIZES = [1, 7, 13, 4093]
 
 
 class TestScrapingSources(unittest.TestCase):
@@ -25,6 +31,56 @@ class TestOffline(TestScrapingSources):
                 self.assertIsNotNone(drugs)
 
 
+class TestParserParity(TestScrapingSources):
+
+    def test_backends_extract_identical_drugs(self):
+        for src in self.sources:
+            if not os.path.isfile(src.test_file):
+                with self.subTest(name=type(src)):
+                    self.skipTest('Missing test file {}, run UPDATE_TEST_FILES mode'.format(src.test_file))
+                continue
+            r = src.get_data(url=src.test_file, from_file=True)
+            src.parser_backend = 'html.parser'
+            expected = src.extract_drugs(r)
+            for backend in available_backends():
+                with self.subTest(name=type(src), backend=backend):
+                    src.parser_backend = backend
+                    self.assertEqual(src.extract_drugs(r), expected)
+            src.parser_backend = None
+
+    def test_requested_backend_available(self):
+        requested = os.environ.get(PARSER_ENV_VARIABLE)
+        if requested:
+            self.assertIn(requested, available_backends(),
+                          'Backend {} set in {} is not installed'.format(requested, PARSER_ENV_VARIABLE))
+
+    def streamed_sources(self):
+        return [src for src in self.sources if isinstance(src, DeclarativeSource) and src.definition.stream]
+
+    def test_streaming_matches_extract_on_test_files(self):
+        for src in self.streamed_sources():
+            with self.subTest(name=type(src)):
+                if not os.path.isfile(src.test_file):
+                    self.skipTest('Missing test file {}, run UPDATE_TEST_FILES mode'.format(src.test_file))
+                with open(src.test_file, 'rb') as in_file:
+                    expected = src.definition.extract(make_soup(in_file.read(), 'html.parser'))
+                for chunk_size in [CHUNK_SIZE] + AWKWARD_CHUNK_SIZES:
+                    with self.subTest(name=type(src), chunk_size=chunk_size):
+                        self.assertEqual(stream_drugs(src.definition, iter_file_chunks(src.test_file, chunk_size)),
+                                         expected)
+
+    def test_streaming_matches_extract_on_split_page(self):
+        drugs = {name: '/drugs/{}'.format(idx) for idx, name in enumerate(drug_names(40))}
+        for src in self.streamed_sources():
+            page = synthetic_page(src.definition, drugs)
+            expected = src.definition.extract(make_soup(page, 'html.parser'))
+            self.assertTrue(expected)
+            for chunk_size in AWKWARD_CHUNK_SIZES:
+                with self.subTest(name=type(src), chunk_size=chunk_size):
+                    chunks = [page[start:start + chunk_size] for start in range(0, len(page), chunk_size)]
+                    self.assertEqual(stream_drugs(src.definition, chunks), expected)
+
+
 class TestOnline(TestScrapingSources):
     # @unittest.skip("online tests disabled")
     def test_fetchdata_url(self):
@@ -44,4 +100,5 @@ if __name__ == '__main__':
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestOnline))
     test_suite.addTest(unittest.makeSuite(TestOffline))
+    test_suite.addTest(unittest.makeSuite(TestParserParity))
     unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -1,12 +1,22 @@
 import requests
 import time
-import urllib
-import sys
 import os
-import inspect
-from bs4 import BeautifulSoup
 import logging
 
+from drug_sources.extraction import load_definitions
+from drug_sources.http_session import get_session, make_deadline, until_deadline, read_body, HEADERS
+from drug_sources.registry import SourceRegistry
+from drug_sources.streaming import stream_drugs, iter_file_chunks, CHUNK_SIZE
+
+
+def hash_chunks(chunks, hasher):
+    """
+    Passes chunks through and updates hasher with every chunk
+    """
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
 
 class HTML_RetrievalFail(Exception):
     pass
@@ -21,6 +31,12 @@ class Source:
     _test_file = "None"
     _display_name = "None"
     _twitter_name = "None"
+    timeout = None
+    # time.monotonic() value after which downloading of the source fails, set by get_drugs from timeout
+    deadline = None
+    response_cache = None
+    parser_backend = None
+    streaming = False
 
     def __init__(self):
         self.logger = logging.getLogger('__main__')
@@ -28,10 +44,8 @@ class Source:
 
     def update_test_file(self):
         self.logger.info("Updating test file for source {}".format(self.display_name))
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.117 Safari/537.36'}
         self.logger.debug("Downloading HTML file")
-        r = requests.get(self.url, headers=headers).content
+        r = get_session().get(self.url, timeout=self.timeout).content
         directory = os.path.split(self.test_file)[0]
         try:
             os.makedirs(directory)
@@ -45,9 +59,10 @@ class Source:
         if not from_file:
             self.logger.debug('Getting data from url: {}'.format(url))
             try:
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.117 Safari/537.36'}
-                r = requests.get(url, headers=headers).content
-            except requests.exceptions.ConnectionError:
+                r = read_body(get_session().get(url, timeout=self.timeout, stream=True, deadline=self.deadline),
+                              self.deadline)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
                 raise HTML_RetrievalFail("Failed to get HTML from the web: {}".format(url))
         else:
             self.logger.debug('Getting data from file: {}'.format(url))
@@ -58,17 +73,156 @@ class Source:
                 raise HTML_RetrievalFail("Failed to get HTML from the file: {}".format(url))
         return r
 
-    def fetch_drugs_from_source(self, from_file=False):
+    async def get_data_async(self, url, from_file=False):
+        if from_file:
+            return self.get_data(url, from_file=True)
+        from drug_sources.async_fetch import get_fetcher, FetchFailed
+        timeout = self.timeout
+        if self.deadline is not None:
+            timeout = self.deadline - time.monotonic()
+            if timeout <= 0:
+                raise HTML_RetrievalFail("Deadline exceeded before request: {}".format(url))
+        try:
+            return await get_fetcher(HEADERS).fetch(url, timeout=timeout)
+        except FetchFailed:
+            raise HTML_RetrievalFail("Failed to get HTML from the web: {}".format(url))
+
+    def get_source_location(self, from_file=False):
+        if from_file:
+            return self.test_file
+        return self.url
+
+    def extract_drugs(self, r):
         raise NotImplementedError
 
+    def stream_drugs(self, chunks, encoding='utf8'):
+        raise NotImplementedError
+
+    def fetch_drugs_from_source(self, from_file=False):
+        if not from_file and self.response_cache is not None:
+            return self.fetch_drugs_from_cache()
+        if self.streaming:
+            return self.fetch_drugs_streaming(from_file)
+        r = self.get_data(self.get_source_location(from_file), from_file=from_file)
+        return self.extract_drugs(r)
+
+    def fetch_drugs_streaming(self, from_file=False):
+        url = self.get_source_location(from_file)
+        if from_file:
+            self.logger.debug('Streaming data from file: {}'.format(url))
+            try:
+                return self.stream_drugs(iter_file_chunks(url))
+            except FileNotFoundError:
+                raise HTML_RetrievalFail("Failed to get HTML from the file: {}".format(url))
+        self.logger.debug('Streaming data from url: {}'.format(url))
+        try:
+            r = get_session().get(url, timeout=self.timeout, stream=True, deadline=self.deadline)
+            try:
+                return self.stream_response(r)
+            finally:
+                r.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError):
+            raise HTML_RetrievalFail("Failed to get HTML from the web: {}".format(url))
+
+    def stream_response(self, r, hasher=None):
+        """
+        Extracts drugs while the response is downloaded
+        :param r: response requested with stream=True
+        :param hasher: hash object updated with every chunk that was read
+        :return: dictionary of drugs {'drug_name':'drug_url'}
+        """
+        encoding = r.encoding if 'charset' in r.headers.get('content-type', '') else 'utf8'
+        chunks = until_deadline(r.iter_content(CHUNK_SIZE), self.deadline)
+        if hasher is not None:
+            chunks = hash_chunks(chunks, hasher)
+        return self.stream_drugs(chunks, encoding)
+
+    def fetch_drugs_from_cache(self):
+        self.logger.debug('Getting data from url with validators: {}'.format(self.url))
+        try:
+            r = get_session().get(self.url, timeout=self.timeout, stream=True, deadline=self.deadline,
+                                  headers=self.response_cache.conditional_headers(self.url, self.fingerprint))
+            try:
+                if r.status_code == 304:
+                    drugs = self.response_cache.not_modified(self.url, self.fingerprint)
+                    if drugs is not None:
+                        self.logger.debug('Page not modified: {}'.format(self.url))
+                        return drugs
+                    r.close()
+                    r = get_session().get(self.url, timeout=self.timeout, stream=True, deadline=self.deadline)
+                if r.status_code != 200 and self.streaming:
+                    return self.stream_response(r)
+                if r.status_code != 200:
+                    return self.extract_drugs(read_body(r, self.deadline))
+                if self.streaming:
+                    return self.stream_drugs_if_changed(r)
+                return self.extract_drugs_if_changed(read_body(r, self.deadline), r.headers)
+            finally:
+                r.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError):
+            raise HTML_RetrievalFail("Failed to get HTML from the web: {}".format(self.url))
+
+    def stream_drugs_if_changed(self, r):
+        """
+        Extracts drugs while the response is downloaded and hashed, the page is never held in memory.
+        Streaming stops when the container closes, so the hash covers the part of the page that was read.
+        :param r: response requested with stream=True
+        :return: dictionary of drugs {'drug_name':'drug_url'}
+        """
+        hasher = self.response_cache.hasher()
+        drugs = self.stream_response(r, hasher)
+        digest = hasher.hexdigest()
+        if self.response_cache.unchanged(self.url, digest, self.fingerprint) is not None:
+            self.logger.debug('Page content not changed: {}'.format(self.url))
+            return drugs
+        self.response_cache.store(self.url, r.headers, digest, drugs, self.fingerprint)
+        return drugs
+
+    def extract_drugs_if_changed(self, r, headers=None):
+        digest = self.response_cache.digest(r)
+        drugs = self.response_cache.unchanged(self.url, digest, self.fingerprint)
+        if drugs is not None:
+            self.logger.debug('Page content not changed: {}'.format(self.url))
+            return drugs
+        drugs = self.extract_drugs(r)
+        self.response_cache.store(self.url, headers or {}, digest, drugs, self.fingerprint)
+        return drugs
+
     def get_drugs(self, from_file=False):
         self.logger.info("Reading drugs from {}".format(self.display_name))
-        response = dict()
+        self.deadline = make_deadline(self.timeout)
         try:
-            response["drugs"] = self.fetch_drugs_from_source(from_file)
+            drugs = self.fetch_drugs_from_source(from_file)
         except AttributeError:
             raise NoDrugsFound('Failed getting drugs for {}'.format(self.url))
-        self.logger.info("Got {} entries".format(len(response["drugs"])))
+        return self.make_scan(drugs)
+
+    async def get_drugs_async(self, from_file=False):
+        """
+        Reads drugs on the shared event loop within the same deadline as get_drugs. Pages are downloaded whole,
+        streaming extraction and conditional requests with validators of the response cache are not used,
+        cached drugs are only reused when the page content did not change.
+        :param from_file: True reads data from file instead of url
+        :return: scan dictionary
+        """
+        self.logger.info("Reading drugs asynchronously from {}".format(self.display_name))
+        self.deadline = make_deadline(self.timeout)
+        r = await self.get_data_async(self.get_source_location(from_file), from_file=from_file)
+        try:
+            if not from_file and self.response_cache is not None:
+                drugs = self.extract_drugs_if_changed(r)
+            else:
+                drugs = self.extract_drugs(r)
+        except AttributeError:
+            raise NoDrugsFound('Failed getting drugs for {}'.format(self.url))
+        return self.make_scan(drugs)
+
+    def make_scan(self, drugs):
+        self.logger.info("Got {} entries".format(len(drugs)))
+        response = dict()
+        response["drugs"] = drugs
         response["source"] = self
         response["ts"] = int(time.time())
         if len(response["drugs"]) == 0:
@@ -96,212 +250,64 @@ class Source:
     def name(self):
         return self.__class__.__name__
 
+    @property
+    def fingerprint(self):
+        """
+        Identifies how drugs are extracted, drugs cached by another extraction are extracted again
+        """
+        return '{}.{}'.format(self.__class__.__module__, self.__class__.__name__)
 
-class TorHoermanLawSource(Source):
-    _url = "https://www.torhoermanlaw.com/lawsuits/"
-    _test_file = "test_sites/torhoermanlaw/torhoermanlaw.html"
-    _display_name = "Tor Hoerman Law LLC"
-
-    def __init__(self):
-        Source.__init__(self)
-        pass
-
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        drugs = soup.find('div', class_="mainContent")
-        drugs = drugs.find_all('a')
-        for item in drugs:
-            drug_name = item.text.strip()
-            try:
-                drug_link = item.get("href")
-                drug_link = urllib.parse.urljoin(self.url, drug_link)
-            except AttributeError:
-                continue
-            drugs_dict[drug_name] = drug_link
-        return drugs_dict
-
-
-class TheJusticeSource(Source):
-    _url = "http://www.thejusticelawyer.com/practice-areas/detail/dangerous-drugs-medical-devices-list"
-    _test_file = "test_sites/thejustice/thejustice.html"
-    _display_name = "The Eichholz Law Firm, P.C."
-
-    def __init__(self):
-        Source.__init__(self)
-        pass
-
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        drugs = soup.find_all('h3')
-
-        for item in drugs:
-            drug_name = item.text.replace('Lawsuit', '').strip()
-            try:
-                drug_link = item.find('a').get("href")
-            except AttributeError:
-                continue
-            drugs_dict[drug_name] = drug_link
-        return drugs_dict
-
-
-class DrugLawsuitSource(Source):
-    _url = "https://www.druglawsuitsource.com/drugs/"
-    _test_file = "test_sites/druglawsuitsource/druglawsuitsource.html"
-    _display_name = "Buckfire & Buckfire, P.C"
-
-    def __init__(self):
-        Source.__init__(self)
-        pass
 
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        drugs = soup.find_all('td', class_="column-1")
+class DeclarativeSource(Source):
+    definition = None
 
-        for item in drugs:
-            drug_name = item.text
-            try:
-                drug_link = item.find('a').get("href")
-            except AttributeError:
-                continue
-            drugs_dict[drug_name] = drug_link
-        return drugs_dict
-
-
-class LevinLawSource(Source):
-    _url = "https://www.levinlaw.com/drug-injuries"
-    _test_file = "test_sites/levinlaw/levinlaw.html"
-    _display_name = "Levin Papantonio"
-    discarded = ['MAIN OFFICE', 'Click to Chat', 'Click for Free Evaluation']
     def __init__(self):
         Source.__init__(self)
         pass
 
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        drugs = soup.find_all('div', class_="one-third-column")
-        drugs = [item.find('span') for item in drugs]
-        drugs = [item.get_text().strip() for item in drugs]
-
-        for item in drugs:
-            if item not in self.discarded:
-                drugs_dict[item]=self.url
-            pass
-        return drugs_dict
-
-
-class ClassActionSource(Source):
-    _url = "https://www.classaction.com/lawsuits/drugs/"
-    _test_file = "test_sites/classaction/classaction.html"
-    _display_name = "Morgan & Morgan, PA"
+    def extract_drugs(self, r):
+        from drug_sources.parsers import make_soup
+        soup = make_soup(r, self.parser_backend)
+        return self.definition.extract(soup)
 
-    def __init__(self):
-        Source.__init__(self)
-        pass
+    def stream_drugs(self, chunks, encoding='utf8'):
+        return stream_drugs(self.definition, chunks, encoding)
 
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-
-        soup = BeautifulSoup(r, 'html.parser')
-        drug_entries = soup.find_all('div', class_="blurb-wrapper")
-
-        for item in drug_entries:
-            dr = item.find('h4').text.replace(' Lawsuit', '')
-            drugs_dict[dr] = item['data-url']
-        return drugs_dict
-
-
-class YouHaveALawyer(Source):
-    _url = "https://www.youhavealawyer.com/side-effects/"
-    _test_file = "test_sites/youhavealawyer/youhavealawyer.html"
-    _display_name = "Saiontz & Kirk, P.A."
-
-    def __init__(self):
-        Source.__init__(self)
-        pass
+    @property
+    def streaming(self):
+        return self.definition.stream
 
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        items = soup.find('div', class_="flex-accordian").find_all('h4')
-        drugs = [drug.text for drug in items]
-        for drug in drugs:
-            drugs_dict[drug] = self.url
-        return drugs_dict
+    @property
+    def fingerprint(self):
+        from drug_sources.parsers import get_parser_backend
+        return '{}:{}'.format(self.definition.fingerprint, self.parser_backend or get_parser_backend())
 
 
-class ForTheInjured(Source):
-    _url = "https://www.fortheinjured.com/class-action-lawyers/defective-drugs/"
-    _test_file = "test_sites/fortheinjured/fortheinjured.html"
-    _display_name = "Gordon & Doner, P.A."
+def create_declarative_sources(definitions):
+    srcs = dict()
+    for name, definition in definitions.items():
+        srcs[name] = type(name, (DeclarativeSource,), {'_url': definition.url,
+                                                       '_test_file': definition.test_file,
+                                                       '_display_name': definition.display_name,
+                                                       '_twitter_name': definition.twitter_name,
+                                                       'definition': definition,
+                                                       '__module__': __name__})
+    return srcs
 
-    def __init__(self):
-        Source.__init__(self)
-        pass
 
-    def fetch_drugs_from_source(self, from_file=False):
-        drugs_dict = {}
-        if from_file:
-            url = self.test_file
-        else:
-            url = self.url
-        r = self.get_data(url, from_file=from_file)
-        soup = BeautifulSoup(r, 'html.parser')
-        hits = soup.find_all('div', class_="col-12 col-md-6 col-lg-4")
-        for hit in hits:
-            drug_name = hit.find('a')['title']
-            drug_link = urllib.parse.urljoin("{0.scheme}://{0.netloc}/".format(urllib.parse.urlsplit(self.url)),
-                                              hit.find('a')['href'])
-            drugs_dict[drug_name] = drug_link
-        return drugs_dict
+SOURCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json')
+registry = SourceRegistry(Source)
+for _src_class in create_declarative_sources(load_definitions(SOURCES_FILE)).values():
+    globals()[_src_class.__name__] = registry.register(_src_class)
 
 
 def get_all_scraping_sources():
-    srcs = dict()
-    class_members = inspect.getmembers(sys.modules[__name__], inspect.isclass)
-    for name, scraping_class in class_members:
-        if issubclass(scraping_class, Source) and name != 'Source':
-            srcs[name] = scraping_class
-    return srcs
+    return registry.as_dict()
 
 
 def update_test_sources():
-    srcs = get_all_scraping_sources()
-    for src_class in srcs.values():
-        src_class().update_test_file()
+    for name in sorted(get_all_scraping_sources()):
+        registry.instance(name).update_test_file()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,422 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+import drugAlert
+from benchmarks import startup, publish, suite
+from drugAlert import DrugAlert
+from database.lawsuit_database import DrugsDb, DbHit, DbDrugSourceSummary
+from drug_sources.web_scraping_sources import Source, HTML_RetrievalFail, DrugLawsuitSource, YouHaveALawyer, \
+    DeclarativeSource, get_all_scraping_sources
+from drug_sources.extraction import SourceDefinition
+from drug_sources.response_cache import ResponseCache
+from drug_sources.stand_in import StandInServerTestCase
+
+
+class SlowSource(Source):
+    _url = "http://slow.example.com"
+    delay = 0.2
+
+    def fetch_drugs_from_source(self, from_file=False):
+        time.sleep(self.delay)
+        return {'Slow Drug': self.url}
+
+
+class FastSource(Source):
+    _url = "http://fast.example.com"
+    delay = 0
+
+    def fetch_drugs_from_source(self, from_file=False):
+        return {'Fast Drug': self.url}
+
+
+class EmptySource(Source):
+    _url = "http://empty.example.com"
+
+    def fetch_drugs_from_source(self, from_file=False):
+        return {}
+
+
+class BrokenSource(Source):
+    _url = "http://broken.example.com"
+
+    def fetch_drugs_from_source(self, from_file=False):
+        raise HTML_RetrievalFail("Failed to get HTML from the web: {}".format(self.url))
+
+
+class RunAlert(DrugAlert):
+    """
+    DrugAlert that runs on a database in db_path and does not log in to Twitter
+    """
+    def __init__(self, db_path):
+        DrugAlert.__init__(self)
+        self.db_path = db_path
+
+    def initialize_db(self, live=False, profile=None, merge_matches=False):
+        self.db = DrugsDb(db_name='run.db', db_path=self.db_path)
+        self.db.create_database()
+        self.session = self.db.create_session()
+
+    def initalize_twitter(self):
+        self.twitter = None
+
+    def initialize_response_cache(self):
+        Source.response_cache = ResponseCache(os.path.join(self.db_path, 'response_cache'))
+
+    def send_tweets(self, hits, live=False):
+        self.hits = hits
+
+
+class FailingEvaluation(RunAlert):
+    """
+    Run on a snapshot of run.db whose evaluation fails after the first scan
+    """
+    def initialize_db(self, live=False, profile=None, merge_matches=False):
+        RunAlert.initialize_db(self)
+        self.db.close_db()
+        self.db = DrugsDb(db_name='run.db', db_path=self.db_path, snapshot=True)
+        self.session = self.db.create_session()
+        self.closed = False
+        close_db = self.db.close_db
+
+        def close_and_record():
+            close_db()
+            self.closed = True
+        self.db.close_db = close_and_record
+
+    def evaluate_scans(self, scans):
+        next(iter(scans))
+        raise RuntimeError('database is locked')
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    page = b'<html><body><ul class="drugs"><li><a href="/actos">Actos</a></li><li><a href="/zantac">Zantac</a>' \
+           b'</li></ul><p>footer</p></body></html>'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamedSource(DeclarativeSource):
+
+    def extract_drugs(self, r):
+        raise AssertionError('Page of streamed source parsed as a whole')
+
+
+class TestDrugAlert(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        drugAlert.logger = logging.getLogger('__main__')
+
+
+class TestStreamSources(TestDrugAlert):
+
+    @staticmethod
+    def scan_sources(srcs, **kwargs):
+        errors = []
+        scans = list(DrugAlert.split_scan_results(DrugAlert.stream_sources(srcs, **kwargs), errors))
+        return scans, errors
+
+    def test_sources_fetched_concurrently(self):
+        srcs = {'SlowSource{}'.format(idx): type('SlowSource{}'.format(idx), (SlowSource,), {}) for idx in range(4)}
+        started = time.time()
+        scans, _ = self.scan_sources(srcs, workers=4)
+        self.assertLess(time.time() - started, 4 * SlowSource.delay)
+        self.assertEqual(len(scans), 4)
+        self.assertEqual(scans[0]['drugs'], {'Slow Drug': SlowSource._url})
+
+    def test_errors_collected(self):
+        srcs = {'EmptySource': EmptySource, 'BrokenSource': BrokenSource, 'FastSource': FastSource}
+        scans, errors = self.scan_sources(srcs, workers=3)
+        self.assertEqual([scan['source'].name for scan in scans], ['FastSource'])
+        self.assertEqual(sorted(errors), ['Failed to get HTML from the web: http://broken.example.com',
+                                          'No drugs found in scraping source http://empty.example.com'])
+
+    def test_timeout_passed_to_sources(self):
+        scans, _ = self.scan_sources({'FastSource': FastSource}, timeout=5)
+        self.assertEqual(scans[0]['source'].timeout, 5)
+
+    def test_results_in_completion_order(self):
+        srcs = {'SlowSource': SlowSource, 'FastSource': FastSource, 'BrokenSource': BrokenSource}
+        results = list(DrugAlert.stream_sources(srcs, workers=3))
+        self.assertEqual(results[-1][0].name, 'SlowSource')
+        self.assertIsInstance(dict((source.name, result) for source, result in results)['BrokenSource'],
+                              HTML_RetrievalFail)
+
+    def test_consumer_can_stop_early(self):
+        srcs = {'FastSource{}'.format(idx): type('FastSource{}'.format(idx), (FastSource,), {}) for idx in range(6)}
+        results = DrugAlert.stream_sources(srcs, workers=6, depth=1)
+        next(results)
+        results.close()
+
+    def test_failed_evaluation_stops_workers(self):
+        srcs = {'SlowSource{}'.format(idx): type('SlowSource{}'.format(idx), (SlowSource,), {'delay': 0.05})
+                for idx in range(6)}
+        db_path = tempfile.mkdtemp()
+        alert = FailingEvaluation(db_path)
+        try:
+            before = set(threading.enumerate())
+            started = time.time()
+            failure = None
+            try:
+                alert.run(live=False, from_file=True, workers=3, srcs=srcs)
+            except RuntimeError as e:
+                # traceback keeps frames of the run alive, as it does until an uncaught exception is printed
+                failure = e
+            self.assertIsNotNone(failure)
+            self.assertTrue(alert.closed)
+            self.assertLess(time.time() - started, 2)
+            # workers left running would keep the process from exiting
+            self.assertEqual([thread for thread in threading.enumerate()
+                              if thread not in before and thread.name.startswith('ThreadPoolExecutor')], [])
+        finally:
+            alert.db.close_db()
+            shutil.rmtree(db_path)
+
+    def test_split_scan_results(self):
+        errors = []
+        results = DrugAlert.stream_sources({'EmptySource': EmptySource, 'FastSource': FastSource}, workers=2)
+        scans = list(DrugAlert.split_scan_results(results, errors))
+        self.assertEqual([scan['source'].name for scan in scans], ['FastSource'])
+        self.assertEqual(errors, ['No drugs found in scraping source http://empty.example.com'])
+
+
+class TestRunWithResponseCache(StandInServerTestCase):
+    handler = ListingHandler
+
+    def setUp(self):
+        drugAlert.logger = logging.getLogger('__main__')
+        self.db_path = tempfile.mkdtemp()
+        definition = SourceDefinition('StreamedSource', {
+            'url': self.base_url + '/drugs', 'test_file': 'streamed.html', 'display_name': 'Streamed',
+            'container': {'tag': 'ul', 'class': 'drugs'}, 'items': {'tag': 'li'},
+            'link': {'selector': {'tag': 'a'}, 'attribute': 'href', 'join': 'url'}, 'stream': True})
+        self.srcs = {'StreamedSource': type('StreamedSource', (StreamedSource,), {'_url': definition.url,
+                                                                                  'definition': definition})}
+
+    def tearDown(self):
+        Source.response_cache = None
+        shutil.rmtree(self.db_path)
+
+    def run_alert(self):
+        alert = RunAlert(self.db_path)
+        alert.run(live=False, from_file=False, srcs=self.srcs)
+        return alert
+
+    def test_cache_miss_streamed(self):
+        alert = self.run_alert()
+        self.assertEqual(sorted(alert.hits), ['Actos', 'Zantac'])
+        self.assertEqual(Source.response_cache.stats['misses'], 1)
+        entry = Source.response_cache.entries[self.base_url + '/drugs']
+        self.assertEqual(entry['drugs'], {'Actos': self.base_url + '/actos', 'Zantac': self.base_url + '/zantac'})
+
+        self.run_alert()
+        self.assertEqual(Source.response_cache.stats['hits'], 1)
+
+
+class TestEvaluateScans(TestDrugAlert):
+
+    def setUp(self):
+        self.db_path = tempfile.mkdtemp()
+        self.alert = DrugAlert()
+        self.alert.db = DrugsDb(db_name='evaluate.db', db_path=self.db_path)
+        self.alert.db.create_database()
+        self.alert.session = self.alert.db.create_session()
+
+    def tearDown(self):
+        self.alert.session.close()
+        self.alert.db.close_db()
+        shutil.rmtree(self.db_path)
+
+    def scan(self, ts, *sources):
+        scans = [{'drugs': drugs, 'source': source, 'ts': ts} for source, drugs in sources]
+        return self.alert.evaluate_postprocessed_scans(DrugAlert.postprocess_scans(scans))
+
+    def test_new_and_known_hits(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        new_hits = self.scan(1, (first, {'Actos': 'a', 'Zantac': 'z'}))
+        self.assertEqual(new_hits['Actos'], {'first_hit': True, 'new_sources': [first], 'old_sources': []})
+
+        new_hits = self.scan(2, (first, {'Actos': 'a'}), (second, {'Actos': 'a', 'Zantac': 'z', 'Elmiron': 'e'}))
+        self.assertEqual(new_hits['Actos'], {'first_hit': False, 'new_sources': [second],
+                                             'old_sources': [DrugLawsuitSource]})
+        self.assertEqual(new_hits['Zantac'], {'first_hit': False, 'new_sources': [second],
+                                              'old_sources': [DrugLawsuitSource]})
+        self.assertEqual(new_hits['Elmiron'], {'first_hit': True, 'new_sources': [second], 'old_sources': []})
+
+        self.assertEqual(len(self.alert.hit_pairs), 5)
+
+        new_hits = self.scan(3, (first, {'Actos': 'a', 'Zantac': 'z', 'Elmiron': 'e'}),
+                             (second, {'Actos': 'a', 'Zantac': 'z', 'Elmiron': 'e'}))
+        self.assertEqual(new_hits, {'Elmiron': {'first_hit': False, 'new_sources': [first],
+                                                'old_sources': [YouHaveALawyer]},
+                                    'Zantac': {'first_hit': False, 'new_sources': [],
+                                               'old_sources': [DrugLawsuitSource, YouHaveALawyer]}})
+
+    def test_unchanged_sources_add_no_hits(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        self.scan(1, (first, {'Actos': 'a', 'Zantac': 'z'}), (second, {'Actos': 'a'}))
+        hits = len(self.alert.db.query_all(DbHit, self.alert.session))
+
+        self.alert.hit_pairs = set()
+        self.assertEqual(self.scan(2, (first, {'Actos': 'a', 'Zantac': 'z'}), (second, {'Actos': 'a'})), {})
+        self.assertEqual(self.alert.hit_pairs, set())
+        self.assertEqual(len(self.alert.db.query_all(DbHit, self.alert.session)), hits)
+        summary = self.alert.db.query_all(DbDrugSourceSummary, self.alert.session)
+        self.assertEqual(sorted((item.last_ts, item.hit_count, item.present) for item in summary),
+                         [(2, 2, True)] * 3)
+
+    def test_removed_and_returning_drugs(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        self.scan(1, (first, {'Actos': 'a', 'Zantac': 'z'}))
+        self.scan(2, (first, {'Actos': 'a'}))
+        actos = self.alert.db.get_drug(self.alert.session, name='Actos').id
+        zantac = self.alert.db.get_drug(self.alert.session, name='Zantac').id
+        self.assertEqual(self.alert.db.get_present_drugs(self.alert.session, [1]), {1: {actos}})
+        new_hits = self.scan(3, (first, {'Actos': 'a', 'Zantac': 'z'}), (second, {'Zantac': 'z'}))
+        self.assertEqual(new_hits, {'Zantac': {'first_hit': False, 'new_sources': [second],
+                                               'old_sources': [DrugLawsuitSource]}})
+        self.assertEqual(self.alert.db.get_present_drugs(self.alert.session, [1])[1], {actos, zantac})
+
+    def test_streamed_scans_match_batch(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        self.scan(1, (first, {'Actos': 'a'}))
+        new_hits = self.alert.evaluate_scans([{'drugs': {'Actos': 'a', 'Zantac': 'z'}, 'source': second, 'ts': 2},
+                                              {'drugs': {'Zantac': 'z', 'Elmiron': 'e'}, 'source': first, 'ts': 2}])
+        self.assertEqual(new_hits, {'Actos': {'first_hit': False, 'new_sources': [second],
+                                              'old_sources': [DrugLawsuitSource]},
+                                    'Zantac': {'first_hit': True, 'new_sources': [second, first], 'old_sources': []},
+                                    'Elmiron': {'first_hit': True, 'new_sources': [first], 'old_sources': []}})
+
+    def test_names_normalized_before_evaluation(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        self.scan(1, (first, {'Invokana Lawsuit': 'i'}))
+        new_hits = self.alert.evaluate_scans([{'drugs': {'Zantac Lawsuit': 'z', 'INVOKANA': 'i'}, 'source': second,
+                                               'ts': 2},
+                                              {'drugs': {'ranitidine': 'r', 'Zantac': 'z'}, 'source': first, 'ts': 2}])
+        self.assertEqual(sorted(new_hits), ['Invokana Lawsuit', 'Zantac'])
+        self.assertEqual(new_hits['Zantac']['new_sources'], [second, first])
+        self.assertEqual(sorted(self.alert.db.get_drug_names(self.alert.session)), ['Invokana Lawsuit', 'Zantac'])
+
+    def test_new_drug_names_do_not_depend_on_order(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        scans = [{'drugs': {'bard ivc filter': 'b'}, 'source': first, 'ts': 1},
+                 {'drugs': {'Bard IVC Filter Lawsuit': 'b'}, 'source': second, 'ts': 1}]
+        new_hits = self.alert.evaluate_scans(scans)
+        self.assertEqual(self.alert.db.get_drug_names(self.alert.session), ['Bard IVC Filter'])
+        self.assertEqual(new_hits['Bard IVC Filter']['new_sources'], [first, second])
+
+    def test_diff_hits(self):
+        first, second = DrugLawsuitSource(), YouHaveALawyer()
+        hits = [('A', first, 5, 'a'), ('B', first, 5, 'b'), ('B', second, 6, 'b')]
+        added, seen, removed = DrugAlert.diff_hits(hits, {'A': 1, 'B': 2}, {first.name: 1, second.name: 2},
+                                                   {1: {1, 3}, 2: set()})
+        self.assertEqual(added, [('B', first, 5), ('B', second, 6)])
+        self.assertEqual(seen, {(1, 5): [1]})
+        self.assertEqual(removed, {1: [3]})
+
+
+class TestSendDmIfError(unittest.TestCase):
+
+    class Publisher:
+
+        def __init__(self):
+            self.messages = []
+
+        def dm(self, recipient, text):
+            self.messages.append((recipient, text))
+
+    class Twitter:
+        admin_profile = '@admin'
+
+        @staticmethod
+        def admin_fix_me_message(reason):
+            return 'fix: ' + reason
+
+    def test_single_message(self):
+        alert = DrugAlert()
+        alert.twitter, alert.publisher = self.Twitter(), self.Publisher()
+        alert.send_dm_if_error([None])
+        self.assertEqual(alert.publisher.messages, [])
+        alert.send_dm_if_error(['first', None, 'second'])
+        self.assertEqual(alert.publisher.messages, [('@admin', 'fix: first\nsecond')])
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_startup_skips_heavy_modules(self):
+        costs, imported = startup.measure([])
+        self.assertIn('drugAlert', costs)
+        self.assertEqual(sorted(set(startup.HEAVY_MODULES) & imported), [])
+
+    def test_sources_skip_fetching_and_parsing_modules(self):
+        _, imported = startup.measure(startup.MODES['UPDATE_TEST_FILES'])
+        self.assertEqual(sorted({'asyncio', 'bs4', 'lxml', 'drug_sources.async_fetch', 'drug_sources.parsers'} &
+                                imported), [])
+
+    def test_parse_importtime(self):
+        output = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:        10 |         10 |   queue\n'
+                  'import time:        30 |         40 | drugAlert\n')
+        self.assertEqual(startup.parse_importtime(output), [('queue', 1, 10, 10), ('drugAlert', 0, 30, 40)])
+
+
+class TestPublishBenchmark(unittest.TestCase):
+
+    def test_every_drug_tweeted(self):
+        result = publish.run_benchmark(sources=2, drugs=20, overlap=0.5)
+        self.assertEqual(result['drugs'], 30)
+        self.assertEqual(result['tweets'], 30)
+        self.assertEqual(result['left'], 0)
+        self.assertEqual(result['messages'], 0)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_every_case_runs(self):
+        results = suite.run_suite(hits=[1000], items=[20], repeat=1)['results']
+        for name in suite.DB_CASES:
+            self.assertIn('db/{}/1000'.format(name), results)
+        for name in get_all_scraping_sources():
+            self.assertIn('parse/{}/stream/20'.format(name), results)
+
+    def test_select(self):
+        results = suite.run_suite(hits=[1000], items=[20], repeat=1, select='db/add_hits|/stream/')['results']
+        self.assertIn('db/add_hits/1000', results)
+        self.assertNotIn('db/match_drugs/1000', results)
+        self.assertNotIn('parse/ClassActionSource/extract-html.parser/20', results)
+
+    def test_compare(self):
+        baseline = {'results': {'slower': 1.0, 'noise': 0.001, 'faster': 1.0, 'removed': 1.0}}
+        current = {'results': {'slower': 1.5, 'noise': 0.002, 'faster': 0.5, 'new': 1.0}}
+        self.assertEqual(suite.compare(baseline, current, threshold=0.25), [('slower', 1.0, 1.5)])
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestStreamSources))
+    test_suite.addTest(unittest.makeSuite(TestEvaluateScans))
+    test_suite.addTest(unittest.makeSuite(TestSendDmIfError))
+    test_suite.addTest(unittest.makeSuite(TestStartup))
+    test_suite.addTest(unittest.makeSuite(TestPublishBenchmark))
+    test_suite.addTest(unittest.makeSuite(TestBenchmarkSuite))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,182 @@
+"""
+Local stand-in of the Twitter API used by tests and benchmarks.
+Emulates statuses/update, users/lookup and direct_messages/events/new with duplicate status (187),
+spam lock (326) and rate limit (88) errors, latency and rate limit headers.
+"""
+import json
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTwitterState:
+    """
+    State shared by all requests of the server
+    """
+    def __init__(self, latency=0, rate_limit=None, rate_window=15 * 60, spam_threshold=None, spam_window=60,
+                 spam_lock=60):
+        """
+        :param latency: seconds every response is delayed
+        :param rate_limit: number of requests to a single endpoint in rate_window, None disables the limit
+        :param rate_window: length of the rate limit window in seconds
+        :param spam_threshold: number of status updates in spam_window that locks the account, None disables locks
+        :param spam_window: length of the spam window in seconds
+        :param spam_lock: seconds the account stays locked
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.spam_threshold = spam_threshold
+        self.spam_window = spam_window
+        self.spam_lock = spam_lock
+        self.tweets = []
+        self.statuses = set()
+        self.messages = []
+        self.responses = Counter()
+        self.windows = dict()
+        self.recent_tweets = deque()
+        self.locked_until = 0
+        self._lock = threading.Lock()
+
+    def rate_limit_headers(self, endpoint):
+        """
+        Counts request in the window of the endpoint
+        :return: tuple (headers, True if limit is exceeded)
+        """
+        if self.rate_limit is None:
+            return {}, False
+        now = time.time()
+        reset, used = self.windows.get(endpoint, (now + self.rate_window, 0))
+        if now >= reset:
+            reset, used = now + self.rate_window, 0
+        used += 1
+        self.windows[endpoint] = (reset, used)
+        headers = {'x-rate-limit-limit': str(self.rate_limit),
+                   'x-rate-limit-remaining': str(max(self.rate_limit - used, 0)),
+                   'x-rate-limit-reset': str(int(reset) + 1)}
+        return headers, used > self.rate_limit
+
+    def post_status(self, text):
+        """
+        :return: tuple (status code, error code or None)
+        """
+        now = time.monotonic()
+        if now < self.locked_until:
+            return 403, 326
+        if text in self.statuses:
+            return 403, 187
+        if self.spam_threshold is not None:
+            while self.recent_tweets and self.recent_tweets[0] < now - self.spam_window:
+                self.recent_tweets.popleft()
+            if len(self.recent_tweets) >= self.spam_threshold:
+                self.locked_until = now + self.spam_lock
+                return 403, 326
+            self.recent_tweets.append(now)
+        self.tweets.append(text)
+        self.statuses.add(text)
+        return 200, None
+
+    def handle(self, method, endpoint, params, body):
+        """
+        :return: tuple (status code, headers, JSON body)
+        """
+        with self._lock:
+            headers, exceeded = self.rate_limit_headers(endpoint)
+            if exceeded:
+                status, payload = 429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+            elif endpoint == 'statuses/update' and method == 'POST':
+                status, code = self.post_status(params.get('status', ''))
+                payload = {'id': len(self.tweets), 'text': params.get('status')} if code is None else \
+                    {'errors': [{'code': code}]}
+            elif endpoint == 'users/lookup' and method == 'GET':
+                names = params.get('screen_name', '').split(',')
+                status, payload = 200, [{'id': zlib.crc32(name.lower().encode('utf8')), 'screen_name': name}
+                                        for name in names]
+            elif endpoint == 'direct_messages/events/new' and method == 'POST':
+                event = json.loads(body or '{}').get('event', {})
+                self.messages.append(event)
+                status, payload = 200, {'event': event}
+            else:
+                status, payload = 404, {'errors': [{'code': 34}]}
+            self.responses[(endpoint, status)] += 1
+        return status, headers, payload
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle's algorithm would delay every response
+    disable_nagle_algorithm = True
+
+    def respond(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.strip('/')
+        if endpoint.startswith('1.1/'):
+            endpoint = endpoint[len('1.1/'):]
+        if endpoint.endswith('.json'):
+            endpoint = endpoint[:-len('.json')]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8')
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(urllib.parse.parse_qsl(body))
+        state = self.server.state
+        if state.latency:
+            time.sleep(state.latency)
+        status, headers, payload = state.handle(method, endpoint, params, body)
+        content = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTwitterServer:
+    """
+    Fake Twitter API served on a background thread, base_url is passed to HttpTransport
+    """
+    def __init__(self, host='127.0.0.1', port=0, **kwargs):
+        """
+        :param kwargs: parameters of FakeTwitterState
+        """
+        self.server = ThreadingHTTPServer((host, port), FakeTwitterHandler)
+        self.server.daemon_threads = True
+        self.server.state = FakeTwitterState(**kwargs)
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def start(self):
+        # short poll interval lets stop return quickly
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from twitter.rate_limit import RATE_LIMIT_BACKOFF
+from twitter.twitter import TweetNotSent, TwitterError, DuplicateTweet, TwitterLockedForSpam, RateLimitExceeded
+
+logger = logging.getLogger('__main__')
+
+# Pause after the account is locked for spam, doubled on every lock in the same run
+SPAM_BACKOFF = 15 * 60
+
+
+class PublishQueue:
+    """
+    Persistent queue of tweets and direct messages waiting to be published.
+    Every change is saved, items that were not published are published by the next run.
+    """
+    def __init__(self, queue_file):
+        self.queue_file = queue_file
+        self.items = []
+        self.taken = set()
+        self.next_id = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.queue_file, 'r', encoding='utf8') as in_file:
+                self.items = json.load(in_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning('Publish queue {} is corrupted, starting with empty queue'.format(self.queue_file))
+            return
+        self.next_id = max((item['id'] for item in self.items), default=-1) + 1
+
+    def save(self):
+        directory = os.path.dirname(self.queue_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = self.queue_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as out_file:
+            json.dump(self.items, out_file)
+        os.replace(tmp_file, self.queue_file)
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, kind, text, recipient=None):
+        """
+        Appends item and saves the queue
+        :param kind: 'tweet' or 'dm'
+        :param text: text of the tweet or message
+        :param recipient: user name of the message recipient
+        :return: queued item
+        """
+        return self.put_many(kind, [text], recipient)[0]
+
+    def put_many(self, kind, texts, recipient=None):
+        """
+        Appends items of the same kind and saves the queue once
+        :return: list of queued items
+        """
+        with self._lock:
+            items = [{'id': self.next_id + idx, 'kind': kind, 'text': text, 'recipient': recipient}
+                     for idx, text in enumerate(texts)]
+            self.next_id += len(items)
+            self.items.extend(items)
+            self.save()
+        return items
+
+    def take(self, skip=()):
+        """
+        Takes the oldest item that is not being published
+        :param skip: ids of items and kinds of items that are not taken
+        :return: item or None
+        """
+        with self._lock:
+            for item in self.items:
+                if item['id'] not in self.taken and item['id'] not in skip and item['kind'] not in skip:
+                    self.taken.add(item['id'])
+                    return item
+        return None
+
+    def pending(self, skip=()):
+        """
+        :param skip: ids of items and kinds of items that are not taken
+        :return: True if take would return an item
+        """
+        with self._lock:
+            return any(item['id'] not in self.taken and item['id'] not in skip and item['kind'] not in skip
+                       for item in self.items)
+
+    def release(self, item):
+        """
+        Returns item to the queue, it will be published again
+        """
+        with self._lock:
+            self.taken.discard(item['id'])
+
+    def done(self, item):
+        """
+        Removes published or rejected item and saves the queue
+        """
+        with self._lock:
+            self.taken.discard(item['id'])
+            self.items = [queued for queued in self.items if queued['id'] != item['id']]
+            self.save()
+
+
+class Publisher:
+    """
+    Publishes queued tweets and direct messages on background threads, while the run goes on.
+    Requests are spaced by rate limiters of the Twitter object.
+    Locked account pauses publishing of tweets with doubled back-off, tweets are kept in the queue for the next
+    run when it is locked again. Items that failed for reasons other than rejection are kept for the next run too.
+    """
+    def __init__(self, twitter, queue, workers=1, spam_backoff=SPAM_BACKOFF, spam_retries=1):
+        """
+        :param twitter: Twitter object with tweet_limiter and dm_limiter
+        :param queue: PublishQueue object
+        :param workers: number of items published at the same time
+        :param spam_backoff: pause in seconds after the account is locked for spam for the first time
+        :param spam_retries: number of pauses before tweets are left for the next run
+        """
+        self.twitter = twitter
+        self.queue = queue
+        self.workers = workers
+        self.spam_backoff = spam_backoff
+        self.spam_retries = spam_retries
+        self.spam_locks = 0
+        self.skip = set()
+        self.errors = []
+        self.busy = 0
+        self.closing = False
+        self.deferred = {'tweet': threading.Event(), 'dm': threading.Event()}
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        """
+        Starts publishing, items left in the queue by previous runs are published first
+        """
+        if len(self.queue):
+            logger.info('{} items left by the previous run are waiting to be published'.format(len(self.queue)))
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self.work, name='publisher-{}'.format(idx), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def tweet(self, text):
+        self.tweet_all([text])
+
+    def tweet_all(self, texts):
+        self._put('tweet', texts)
+
+    def dm(self, recipient, text):
+        self._put('dm', [text], recipient)
+
+    def _put(self, kind, texts, recipient=None):
+        self.queue.put_many(kind, texts, recipient)
+        with self.condition:
+            self.condition.notify_all()
+
+    def _take(self):
+        with self.condition:
+            while True:
+                item = self.queue.take(self.skip)
+                if item is not None:
+                    self.busy += 1
+                    return item
+                if self.closing:
+                    return None
+                self.condition.wait()
+
+    def work(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            try:
+                self.publish(item)
+            finally:
+                with self.condition:
+                    self.busy -= 1
+                    self.condition.notify_all()
+
+    def publish(self, item):
+        """
+        Publishes a single item, waits for rate limiter first
+        :param item: queued item
+        """
+        tweet = item['kind'] == 'tweet'
+        limiter = self.twitter.tweet_limiter if tweet else self.twitter.dm_limiter
+        if not limiter.acquire(self.deferred[item['kind']]):
+            self.queue.release(item)
+            return
+        try:
+            if tweet:
+                self.twitter.post_tweet(item['text'])
+            else:
+                self.twitter.send_dm(item['recipient'], item['text'])
+        except DuplicateTweet:
+            logger.warning('Tweet already posted!')
+        except TwitterLockedForSpam:
+            self.locked_for_spam(limiter)
+            self.queue.release(item)
+            return
+        except RateLimitExceeded:
+            logger.warning('Rate limit exceeded, waiting for reset')
+            if not limiter.update(self.twitter.last_headers):
+                limiter.pause(RATE_LIMIT_BACKOFF)
+            self.queue.release(item)
+            return
+        except (TweetNotSent, TwitterError):
+            logger.error('Twitter rejected {}: {}'.format(item['kind'], item['text']))
+            self.errors.append('Twitter rejected {}'.format(item['kind']))
+        except Exception as e:
+            logger.error('Publishing {} failed, it is kept for the next run: {}'.format(item['kind'], e))
+            with self.condition:
+                self.skip.add(item['id'])
+            self.queue.release(item)
+            return
+        self.queue.done(item)
+
+    def locked_for_spam(self, limiter):
+        with self.condition:
+            self.spam_locks += 1
+            if self.spam_locks > self.spam_retries:
+                if 'tweet' not in self.skip:
+                    logger.error('Too many tweets resulted in spam, tweets are kept for the next run')
+                    self.errors.append('Twitter locked the account')
+                    self.defer('tweet')
+                return
+        backoff = self.spam_backoff * 2 ** (self.spam_locks - 1)
+        logger.error('Too many tweets resulted in spam, pausing tweets for {} seconds'.format(backoff))
+        limiter.pause(backoff)
+
+    def defer(self, kind):
+        """
+        Stops publishing items of one kind in this run, they are kept in the queue for the next run
+        :param kind: 'tweet' or 'dm'
+        """
+        with self.condition:
+            self.skip.add(kind)
+            self.deferred[kind].set()
+            self.condition.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Waits until every item that can be published in this run is published
+        :param timeout: maximum wait in seconds
+        :return: True if nothing is left to publish
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def drained():
+            return not self.busy and not self.queue.pending(self.skip)
+
+        with self.condition:
+            while not drained():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Publishes remaining items and stops threads, items not published before timeout are kept in the queue
+        :param timeout: maximum wait in seconds
+        :return: error messages of this run
+        """
+        drained = self.drain(timeout)
+        if not drained:
+            logger.warning('{} items are left for the next run'.format(len(self.queue)))
+            for kind in self.deferred:
+                self.defer(kind)
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        return self.errors
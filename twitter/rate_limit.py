@@ -0,0 +1,95 @@
+import threading
+import time
+
+# Twitter allows 300 status updates per 3 hours
+TWEET_RATE = 300 / (3 * 60 * 60)
+TWEET_BURST = 5
+DM_RATE = 1
+DM_BURST = 1
+# Pause after rate limit was exceeded without headers telling when it resets
+RATE_LIMIT_BACKOFF = 15 * 60
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads posting to the same endpoint.
+    Bucket is emptied when response headers report no remaining requests, until the limit resets.
+    """
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens, number of requests sent in a burst
+        :param clock: monotonic clock in seconds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = self.updated
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """
+        Takes a token if one is available
+        :return: 0 if token was taken, otherwise seconds until the next token is available
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, cancel=None):
+        """
+        Waits for a token
+        :param cancel: threading.Event that interrupts waiting
+        :return: True if token was taken, False if waiting was cancelled
+        """
+        cancel = cancel or threading.Event()
+        delay = self.delay()
+        while delay > 0:
+            if cancel.wait(delay):
+                return False
+            delay = self.delay()
+        return not cancel.is_set()
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens
+        :param seconds: length of the pause
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, now + seconds)
+
+    def update(self, headers):
+        """
+        Adjusts the bucket to x-rate-limit-remaining and x-rate-limit-reset headers of a response
+        :param headers: response headers, may miss rate limit headers
+        :return: True if headers held rate limit information
+        """
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if remaining > 0:
+            with self._lock:
+                self.tokens = min(self.tokens, remaining)
+            return True
+        try:
+            reset = float(headers['x-rate-limit-reset']) - time.time()
+        except (KeyError, TypeError, ValueError):
+            reset = RATE_LIMIT_BACKOFF
+        self.pause(max(reset, 0))
+        return True
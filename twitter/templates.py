@@ -0,0 +1,110 @@
+import re
+from string import Formatter
+
+# trailing punctuation is not a part of the link
+URL = re.compile(r'https?://\S*[^\s!?.,;:)\]\'"]')
+TWEET_LENGTH = 280
+URL_LENGTH = 23
+ELLIPSIS = '...'
+
+
+class InvalidTemplate(Exception):
+    pass
+
+
+def weighted_length(text, url_length=URL_LENGTH):
+    """
+    Length of text as counted by Twitter, every link counts as url_length characters
+    :param text: text of the tweet or its part
+    :param url_length: length of a link shortened by Twitter
+    :return: number of characters
+    """
+    return len(text) + sum(url_length - len(url) for url in URL.findall(text))
+
+
+class CompiledFormat:
+    """
+    Format string split once into literals and positional fields, length of the result is known before rendering
+    """
+    def __init__(self, pattern, url_length=URL_LENGTH):
+        self.pattern = pattern
+        self.literals = []
+        self.fields = []
+        for literal, field, spec, conversion in Formatter().parse(pattern):
+            self.literals.append(literal)
+            if field is None:
+                continue
+            if spec or conversion or not (field == '' or field.isdigit()):
+                raise InvalidTemplate('Only plain positional fields are supported: {}'.format(pattern))
+            self.fields.append(len(self.fields) if field == '' else int(field))
+        if len(self.literals) == len(self.fields):
+            self.literals.append('')
+        self.static_length = weighted_length(''.join(self.literals), url_length)
+
+    def length(self, lengths):
+        """
+        :param lengths: weighted lengths of values
+        :return: weighted length of rendered text
+        """
+        return self.static_length + sum(lengths[field] for field in self.fields)
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(values[field])
+            parts.append(literal)
+        return ''.join(parts)
+
+
+class TweetTemplate:
+    """
+    Variants of a tweet from the longest to the shortest, the longest variant that fits the limit is rendered.
+    When even the shortest variant is too long, the shrinkable value is cut.
+    """
+    def __init__(self, variants, shrink=0, url_length=URL_LENGTH, max_length=TWEET_LENGTH):
+        """
+        :param variants: format strings with positional fields, from the longest to the shortest
+        :param shrink: index of the value cut when no variant fits
+        :param url_length: length of a link shortened by Twitter
+        :param max_length: maximum length of the tweet
+        """
+        self.variants = [CompiledFormat(variant, url_length) for variant in variants]
+        self.shrink = shrink
+        self.url_length = url_length
+        self.max_length = max_length
+
+    @classmethod
+    def from_parts(cls, main, additional, **kwargs):
+        """
+        Template of the main part with optional additional part
+        """
+        return cls([main + additional, main], **kwargs)
+
+    def render(self, values):
+        """
+        :param values: values of positional fields
+        :return: text of the tweet, never longer than max_length
+        """
+        values = [str(value) for value in values]
+        lengths = [weighted_length(value, self.url_length) for value in values]
+        for variant in self.variants:
+            if variant.length(lengths) <= self.max_length:
+                return variant.render(values)
+        variant = self.variants[-1]
+        excess = variant.length(lengths) - self.max_length
+        value = values[self.shrink]
+        values[self.shrink] = value[:max(len(value) - excess - len(ELLIPSIS), 0)] + ELLIPSIS
+        text = variant.render(values)
+        if weighted_length(text, self.url_length) > self.max_length:
+            text = text[:self.max_length - len(ELLIPSIS)] + ELLIPSIS
+        return text
+
+
+def render_batch(templates, rows):
+    """
+    Renders tweets of many hits at once
+    :param templates: dictionary of TweetTemplate objects
+    :param rows: iterable of tuples (template_name, values)
+    :return: list of tweets
+    """
+    return [templates[name].render(values) for name, values in rows]
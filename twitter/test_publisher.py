@@ -0,0 +1,294 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from .publisher import Publisher, PublishQueue
+from .rate_limit import RateLimiter
+from .twitter import Twitter, UserIdCache, TwitterError, TweetNotSent, DuplicateTweet, TwitterLockedForSpam, \
+    RateLimitExceeded
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTwitter:
+    admin_profile = '@admin'
+
+    def __init__(self, failures=None, delay=0, rate=1000):
+        self.tweet_limiter = RateLimiter(rate, 10)
+        self.dm_limiter = RateLimiter(rate, 10)
+        self.last_headers = {}
+        self.failures = failures or {}
+        self.delay = delay
+        self.tweets = []
+        self.messages = []
+
+    def post_tweet(self, text):
+        time.sleep(self.delay)
+        failures = self.failures.get(text)
+        if failures:
+            raise failures.pop(0)
+        self.tweets.append(text)
+
+    def send_dm(self, username, message):
+        self.messages.append((username, message))
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers, content=b''):
+        self.status_code = status_code
+        self.headers = headers
+        self.response = self
+        self.content = content
+
+
+class FakeApi:
+
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def request(self, resource, params=None):
+        self.requests.append(resource)
+        if resource == 'users/lookup':
+            return FakeUsers()
+        return self.response
+
+
+class FakeUsers(FakeResponse):
+
+    def __init__(self):
+        FakeResponse.__init__(self, 200, {})
+
+    def json(self):
+        return [{'id': 42}]
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(rate=0.5, capacity=2, clock=self.clock)
+
+    def test_bucket(self):
+        self.assertEqual([self.limiter.delay(), self.limiter.delay()], [0, 0])
+        self.assertEqual(self.limiter.delay(), 2)
+        self.clock.now += 2
+        self.assertEqual(self.limiter.delay(), 0)
+        self.clock.now += 100
+        self.assertEqual([self.limiter.delay(), self.limiter.delay(), self.limiter.delay()], [0, 0, 2])
+
+    def test_headers(self):
+        self.assertFalse(self.limiter.update({}))
+        self.assertTrue(self.limiter.update({'x-rate-limit-remaining': '1'}))
+        self.assertEqual([self.limiter.delay(), self.limiter.delay()], [0, 2])
+        self.limiter.update({'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(time.time() + 60)})
+        self.assertAlmostEqual(self.limiter.delay(), 60, delta=1)
+
+    def test_cancel(self):
+        limiter = RateLimiter(rate=0.001, capacity=1)
+        self.assertTrue(limiter.acquire())
+        cancel = threading.Event()
+        threading.Timer(0.05, cancel.set).start()
+        self.assertFalse(limiter.acquire(cancel))
+
+
+class TestPublishQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue_file = os.path.join(self.directory.name, 'queue', 'publish_queue.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_survives_restart(self):
+        queue = PublishQueue(self.queue_file)
+        first = queue.put('tweet', 'first')
+        queue.put('dm', 'second', '@admin')
+        self.assertEqual(queue.take()['text'], 'first')
+        self.assertEqual(queue.take(skip={'dm'}), None)
+        queue.done(first)
+        queue = PublishQueue(self.queue_file)
+        self.assertEqual([item['text'] for item in queue.items], ['second'])
+        self.assertEqual(queue.put('tweet', 'third')['id'], 2)
+
+    def test_corrupted_file(self):
+        os.makedirs(os.path.dirname(self.queue_file))
+        with open(self.queue_file, 'w') as out_file:
+            out_file.write('[{')
+        self.assertEqual(len(PublishQueue(self.queue_file)), 0)
+
+
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue_file = os.path.join(self.directory.name, 'publish_queue.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def publisher(self, twitter, **kwargs):
+        publisher = Publisher(twitter, PublishQueue(self.queue_file), **kwargs)
+        publisher.start()
+        return publisher
+
+    def test_publish_in_background(self):
+        twitter = FakeTwitter(delay=0.05)
+        publisher = self.publisher(twitter)
+        started = time.monotonic()
+        for idx in range(5):
+            publisher.tweet('tweet {}'.format(idx))
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.assertEqual(publisher.close(timeout=5), [])
+        self.assertEqual(twitter.tweets, ['tweet {}'.format(idx) for idx in range(5)])
+        self.assertEqual(len(PublishQueue(self.queue_file)), 0)
+
+    def test_previous_run_first(self):
+        PublishQueue(self.queue_file).put('tweet', 'left')
+        twitter = FakeTwitter()
+        publisher = self.publisher(twitter)
+        publisher.tweet('new')
+        publisher.close(timeout=5)
+        self.assertEqual(twitter.tweets, ['left', 'new'])
+
+    def test_failures(self):
+        twitter = FakeTwitter({'duplicate': [DuplicateTweet()], 'rejected': [TweetNotSent()],
+                               'offline': [ConnectionError()]})
+        publisher = self.publisher(twitter)
+        for text in ['duplicate', 'rejected', 'offline', 'fine']:
+            publisher.tweet(text)
+        self.assertEqual(publisher.close(timeout=5), ['Twitter rejected tweet'])
+        self.assertEqual(twitter.tweets, ['fine'])
+        self.assertEqual([item['text'] for item in PublishQueue(self.queue_file).items], ['offline'])
+
+    def test_rate_limit_exceeded(self):
+        twitter = FakeTwitter({'limited': [RateLimitExceeded()]})
+        twitter.last_headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(time.time() + 0.1)}
+        publisher = self.publisher(twitter)
+        publisher.tweet('limited')
+        self.assertEqual(publisher.close(timeout=5), [])
+        self.assertEqual(twitter.tweets, ['limited'])
+
+    def test_spam_backoff(self):
+        twitter = FakeTwitter({'spam': [TwitterLockedForSpam()]})
+        publisher = self.publisher(twitter, spam_backoff=0.05)
+        started = time.monotonic()
+        publisher.tweet('spam')
+        publisher.tweet('next')
+        self.assertEqual(publisher.close(timeout=5), [])
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(twitter.tweets, ['spam', 'next'])
+
+    def test_spam_lock_keeps_tweets(self):
+        twitter = FakeTwitter({'spam': [TwitterLockedForSpam(), TwitterLockedForSpam()]})
+        publisher = self.publisher(twitter, spam_backoff=0.01)
+        publisher.tweet('spam')
+        publisher.tweet('next')
+        self.assertTrue(publisher.drain(timeout=5))
+        self.assertEqual(publisher.errors, ['Twitter locked the account'])
+        publisher.dm('@admin', 'locked')
+        publisher.close(timeout=5)
+        self.assertEqual(twitter.messages, [('@admin', 'locked')])
+        self.assertEqual([item['text'] for item in PublishQueue(self.queue_file).items], ['spam', 'next'])
+
+    def test_timeout_leaves_items(self):
+        twitter = FakeTwitter(rate=0.001)
+        twitter.tweet_limiter.tokens = 1
+        publisher = self.publisher(twitter)
+        publisher.tweet('first')
+        publisher.tweet('second')
+        self.assertFalse(publisher.drain(timeout=0.1))
+        publisher.defer('tweet')
+        publisher.dm('@admin', 'slow')
+        started = time.monotonic()
+        publisher.close(timeout=5)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(twitter.tweets, ['first'])
+        self.assertEqual(twitter.messages, [('@admin', 'slow')])
+        self.assertEqual([item['text'] for item in PublishQueue(self.queue_file).items], ['second'])
+
+
+class TestTwitterRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config_file = os.path.join(self.directory.name, 'twitter_auth.json')
+        with open(config_file, 'w') as out_file:
+            json.dump({'consumer_key': 'a', 'consumer_secret': 'b', 'token_key': 'c', 'token_secret': 'd',
+                       'admin_profile': '@admin'}, out_file)
+        self.twitter = Twitter(config_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_headers_update_limiter(self):
+        self.twitter._api = FakeApi(FakeResponse(200, {'x-rate-limit-remaining': '0',
+                                                       'x-rate-limit-reset': str(time.time() + 60)}))
+        self.twitter.post_tweet('text')
+        self.assertAlmostEqual(self.twitter.tweet_limiter.delay(), 60, delta=1)
+
+    def test_rate_limit_exceeded(self):
+        self.twitter._api = FakeApi(FakeResponse(429, {}))
+        self.assertRaises(RateLimitExceeded, self.twitter.post_tweet, 'text')
+        self.twitter._api = FakeApi(FakeResponse(403, {}, b'{"errors": [{"code": 185}]}'))
+        self.assertRaises(RateLimitExceeded, self.twitter.post_tweet, 'text')
+        self.twitter._api = FakeApi(FakeResponse(403, {}, b'{"errors": [{"code": 326}]}'))
+        self.assertRaises(TwitterLockedForSpam, self.twitter.post_tweet, 'text')
+
+
+class TestUserIdCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, 'user_ids.json')
+        config_file = os.path.join(self.directory.name, 'twitter_auth.json')
+        with open(config_file, 'w') as out_file:
+            json.dump({'consumer_key': 'a', 'consumer_secret': 'b', 'token_key': 'c', 'token_secret': 'd',
+                       'admin_profile': '@admin'}, out_file)
+        self.twitter = Twitter(config_file)
+        self.twitter._api = FakeApi(FakeResponse(200, {}))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_expiry(self):
+        clock = Clock()
+        cache = UserIdCache(self.cache_file, ttl=60, clock=clock)
+        cache.set('@Admin', 42)
+        self.assertEqual(UserIdCache(self.cache_file, clock=clock).get('admin'), 42)
+        clock.now += 61
+        self.assertIsNone(cache.get('@admin'))
+
+    def test_lookup_once(self):
+        self.twitter.send_dm('@admin', 'first')
+        self.twitter.send_dm('@admin', 'second')
+        self.assertEqual(self.twitter._api.requests.count('users/lookup'), 1)
+        self.assertEqual(UserIdCache(self.cache_file).get('@admin'), 42)
+
+    def test_failed_dm_invalidates(self):
+        self.twitter.user_cache.set('@admin', 7)
+        self.twitter._api = FakeApi(FakeResponse(403, {}))
+        self.assertRaises(TwitterError, self.twitter.send_dm, '@admin', 'message')
+        self.assertIsNone(UserIdCache(self.cache_file).get('@admin'))
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestRateLimiter))
+    test_suite.addTest(unittest.makeSuite(TestPublishQueue))
+    test_suite.addTest(unittest.makeSuite(TestPublisher))
+    test_suite.addTest(unittest.makeSuite(TestTwitterRateLimit))
+    test_suite.addTest(unittest.makeSuite(TestUserIdCache))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
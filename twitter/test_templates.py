@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+
+from .templates import CompiledFormat, TweetTemplate, InvalidTemplate, weighted_length, ELLIPSIS
+from .twitter import LawsuitsTwitter
+
+URL = 'https://www.drugsandlawsuits.example.com/lawsuits/very/long/path/to/the/page/'
+
+
+class FakeSource:
+
+    def __init__(self, display_name, url=URL):
+        self.display_name = display_name
+        self.url = url
+
+
+class TestTemplates(unittest.TestCase):
+
+    def test_weighted_length(self):
+        self.assertEqual(weighted_length('Follow {} now'.format(URL)), len('Follow  now') + 23)
+        self.assertEqual(weighted_length('no links'), len('no links'))
+
+    def test_compiled_length(self):
+        compiled = CompiledFormat('{} case by {}. Follow {}!')
+        values = ['Xarelto', 'Law Firm', URL]
+        text = compiled.render(values)
+        self.assertEqual(text, 'Xarelto case by Law Firm. Follow {}!'.format(URL))
+        self.assertEqual(compiled.length([weighted_length(value) for value in values]), weighted_length(text))
+        self.assertEqual(CompiledFormat('{1} {0}').render(['a', 'b']), 'b a')
+        self.assertRaises(InvalidTemplate, CompiledFormat, '{:>10}')
+        self.assertRaises(InvalidTemplate, CompiledFormat, '{name}')
+
+    def test_longest_variant_that_fits(self):
+        template = TweetTemplate.from_parts('{} case found!', ' Follow {} to learn more!', max_length=70)
+        self.assertEqual(template.render(['Xarelto', URL]), 'Xarelto case found! Follow {} to learn more!'.format(URL))
+        self.assertEqual(template.render(['X' * 30, URL]), 'X' * 30 + ' case found!')
+
+    def test_shrink(self):
+        template = TweetTemplate.from_parts('{} case found by {}!', ' Follow {}', shrink=0, max_length=40)
+        text = template.render(['X' * 50, 'Firm', URL])
+        self.assertEqual(len(text), 40)
+        self.assertTrue(text.endswith(ELLIPSIS + ' case found by Firm!'))
+        text = template.render(['Xarelto', 'F' * 50, URL])
+        self.assertEqual(len(text), 40)
+
+
+class TestPrepareTweets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config_file = os.path.join(self.directory.name, 'twitter_auth.json')
+        with open(config_file, 'w') as out_file:
+            json.dump({'consumer_key': 'a', 'consumer_secret': 'b', 'token_key': 'c', 'token_secret': 'd',
+                       'admin_profile': '@admin'}, out_file)
+        self.twitter = LawsuitsTwitter(config_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_templates(self):
+        first, second = FakeSource('First Firm'), FakeSource('Second Firm')
+        tweets = self.twitter.prepare_tweets({
+            'Xarelto': {'first_hit': True, 'new_sources': [first], 'old_sources': []},
+            'Zantac': {'first_hit': True, 'new_sources': [first, first], 'old_sources': []},
+            'Onglyza': {'first_hit': False, 'new_sources': [second], 'old_sources': [first]},
+            'Invokana': {'first_hit': False, 'new_sources': [first, first], 'old_sources': [second]},
+            'Elmiron': {'first_hit': False, 'new_sources': [], 'old_sources': [second]}})
+        self.assertEqual(tweets, [
+            'Xarelto case found! New #lawsuit by First Firm. Follow {} to learn more!'.format(URL),
+            'Zantac case found! New #lawsuit on 2 pages! First Firm is one of them, follow {} to learn more!'.format(
+                URL),
+            'Another law firm, Second Firm, started a case against Onglyza, totaling to 2 lawsuits. '
+            'Follow {} to learn more!'.format(URL),
+            'New law firms started case against Invokana, totaling to 3 lawsuits. '
+            'First Firm is one of them, follow {} to learn more!'.format(URL)])
+
+    def test_tweets_fit(self):
+        name = 'Drug ' * 70
+        sources = [FakeSource('Firm ' * 30)]
+        for first_hit, new_sources in [(True, sources), (True, sources * 2), (False, sources), (False, sources * 2)]:
+            with self.subTest(first_hit=first_hit, new_sources=len(new_sources)):
+                tweets = self.twitter.prepare_tweets({name: {'first_hit': first_hit, 'new_sources': new_sources,
+                                                             'old_sources': []}})
+                self.assertLessEqual(weighted_length(tweets[0]), 280)
+                self.assertIn('Drug', tweets[0])
+
+    def test_unknown_hit(self):
+        self.assertRaises(NotImplementedError, self.twitter.prepare_tweets,
+                          {'Xarelto': {'first_hit': None, 'new_sources': [], 'old_sources': []}})
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestTemplates))
+    test_suite.addTest(unittest.makeSuite(TestPrepareTweets))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
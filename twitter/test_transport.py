@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from .fake_server import FakeTwitterServer
+from .twitter import Twitter, DuplicateTweet, TwitterLockedForSpam, RateLimitExceeded
+
+
+class TestFakeTwitter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        self.directory.cleanup()
+
+    def twitter(self, **kwargs):
+        server = FakeTwitterServer(**kwargs).start()
+        self.servers.append(server)
+        config_file = os.path.join(self.directory.name, 'twitter_auth.json')
+        with open(config_file, 'w') as out_file:
+            json.dump({'consumer_key': 'a', 'consumer_secret': 'b', 'token_key': 'c', 'token_secret': 'd',
+                       'admin_profile': '@admin', 'api_url': server.base_url}, out_file)
+        return Twitter(config_file), server.state
+
+    def test_tweet(self):
+        twitter, state = self.twitter()
+        twitter.post_tweet('first')
+        self.assertRaises(DuplicateTweet, twitter.post_tweet, 'first')
+        self.assertEqual(state.tweets, ['first'])
+
+    def test_dm(self):
+        twitter, state = self.twitter()
+        twitter.send_dm('@admin', 'message')
+        twitter.send_dm('@admin', 'another')
+        self.assertEqual([event['message_create']['message_data']['text'] for event in state.messages],
+                         ['message', 'another'])
+        self.assertEqual(state.responses[('users/lookup', 200)], 1)
+
+    def test_spam_lock(self):
+        twitter, state = self.twitter(spam_threshold=2)
+        twitter.post_tweet('first')
+        twitter.post_tweet('second')
+        self.assertRaises(TwitterLockedForSpam, twitter.post_tweet, 'third')
+        self.assertRaises(TwitterLockedForSpam, twitter.post_tweet, 'fourth')
+        self.assertEqual(state.tweets, ['first', 'second'])
+
+    def test_rate_limit(self):
+        twitter, state = self.twitter(rate_limit=1)
+        twitter.post_tweet('first')
+        self.assertGreater(twitter.tweet_limiter.delay(), 60)
+        self.assertRaises(RateLimitExceeded, twitter.post_tweet, 'second')
+        self.assertEqual(state.responses[('statuses/update', 429)], 1)
+
+    def test_latency(self):
+        twitter, state = self.twitter(latency=0.05)
+        started = time.monotonic()
+        twitter.post_tweet('first')
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+if __name__ == "__main__":
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestFakeTwitter))
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
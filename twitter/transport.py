@@ -0,0 +1,65 @@
+import requests
+
+# HTTP method of every resource used by Twitter
+METHODS = {'statuses/update': 'POST',
+           'statuses/user_timeline': 'GET',
+           'statuses/destroy': 'POST',
+           'users/lookup': 'GET',
+           'direct_messages/events/new': 'POST'}
+
+
+class TransportResponse:
+    """
+    Response of HttpTransport with the part of TwitterAPI response interface used by Twitter
+    """
+    def __init__(self, response):
+        self.response = response
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    def json(self):
+        return self.response.json()
+
+    def __iter__(self):
+        return iter(self.response.json())
+
+
+class HttpTransport:
+    """
+    Sends requests of Twitter to another server implementing the same resources, e.g. FakeTwitterServer.
+    Used instead of TwitterAPI when twitter_auth.json has "api_url".
+    """
+    def __init__(self, base_url, timeout=30):
+        """
+        :param base_url: address of the server, without API version
+        :param timeout: timeout of a single request in seconds
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, resource, params=None):
+        """
+        :param resource: resource name as accepted by TwitterAPI, e.g. 'statuses/update' or 'statuses/destroy/:1'
+        :param params: dictionary of parameters or JSON string of the body
+        :return: TransportResponse object
+        """
+        path, _, resource_id = resource.partition('/:')
+        url = '{}/1.1/{}{}.json'.format(self.base_url, path, '/' + resource_id if resource_id else '')
+        method = METHODS.get(path, 'GET')
+        if isinstance(params, str):
+            kwargs = {'data': params.encode('utf8'), 'headers': {'Content-Type': 'application/json'}}
+        elif method == 'GET':
+            kwargs = {'params': params}
+        else:
+            kwargs = {'data': params}
+        return TransportResponse(self.session.request(method, url, timeout=self.timeout, **kwargs))
+
+    def close(self):
+        self.session.close()
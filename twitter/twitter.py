@@ -1,7 +1,12 @@
-from TwitterAPI import TwitterAPI
 import json
+import os
 import random
 import logging
+import time
+
+from twitter.rate_limit import RateLimiter, TWEET_RATE, TWEET_BURST, DM_RATE, DM_BURST
+from twitter.templates import TweetTemplate, render_batch, URL_LENGTH
+
 # https://github.com/geduldig/TwitterAPI/blob/master/examples
 
 
@@ -18,23 +23,119 @@ class DuplicateTweet(Exception):
 class TwitterLockedForSpam(Exception):
     pass
 
+class RateLimitExceeded(TweetNotSent):
+    pass
+
+
+class UserIdCache:
+    """
+    Persistent map of screen names to user ids, entries expire after ttl seconds
+    """
+    def __init__(self, cache_file, ttl=7 * 24 * 60 * 60, clock=time.time):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = dict()
+        self.logger = logging.getLogger('__main__')
+        self.load()
+
+    @staticmethod
+    def key(username):
+        return username.strip('@').lower()
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf8') as in_file:
+                self.entries = json.load(in_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            self.logger.warning('User id cache {} is corrupted, starting with empty cache'.format(self.cache_file))
+
+    def save(self):
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as out_file:
+            json.dump(self.entries, out_file)
+        os.replace(tmp_file, self.cache_file)
+
+    def get(self, username):
+        """
+        :param username: screen name, with or without @
+        :return: user id or None if it is not cached or expired
+        """
+        entry = self.entries.get(self.key(username))
+        if entry is None or self.clock() - entry['ts'] > self.ttl:
+            return None
+        return entry['id']
+
+    def set(self, username, user_id):
+        self.entries[self.key(username)] = {'id': user_id, 'ts': self.clock()}
+        self.save()
+
+    def invalidate(self, username):
+        if self.entries.pop(self.key(username), None) is not None:
+            self.save()
+
 
 class Twitter:
-    url_length = 23
+    url_length = URL_LENGTH
+    dm_length = 10000
 
-    def __init__(self, config_json_file):
+    def __init__(self, config_json_file, user_cache=None, transport=None):
+        """
+        :param config_json_file: path to JSON file with credentials and admin profile,
+                                 optional "api_url" sends requests to another server instead of Twitter
+        :param user_cache: UserIdCache object, user_ids.json next to config file by default
+        :param transport: object with TwitterAPI request method, used instead of TwitterAPI
+        """
         with open(config_json_file) as json_data_file:
             config_json = json.load(json_data_file)
-        self.api = TwitterAPI(config_json["consumer_key"],
-                              config_json["consumer_secret"],
-                              config_json["token_key"],
-                              config_json["token_secret"])
+        self.credentials = (config_json["consumer_key"],
+                            config_json["consumer_secret"],
+                            config_json["token_key"],
+                            config_json["token_secret"])
+        self._api = transport
+        if transport is None and config_json.get("api_url"):
+            from twitter.transport import HttpTransport
+            self._api = HttpTransport(config_json["api_url"])
         self.logger = logging.getLogger('__main__')
         self.admin_profile = config_json["admin_profile"]
+        self.tweet_limiter = RateLimiter(TWEET_RATE, TWEET_BURST)
+        self.dm_limiter = RateLimiter(DM_RATE, DM_BURST)
+        self.last_headers = {}
+        if user_cache is None:
+            user_cache = UserIdCache(os.path.join(os.path.dirname(os.path.abspath(config_json_file)), 'user_ids.json'))
+        self.user_cache = user_cache
+
+    @property
+    def api(self):
+        # TwitterAPI is imported on first request, runs that only prepare tweets never load it
+        if self._api is None:
+            from TwitterAPI import TwitterAPI
+            self._api = TwitterAPI(*self.credentials)
+        return self._api
+
+    def request(self, limiter, resource, params=None):
+        """
+        Sends request and adjusts rate limiter to rate limit headers of the response
+        :param limiter: RateLimiter of the endpoint
+        :return: response
+        """
+        r = self.api.request(resource, params)
+        self.last_headers = r.headers or {}
+        limiter.update(self.last_headers)
+        if r.status_code == 429:
+            self.logger.error("Rate limit exceeded for {}".format(resource))
+            raise RateLimitExceeded
+        return r
 
     def post_tweet(self, text):
+        """
+        Posts status update, callers are expected to wait for tweet_limiter first
+        :param text: text of the tweet
+        """
         self.logger.info("Posting tweet: {}".format(text))
-        r = self.api.request('statuses/update', {'status': text})
+        r = self.request(self.tweet_limiter, 'statuses/update', {'status': text})
         if r.status_code != 200:
             self.logger.error("Posting tweet failed with code {}".format(r.status_code))
             self.logger.error("Response content {}".format(r.response.content))
@@ -49,6 +150,9 @@ class Twitter:
             if code_error == 326:
                 self.logger.error('Twitter SPAM protection locked sending status updates.')
                 raise TwitterLockedForSpam
+            if code_error in (88, 185):
+                self.logger.error('Status update limit reached.')
+                raise RateLimitExceeded
             else:
                 self.logger.error('Error code {} not recognized'.format(code_error))
             raise TweetNotSent
@@ -71,6 +175,8 @@ class Twitter:
 
     def send_dm(self, username, message):
         user_id = self.get_user_id(username)
+        if user_id is None:
+            raise TwitterError
         event = {
             "event": {
                 "type": "message_create",
@@ -78,24 +184,31 @@ class Twitter:
                     "target": {"recipient_id": user_id},
                     "message_data": {"text": message}
                 }}}
-        r = self.api.request('direct_messages/events/new', json.dumps(event))
+        r = self.request(self.dm_limiter, 'direct_messages/events/new', json.dumps(event))
         if r.status_code != 200:
+            # cached id may belong to a deleted or renamed account
+            self.user_cache.invalidate(username)
             self.logger.error("Direct Message failed {}".format(r.status_code))
             self.logger.error("Response content {}".format(r.response.content))
             raise TwitterError
 
     def get_user_id(self, username):
+        user_id = self.user_cache.get(username)
+        if user_id is not None:
+            return user_id
         r = self.api.request('users/lookup', {'screen_name': username.strip('@')})
         if r.status_code == 200:
-            return r.json()[0]['id']
+            user_id = r.json()[0]['id']
+            self.user_cache.set(username, user_id)
+            return user_id
         self.logger.error("Getting User id failed with code {}".format(r.status_code))
         self.logger.error("Response content {}".format(r.response.content))
         return None
 
 
 class LawsuitsTwitter(Twitter):
-    def __init__(self, config_json_file):
-        Twitter.__init__(self, config_json_file)
+    def __init__(self, config_json_file, user_cache=None, transport=None):
+        Twitter.__init__(self, config_json_file, user_cache, transport)
         self.templates = {"new_drug_single_hit": {
                                                 "main": "{} case found! New #lawsuit by {}.",
                                                 "additional": " Follow {} to learn more!"},
@@ -110,59 +223,69 @@ class LawsuitsTwitter(Twitter):
                                                 "additional": " {} is one of them, follow {} to learn more!"}
                           }
 
+        # index of the drug name in values of every template, it is cut when no variant fits
+        shrink = {"old_drug_new_source": 1}
+        self.compiled = {name: TweetTemplate.from_parts(parts["main"], parts["additional"],
+                                                        shrink=shrink.get(name, 0), url_length=self.url_length)
+                         for name, parts in self.templates.items()}
+
+    @staticmethod
+    def template_name(hit_details):
+        """
+        :param hit_details: details of the drug hit
+        :return: name of the template or None if there is nothing to publish
+        """
+        new_sources = len(hit_details['new_sources'])
+        if hit_details['first_hit'] is True and new_sources > 0:
+            return "new_drug_single_hit" if new_sources == 1 else "new_drug_multiple_hits"
+        if hit_details['first_hit'] is False:
+            if new_sources == 0:
+                return None
+            return "old_drug_new_source" if new_sources == 1 else "old_drug_new_sources"
+        raise NotImplementedError(hit_details)
+
+    def template_values(self, name, lawsuit_name, hit_details):
+        """
+        :return: values of positional fields of the template
+        """
+        new_sources = hit_details['new_sources']
+        total = len(new_sources) + len(hit_details.get('old_sources', []))
+        if name == "new_drug_single_hit":
+            return [lawsuit_name, new_sources[0].display_name, new_sources[0].url]
+        if name == "old_drug_new_source":
+            return [new_sources[0].display_name, lawsuit_name, total, new_sources[0].url]
+        random_src = self.scramble_list(new_sources)[0]
+        if name == "new_drug_multiple_hits":
+            return [lawsuit_name, len(new_sources), random_src.display_name, random_src.url]
+        return [lawsuit_name, total, random_src.display_name, random_src.url]
+
+    def render_tweet(self, name, lawsuit_name, hit_details):
+        return self.compiled[name].render(self.template_values(name, lawsuit_name, hit_details))
+
     def get_new_drug_single_hit_tweet(self, lawsuit_name, hit_details):
-        source = hit_details['new_sources'][0]
-        tweet = self.templates["new_drug_single_hit"]["main"].format(lawsuit_name, source.display_name)
-        additional = self.templates["new_drug_single_hit"]["additional"].format(source.url)
-        if (len(tweet) + self.url_length + len(additional)) < 280:
-            return tweet + additional
-        return tweet
+        return self.render_tweet("new_drug_single_hit", lawsuit_name, hit_details)
 
     def get_new_drug_multiple_hits_tweet(self, lawsuit_name, hit_details):
-        tweet = self.templates["new_drug_multiple_hits"]["main"].format(lawsuit_name, len(hit_details['new_sources']))
-        random_src = self.scramble_list(hit_details['new_sources'])[0]
-        additional = self.templates["new_drug_multiple_hits"]["additional"].format(random_src.display_name, random_src.url)
-
-        return tweet + additional
+        return self.render_tweet("new_drug_multiple_hits", lawsuit_name, hit_details)
 
     def get_old_drug_new_source_tweet(self, lawsuit_name, hit_details):
-        source = hit_details['new_sources'][0]
-        tweet = self.templates["old_drug_new_source"]["main"].format(source.display_name,
-                                                             lawsuit_name,
-                                                             len(hit_details['new_sources']) + len(hit_details['old_sources']))
-        additional = self.templates["old_drug_new_source"]["additional"].format(source.url)
-        return tweet + additional
+        return self.render_tweet("old_drug_new_source", lawsuit_name, hit_details)
 
     def get_old_drug_new_sources_tweet(self, lawsuit_name, hit_details):
-        tweet = self.templates["old_drug_new_sources"]["main"].format(lawsuit_name,
-                                                                      len(hit_details['new_sources']) + len(hit_details['old_sources']))
-        random_src = self.scramble_list(hit_details['new_sources'])[0]
-        additional = self.templates["old_drug_new_sources"]["additional"].format(random_src.display_name,
-                                                                                   random_src.url)
-        return tweet + additional
+        return self.render_tweet("old_drug_new_sources", lawsuit_name, hit_details)
 
     def prepare_tweets(self, new_hits):
-        tweets = []
+        """
+        Renders tweets of all hits, every tweet fits the length limit
+        :param new_hits: dictionary {'drug_name': hit_details}
+        :return: list of tweets
+        """
+        rows = []
         for lawsuit_name, hit_details in new_hits.items():
-            if hit_details['first_hit'] is True and len(hit_details['new_sources']) == 1:
-                tweet = self.get_new_drug_single_hit_tweet(lawsuit_name, hit_details)
-
-            elif hit_details['first_hit'] is True and len(hit_details['new_sources']) != 1:
-                tweet = self.get_new_drug_multiple_hits_tweet(lawsuit_name, hit_details)
-
-            elif hit_details['first_hit'] is False and len(hit_details['new_sources']) == 1:
-                tweet = self.get_old_drug_new_source_tweet(lawsuit_name, hit_details)
-
-            elif hit_details['first_hit'] is False and len(hit_details['new_sources']) > 1:
-                tweet = self.get_old_drug_new_sources_tweet(lawsuit_name, hit_details)
-
-            elif hit_details['first_hit'] is False and len(hit_details['new_sources']) == 0:
-                continue
-            else:
-                print(hit_details)
-                raise NotImplementedError
-            tweets.append(tweet)
-        return tweets
+            name = self.template_name(hit_details)
+            if name is not None:
+                rows.append((name, self.template_values(name, lawsuit_name, hit_details)))
+        return render_batch(self.compiled, rows)
 
     @staticmethod
     def scramble_list(list_orig):
@@ -170,11 +293,14 @@ class LawsuitsTwitter(Twitter):
         random.shuffle(tmp)
         return tmp
 
-    def admin_fix_me_dm(self, reason=None):
+    def admin_fix_me_message(self, reason=None):
         message = "I'm broken, fix me. "
         if reason:
             message += reason
-        self.send_dm(self.admin_profile, message)
+        return message[:self.dm_length]
+
+    def admin_fix_me_dm(self, reason=None):
+        self.send_dm(self.admin_profile, self.admin_fix_me_message(reason))
 
 if __name__ == '__main__':
     pass